@@ -0,0 +1,103 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from gateway_metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTIONS
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Take a token. Returns 0 on success, otherwise the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Admission control for deploys, local to one gateway process.
+
+    - Each client gets a token bucket (rate limit).
+    - At most `max_concurrent` scheduler runs happen at once; the rest wait in line.
+    - When `max_queue` requests are already waiting, or a request waits longer than
+      `max_wait` seconds, it is shed with 429 and a Retry-After hint.
+    """
+
+    def __init__(self, client_rate: float = 20.0, client_burst: float = 40.0, max_concurrent: int = 4,
+                 max_queue: int = 64, max_wait: float = 2.0, max_clients: int = 10000):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        # Moving average of how long a scheduler run holds its slot, used for Retry-After
+        self._avg_run_seconds = 0.05
+
+    def check_rate(self, client_id: str) -> None:
+        """Charge one request to a client's bucket, or reject it with 429."""
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            self._buckets[client_id] = bucket
+            # Forget the least recently seen clients so memory stays bounded
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client_id)
+
+        wait = bucket.try_acquire()
+        if wait > 0:
+            self._reject("rate_limited", f"Rate limit exceeded for client {client_id}", wait)
+
+    @asynccontextmanager
+    async def scheduler_slot(self):
+        """Hold one of the scheduler slots, waiting in line or shedding the request."""
+        if self._waiting >= self.max_queue:
+            self._reject("queue_full", "Too many deploys waiting for the scheduler", self._estimated_wait())
+
+        self._waiting += 1
+        ADMISSION_QUEUE_DEPTH.set(self._waiting)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout", "Timed out waiting for the scheduler", self._estimated_wait())
+        finally:
+            self._waiting -= 1
+            ADMISSION_QUEUE_DEPTH.set(self._waiting)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._slots.release()
+            elapsed = time.perf_counter() - start
+            self._avg_run_seconds = 0.9 * self._avg_run_seconds + 0.1 * elapsed
+
+    def _estimated_wait(self) -> float:
+        """Rough time for the current line to drain."""
+        return (self._waiting + 1) * self._avg_run_seconds / self.max_concurrent
+
+    def _reject(self, reason: str, message: str, retry_after: float):
+        ADMISSION_REJECTIONS.labels(reason=reason).inc()
+        raise HTTPException(status_code=429, detail=message,
+                            headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
@@ -1,206 +1,573 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 import httpx
+from starlette.concurrency import run_in_threadpool
 from models.resource_usage import ResourceUsage
 from models.specs import Specs
 from models.resources import Resources
 from models.service import Service
+from models.service_instance import Status
+from models.placement_record import PlacementRecord
+from placement_index import PlacementIndex
+from worker_registry import WorkerDirectory
+from admission import AdmissionController
+from status_stream import StatusEventBroker, Subscription
+from inventory_view import InventoryView
+from worker_reconciler import DEPLOY_REQUEST, START_REQUEST, STOP_REQUEST, request_key
+from gateway_metrics import (ERRORS, IN_FLIGHT, REQUEST_LATENCY, mark_process_dead, observe_worker_rpc,
+                             render_metrics, stage_timer)
 
 import sys
 import os
 # Add the parent directory to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from storage_interface.storage_service_wrapper import EtcdStorage, StorageService
+from storage_interface.storage_service_wrapper import StorageFactory, StorageService
 # from ..storage_interface.storage_service_wrapper import EtcdStorage, StorageService
 
 from typing import Dict, Optional, List
 import uvicorn
 import json
 import argparse
-
-
-app = FastAPI(title="Container Management API")
+import asyncio
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+# Process-local state. With --workers every gateway process builds its own storage
+# client, HTTP pool and worker directory after it starts; none of it is shared
+# across a fork. The placement index has no cache of its own and the worker
+# directory follows storage through a watch, so all processes see the same data.
 storage_client = None
+placement_index = None
+worker_directory = None
+http_client = None
+admission_controller = None
+status_broker = None
+inventory_view = None
+state_pid = os.getpid()
+# Peer addresses allowed to name the client with X-Client-Id (from GATEWAY_TRUSTED_PROXIES)
+trusted_proxies = None
+
+def reset_if_forked():
+    """Drop any state inherited from a parent process so it is rebuilt in this one"""
+    global storage_client, placement_index, worker_directory, http_client, admission_controller, status_broker
+    global inventory_view, state_pid
+    if state_pid != os.getpid():
+        storage_client = None
+        placement_index = None
+        worker_directory = None
+        http_client = None
+        admission_controller = None
+        status_broker = None
+        inventory_view = None
+        state_pid = os.getpid()
+
+def get_storage_settings():
+    """Storage backend and connection options, taken from the environment so every process sees them"""
+    storage_type = os.environ.get("GATEWAY_STORAGE", "etcd")
+    if storage_type == "etcd":
+        return storage_type, {
+            "host": os.environ.get("GATEWAY_ETCD_HOST", "127.0.0.1"),
+            "port": int(os.environ.get("GATEWAY_ETCD_PORT", "2379"))
+        }
+    return storage_type, {}
+
+def get_dispatch_mode() -> str:
+    """
+    How start/stop reach the workers: "http" calls each worker's endpoint, "storage"
+    only writes the request keys and lets each worker's reconcile loop apply them
+    """
+    return os.environ.get("GATEWAY_DISPATCH", "http")
 
 def get_storage_client() -> StorageService:
     """Get or initialize storage client"""
     global storage_client
+    reset_if_forked()
     if storage_client is None:
-        # EtcdStorage constructor already handles connection
-        storage_client = EtcdStorage(host="127.0.0.1", port=2379)
+        storage_type, config = get_storage_settings()
+        storage_client = StorageFactory.create(storage_type, **config)
     return storage_client
 
-@app.post("/api/tasks/deploy")
-async def deploy_task(service: Service, storage: StorageService = Depends(get_storage_client)):
+def get_placement_index() -> PlacementIndex:
+    """Get or initialize the placement index"""
+    global placement_index
+    reset_if_forked()
+    if placement_index is None:
+        placement_index = PlacementIndex(get_storage_client())
+    return placement_index
+
+def get_worker_directory() -> WorkerDirectory:
+    """Get or initialize the in-memory worker directory"""
+    global worker_directory
+    reset_if_forked()
+    if worker_directory is None:
+        worker_directory = WorkerDirectory(get_storage_client())
+        worker_directory.start()
+    return worker_directory
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get or initialize the pooled HTTP client used to reach worker nodes"""
+    global http_client
+    reset_if_forked()
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(float(os.environ.get("GATEWAY_WORKER_TIMEOUT", "5.0"))),
+            limits=httpx.Limits(max_connections=int(os.environ.get("GATEWAY_MAX_CONNECTIONS", "100")),
+                                max_keepalive_connections=20)
+        )
+    return http_client
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Get or initialize deploy admission control. Every process keeps its own buckets,
+    so the per-client rate and burst are split between the GATEWAY_PROCESSES processes
+    and the gateway as a whole admits about the configured rate. The scheduler limits
+    (runs, queue, wait) protect each process and apply per process.
+    """
+    global admission_controller
+    reset_if_forked()
+    if admission_controller is None:
+        processes = max(int(os.environ.get("GATEWAY_PROCESSES", "1")), 1)
+        admission_controller = AdmissionController(
+            client_rate=float(os.environ.get("GATEWAY_DEPLOY_RATE", "20")) / processes,
+            client_burst=max(float(os.environ.get("GATEWAY_DEPLOY_BURST", "40")) / processes, 1.0),
+            max_concurrent=int(os.environ.get("GATEWAY_MAX_SCHEDULER_RUNS", "4")),
+            max_queue=int(os.environ.get("GATEWAY_MAX_DEPLOY_QUEUE", "64")),
+            max_wait=float(os.environ.get("GATEWAY_MAX_QUEUE_WAIT", "2.0"))
+        )
+    return admission_controller
+
+def get_status_broker() -> StatusEventBroker:
+    """Get or initialize the broker feeding status streams from storage events"""
+    global status_broker
+    reset_if_forked()
+    if status_broker is None:
+        status_broker = StatusEventBroker(get_storage_client())
+        status_broker.start()
+    return status_broker
+
+def get_inventory_view() -> InventoryView:
+    """Get or initialize the materialized cluster inventory served by the list endpoints"""
+    global inventory_view
+    reset_if_forked()
+    if inventory_view is None:
+        inventory_view = InventoryView(get_storage_client())
+        inventory_view.start()
+    return inventory_view
+
+def get_trusted_proxies() -> frozenset:
+    global trusted_proxies
+    if trusted_proxies is None:
+        trusted_proxies = frozenset(host.strip() for host in os.environ.get("GATEWAY_TRUSTED_PROXIES", "").split(",")
+                                    if host.strip())
+    return trusted_proxies
+
+def get_client_id(request: Request) -> str:
+    """
+    Identify the caller for rate limiting: its peer address. X-Client-Id is only taken
+    from a trusted proxy, which sets it from the identity it authenticated; from anyone
+    else it is ignored, since rotating it would dodge the limit.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if peer in get_trusted_proxies():
+        client_id = request.headers.get("X-Client-Id")
+        if client_id:
+            return client_id
+    return peer
+
+@asynccontextmanager
+async def process_lifespan(app: FastAPI):
+    """Build this process's storage client, worker directory and HTTP pool before serving"""
+    get_storage_client()
+    get_placement_index()
+    get_worker_directory()
+    get_http_client()
+    get_admission_controller()
+    get_status_broker()
+    get_inventory_view()
+    print(f"Gateway process {os.getpid()} initialized")
+    yield
+    # Release this process's connections
+    if http_client is not None:
+        await http_client.aclose()
+    if worker_directory is not None:
+        worker_directory.stop()
+    if status_broker is not None:
+        status_broker.stop()
+    if inventory_view is not None:
+        inventory_view.stop()
+    mark_process_dead(os.getpid())
+
+app = FastAPI(title="Container Management API", lifespan=process_lifespan)
+
+DEPLOY_ENDPOINT = "/api/tasks/deploy"
+START_ENDPOINT = "/api/tasks/start/{task_name}"
+STOP_ENDPOINT = "/api/tasks/stop/{task_name}"
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record latency, in-flight count and errors for every request"""
+    start = time.perf_counter()
+    IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        IN_FLIGHT.dec()
+        # Label by route template so /start/{task_name} is one series, not one per task
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        REQUEST_LATENCY.labels(method=request.method, endpoint=endpoint, status=str(status)).observe(
+            time.perf_counter() - start)
+        if status >= 500:
+            ERRORS.labels(endpoint=endpoint, stage="request").inc()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this gateway"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.post(DEPLOY_ENDPOINT)
+async def deploy_task(service: Service, request: Request, storage: StorageService = Depends(get_storage_client),
+                      placement: PlacementIndex = Depends(get_placement_index),
+                      directory: WorkerDirectory = Depends(get_worker_directory),
+                      admission: AdmissionController = Depends(get_admission_controller)):
     """Deploy a new task to a worker node"""
+    # Shed load before doing any storage work (raises 429 with Retry-After)
+    admission.check_rate(get_client_id(request))
     try:
-        # Run scheduler to determine which workers to deploy to
-        worker_names = run_scheduler(service, storage)
-
-        for instance, worker_name in enumerate(worker_names):
-            key = service.job_id + "-" + worker_name + "-" + str(instance)
-            # Store task information in etcd
-            storage.put(f"/workers/{worker_name}/deploy-req/{key}", service)
-            
-            # Also store in system services
-            storage.put(f"/system_services/{service.job_id}", json.dumps(worker_names))
-
-        return {"status": "success", "message": f"Task {service.job_id} deployment initiated on {worker_names}"}
+        task_name = service.get_service_name
+
+        # Run scheduler to determine which workers to deploy to. Only a few runs may
+        # scan storage at once; they run off the event loop so waiting requests stay cheap.
+        async with admission.scheduler_slot():
+            with stage_timer(DEPLOY_ENDPOINT, "scheduler"):
+                worker_names = await run_in_threadpool(run_scheduler, service, storage, directory)
+
+        with stage_timer(DEPLOY_ENDPOINT, "storage_write"):
+            records = []
+            for instance, worker_name in enumerate(worker_names):
+                record = PlacementRecord(
+                    task_name=task_name,
+                    replica_index=instance,
+                    worker_name=worker_name,
+                    status=Status.DEPLOY_REQUESTED
+                )
+                # Store task information in etcd
+                storage.put(request_key(worker_name, DEPLOY_REQUEST, record.get_unique_id), service.to_json_dict())
+                records.append(record)
+
+            # Record where every replica went so lifecycle calls are a single keyed read
+            placement.put_replicas(task_name, records)
+
+        return {"status": "success", "message": f"Task {task_name} deployment initiated on {worker_names}"}
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/tasks/start/{task_name}")
-async def start_task(task_name: str, storage: StorageService = Depends(get_storage_client)):
+@app.post(START_ENDPOINT)
+async def start_task(task_name: str, storage: StorageService = Depends(get_storage_client),
+                     placement: PlacementIndex = Depends(get_placement_index),
+                     directory: WorkerDirectory = Depends(get_worker_directory),
+                     client: httpx.AsyncClient = Depends(get_http_client)):
     """Start a deployed task"""
     try:
-        # Get task keys
-        task_keys = get_task_keys(task_name, storage)
+        # Get the replicas of this task
+        with stage_timer(START_ENDPOINT, "storage_read"):
+            replicas = placement.get_replicas(task_name)
 
-        if not task_keys:
+        if not replicas:
             raise HTTPException(status_code=404, detail=f"Task {task_name} not found on any worker")
 
-        # Fetch worker IPs
-        worker_ips = get_worker_ips(storage)
-
         # Send start command to all workers running this task
-        success_count = 0
-        for task_key in task_keys:
-            try:
-                worker_name = task_key.split('-')[1]  # Extract worker name from the key
-                if worker_name not in worker_ips:
-                    print(f"Warning: No IP found for worker {worker_name}")
-                    continue
-
-                worker_ip = worker_ips[worker_name]
-                url = f"http://{worker_ip}:8000/api/tasks/start/{task_name}"  # Adjust port if needed
-
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(url, json={"task_key": task_key})  # Send task_key in the request body
-                    response.raise_for_status()
-
-                success_count += 1
-                print(f"Start request sent successfully to {worker_name} for task {task_name}")
-
-                # Changes status in etcd to start_req
-                storage.put(f"/workers/{worker_name}/start_req/{task_name}", task_key)
-
-            except httpx.HTTPStatusError as e:
-                print(f"Error sending start request to {worker_name} for task {task_name}: {e}")
-            except Exception as e:
-                print(f"Error processing task {task_name} for worker {worker_name}: {e}")
-
-        return {"status": "success", "message": f"Task {task_name} start initiated on {success_count}/{len(task_keys)} workers"}
+        started = []
+        if get_dispatch_mode() == "storage":
+            # Workers pick the request up from storage, so there is no call to make
+            started = [replica.get_replica_index for replica in replicas]
+        else:
+            with stage_timer(START_ENDPOINT, "worker_fanout"):
+                for replica in replicas:
+                    worker_name = replica.get_worker_name
+                    rpc_start = time.perf_counter()
+                    outcome = "ok"
+                    try:
+                        worker_url = directory.resolve(worker_name)
+                        if worker_url is None:
+                            print(f"Warning: No endpoint registered for worker {worker_name}")
+                            outcome = "unregistered"
+                            continue
+
+                        url = f"{worker_url}/services/{replica.get_unique_id}/start"
+
+                        response = await client.post(url)
+                        response.raise_for_status()
+
+                        started.append(replica.get_replica_index)
+                        print(f"Start request sent successfully to {worker_name} for task {task_name}")
+
+                    except httpx.HTTPStatusError as e:
+                        outcome = "http_error"
+                        print(f"Error sending start request to {worker_name} for task {task_name}: {e}")
+                    except Exception as e:
+                        outcome = "error"
+                        print(f"Error processing task {task_name} for worker {worker_name}: {e}")
+                    finally:
+                        observe_worker_rpc(START_ENDPOINT, outcome, time.perf_counter() - rpc_start)
+
+        with stage_timer(START_ENDPOINT, "storage_write"):
+            # Changes status in etcd to start_req
+            by_index = {replica.get_replica_index: replica for replica in replicas}
+            for index in started:
+                replica = by_index[index]
+                storage.put(request_key(replica.get_worker_name, START_REQUEST, replica.get_unique_id),
+                            replica.to_json_dict())
+            placement.update_status(task_name, Status.START_REQUESTED, started)
+
+        return {"status": "success", "message": f"Task {task_name} start initiated on {len(started)}/{len(replicas)} workers"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/tasks/stop/{task_name}")
-async def stop_task(task_name: str, storage: StorageService = Depends(get_storage_client)):
+@app.post(STOP_ENDPOINT)
+async def stop_task(task_name: str, storage: StorageService = Depends(get_storage_client),
+                    placement: PlacementIndex = Depends(get_placement_index),
+                    directory: WorkerDirectory = Depends(get_worker_directory),
+                    client: httpx.AsyncClient = Depends(get_http_client)):
     """Stop a running task"""
     try:
-        # Get workers running this task
-        task_keys = get_task_keys(task_name, storage)
+        # Get the replicas of this task
+        with stage_timer(STOP_ENDPOINT, "storage_read"):
+            replicas = placement.get_replicas(task_name)
         
-        if not task_keys:
+        if not replicas:
             raise HTTPException(status_code=404, detail=f"Task {task_name} not found on any worker")
     
-         # Fetch worker IPs (assuming you have a worker_ips dictionary)
-        worker_ips = get_worker_ips(storage)  # Implement this function to fetch worker IPs
-
         # Send stop command to all workers running this task
-        success_count = 0
-        for task_key in task_keys:
-            try:
-                worker_name = task_key.split('-')[1]  # Extract worker name from the key
-                if worker_name not in worker_ips:
-                    print(f"Warning: No IP found for worker {worker_name}")
-                    continue
-
-                worker_ip = worker_ips[worker_name]
-                url = f"http://{worker_ip}:8000/api/tasks/stop/{task_name}"  # Adjust port if needed
-
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(url, json={"task_key": task_key})  # Send task_key in the request body
-                    response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-
-                success_count += 1
-                print(f"Stop request sent successfully to {worker_name} for task {task_name}")
-
-                # Changes status in etcd to stop_req
-                storage.put(f"/workers/{worker_name}/stop_req/{task_name}", task_key)
-
-            except httpx.HTTPStatusError as e:
-                print(f"Error sending stop request to {worker_name} for task {task_name}: {e}")
-            except Exception as e:
-                print(f"Error processing task {task_name} for worker {worker_name}: {e}")
-
-        return {"status": "success", "message": f"Task {task_name} stop initiated on {success_count}/{len(task_keys)} workers"}
+        stopped = []
+        if get_dispatch_mode() == "storage":
+            # Workers pick the request up from storage, so there is no call to make
+            stopped = [replica.get_replica_index for replica in replicas]
+        else:
+            with stage_timer(STOP_ENDPOINT, "worker_fanout"):
+                for replica in replicas:
+                    worker_name = replica.get_worker_name
+                    rpc_start = time.perf_counter()
+                    outcome = "ok"
+                    try:
+                        worker_url = directory.resolve(worker_name)
+                        if worker_url is None:
+                            print(f"Warning: No endpoint registered for worker {worker_name}")
+                            outcome = "unregistered"
+                            continue
+
+                        url = f"{worker_url}/services/{replica.get_unique_id}/stop"
+
+                        response = await client.post(url)
+                        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+
+                        stopped.append(replica.get_replica_index)
+                        print(f"Stop request sent successfully to {worker_name} for task {task_name}")
+
+                    except httpx.HTTPStatusError as e:
+                        outcome = "http_error"
+                        print(f"Error sending stop request to {worker_name} for task {task_name}: {e}")
+                    except Exception as e:
+                        outcome = "error"
+                        print(f"Error processing task {task_name} for worker {worker_name}: {e}")
+                    finally:
+                        observe_worker_rpc(STOP_ENDPOINT, outcome, time.perf_counter() - rpc_start)
+
+        with stage_timer(STOP_ENDPOINT, "storage_write"):
+            # Changes status in etcd to stop_req
+            by_index = {replica.get_replica_index: replica for replica in replicas}
+            for index in stopped:
+                replica = by_index[index]
+                storage.put(request_key(replica.get_worker_name, STOP_REQUEST, replica.get_unique_id),
+                            replica.to_json_dict())
+            placement.update_status(task_name, Status.STOP_REQUESTED, stopped)
+
+        return {"status": "success", "message": f"Task {task_name} stop initiated on {len(stopped)}/{len(replicas)} workers"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-#Helper functions
-def get_worker_ips(storage: StorageService) -> Dict[str, str]:
-    """Helper function to fetch worker IPs from etcd."""
-    worker_ips = {}
+MAX_PAGE_SIZE = 1000
+
+@app.get("/api/tasks")
+async def list_tasks(request: Request, limit: int = 100, cursor: Optional[str] = None,
+                     worker: Optional[str] = None, status: Optional[str] = None,
+                     view: InventoryView = Depends(get_inventory_view)):
+    """List tasks with their replica counts, optionally those on a worker or with replicas in a status"""
+    return inventory_page(request, lambda: view.list_tasks(clamp_limit(limit), cursor, worker, status))
+
+@app.get("/api/replicas")
+async def list_replicas(request: Request, limit: int = 100, cursor: Optional[str] = None,
+                        task: Optional[str] = None, worker: Optional[str] = None, status: Optional[str] = None,
+                        view: InventoryView = Depends(get_inventory_view)):
+    """List replicas, optionally filtered by task, worker and status"""
+    return inventory_page(request, lambda: view.list_replicas(clamp_limit(limit), cursor, task, worker, status))
+
+@app.get("/api/workers")
+async def list_workers(request: Request, limit: int = 100, cursor: Optional[str] = None,
+                       status: Optional[str] = None, view: InventoryView = Depends(get_inventory_view)):
+    """List registered workers, optionally those running replicas in a status"""
+    return inventory_page(request, lambda: view.list_workers(clamp_limit(limit), cursor, status))
+
+def clamp_limit(limit: int) -> int:
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def inventory_page(request: Request, load_page):
+    """Serve one page from the inventory view, answering 304 when the client's ETag still matches"""
     try:
-        values = storage.get_prefix("/workers")
-        for key, value in values.items():
-            parts = key.split('/')
-            if len(parts) >= 3:
-                worker_name = parts[2]
-                worker_ips[worker_name] = value
-    except Exception as e:
-        print(f"Error fetching worker IPs: {e}")
-    return worker_ips
-
-def get_task_keys(task_name: str, storage: StorageService) -> List[str]:
-    """Helper function to get all workers running a specific task"""
+        page = load_page()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    etag = page.pop("etag")
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=json.dumps(page), media_type="application/json", headers={"ETag": etag})
+
+@app.get("/api/events")
+async def stream_status_events(request: Request, task: Optional[str] = None, worker: Optional[str] = None,
+                               resume: Optional[str] = None,
+                               broker: StatusEventBroker = Depends(get_status_broker)):
+    """
+    Stream task and replica state transitions as server-sent events, optionally
+    filtered by task and worker. Each event id is a resume token: reconnect with
+    ?resume=<id> (or the Last-Event-ID header) to pick up where the stream left off.
+    """
+    subscription = broker.subscribe(task, worker, resume or request.headers.get("Last-Event-ID"))
+    return StreamingResponse(status_event_source(broker, subscription), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+async def status_event_source(broker: StatusEventBroker, subscription: Subscription):
+    """Yield a subscription's events in SSE format until the client goes away"""
     try:
-        workers_data = storage.get(f"/system_services/{task_name}")
-        if not workers_data:
-            return []
-        return workers_data
-    except json.JSONDecodeError:
-        print(f"Error decoding JSON for task {task_name}")
-        return []
-    except Exception as e:
-        print(f"Error getting task keys: {e}")
-        return []
+        if subscription.resync_required:
+            # The token is older than the history kept here; the client has to reload state
+            yield "event: resync\ndata: {}\n\n"
+            return
+        for event in subscription.replay:
+            yield format_sse(event)
+        while not subscription.overflowed:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=15)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(event)
+        # The client fell too far behind; it should reconnect with its last event id
+        yield "event: reconnect\ndata: {}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+def format_sse(event: dict) -> str:
+    return f"id: {event['id']}\nevent: status\ndata: {json.dumps(event)}\n\n"
+
+#Helper functions
+def load_json(value):
+    """Storage values may come back already decoded or as a JSON string."""
+    if isinstance(value, (str, bytes)):
+        return json.loads(value)
+    return value
 
-def run_scheduler(service: Service, storage: StorageService) -> List[str]:
+def run_scheduler(service: Service, storage: StorageService, directory: WorkerDirectory) -> List[str]:
     """Run the scheduler to determine which workers to deploy to"""
-    values = storage.get_prefix("/workers")
-    worker_names = [metadata.key.decode().split('/')[2] for _, metadata in values]
+    worker_names = directory.worker_names()
 
     workers = {}
+    requested = service.get_requested_resources
     for worker in worker_names:
-        total_specs_val = storage.get(f"/workers/{worker}/specs")[0].decode()
-        current_usage_val = storage.get(f"/workers/{worker}/current_usage")
-        total_specs = Specs.from_dict(json.loads(total_specs_val))
-        if not current_usage_val or not current_usage_val[0]:
-            usage_dict = {
-                "current_usage": {
-                    "cpu": 0, 
-                    "ram": 0, 
-                    "disk": 0
-                }
-            }
+        if not directory.is_healthy(worker):
+            print(f"Skipping worker {worker}, its heartbeats are late")
+            continue
+        # Workers publish their spare capacity; older ones only have specs and usage
+        headroom_val = storage.get(f"/workers/{worker}/headroom")
+        if headroom_val:
+            available_resources = Resources.from_dict(load_json(headroom_val)["headroom"])
         else:
-            usage_dict = json.loads(current_usage_val[0].decode())
-        current_usage = ResourceUsage.from_dict(usage_dict)
+            total_specs_val = storage.get(f"/workers/{worker}/specs")
+            current_usage_val = storage.get(f"/workers/{worker}/current_usage")
+            if not total_specs_val:
+                print(f"Warning: No specs found for worker {worker}")
+                continue
+            total_specs = Specs.from_dict(load_json(total_specs_val))
+            if not current_usage_val:
+                usage_dict = {
+                    "resource_usage": {
+                        "cpu": 0, 
+                        "ram": 0, 
+                        "disk": 0
+                    }
+                }
+            else:
+                usage_dict = load_json(current_usage_val)
+            current_usage = ResourceUsage.from_dict(usage_dict)
 
-        available_resources = Resources.from_two_specs(total_specs, current_usage)
+            available_resources = Resources.from_two_specs(total_specs, current_usage)
+
+        # Skip workers the request does not fit on; the worker would refuse it with 409 anyway
+        if available_resources.get_cpu < requested.get_cpu or available_resources.get_ram < requested.get_ram or \
+                available_resources.get_disk < requested.get_disk:
+            print(f"Worker {worker} lacks room for {service.get_service_name}")
+            continue
         workers[worker] = available_resources
-    return worker_names
+    return list(workers.keys())
 
 if __name__ == "__main__":
     # Add command line argument parsing
     parser = argparse.ArgumentParser(description='API Service for Kubernetes-like system')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='Host to bind the server to')
     parser.add_argument('--port', type=int, default=8000, help='Port to bind the server to')
+    parser.add_argument('--storage', type=str, choices=['etcd', 'test'], default='etcd', help='Storage backend to use')
     parser.add_argument('--etcd-host', type=str, default='127.0.0.1', help='Etcd host')
     parser.add_argument('--etcd-port', type=int, default=2379, help='Etcd port')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of gateway processes to run (production: one per core)')
+    parser.add_argument('--deploy-rate', type=float, default=20.0,
+                        help='Deploys per second allowed per client, for the whole gateway (split between its processes)')
+    parser.add_argument('--deploy-burst', type=float, default=40.0,
+                        help='Deploy burst allowed per client, for the whole gateway (split between its processes)')
+    parser.add_argument('--trusted-proxy', action='append', default=[], metavar='ADDRESS',
+                        help='Peer address whose X-Client-Id header names the client for rate limiting (repeatable); '
+                             'other callers are limited by their address')
+    parser.add_argument('--max-scheduler-runs', type=int, default=4,
+                        help='Scheduler runs allowed at once, per gateway process')
+    parser.add_argument('--max-deploy-queue', type=int, default=64,
+                        help='Deploys allowed to wait for the scheduler before new ones get 429, per gateway process')
+    parser.add_argument('--max-queue-wait', type=float, default=2.0,
+                        help='Seconds a deploy may wait for the scheduler before it gets 429')
+    parser.add_argument('--dispatch', type=str, choices=['http', 'storage'], default='http',
+                        help='Send start/stop to workers over HTTP, or only through their storage request keys')
     
     args = parser.parse_args()
+
+    # Worker processes read their settings from the environment when they initialize
+    os.environ["GATEWAY_STORAGE"] = args.storage
+    os.environ["GATEWAY_ETCD_HOST"] = args.etcd_host
+    os.environ["GATEWAY_ETCD_PORT"] = str(args.etcd_port)
+    os.environ["GATEWAY_DEPLOY_RATE"] = str(args.deploy_rate)
+    os.environ["GATEWAY_DEPLOY_BURST"] = str(args.deploy_burst)
+    os.environ["GATEWAY_PROCESSES"] = str(args.workers)
+    os.environ["GATEWAY_TRUSTED_PROXIES"] = ",".join(args.trusted_proxy)
+    os.environ["GATEWAY_MAX_SCHEDULER_RUNS"] = str(args.max_scheduler_runs)
+    os.environ["GATEWAY_MAX_DEPLOY_QUEUE"] = str(args.max_deploy_queue)
+    os.environ["GATEWAY_MAX_QUEUE_WAIT"] = str(args.max_queue_wait)
+    os.environ["GATEWAY_DISPATCH"] = args.dispatch
     
     # Start the server
-    uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
+    if args.workers > 1:
+        # Let the processes share their metrics so /metrics reports the whole gateway
+        os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="gateway-metrics-"))
+        # Each process imports this module on its own and builds its state in process_lifespan
+        uvicorn.run("api_gateway:app", host=args.host, port=args.port, workers=args.workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
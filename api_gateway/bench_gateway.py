@@ -0,0 +1,251 @@
+"""
+In-process load test for the API gateway.
+
+The gateway app runs against TestStorage and talks to N stub workers, each a
+worker_node app serving its own WorkerNode, all inside one event loop. No etcd
+and no real worker nodes are needed. Stub workers can add latency and fail a
+fraction of requests. Deploy, start and stop traffic is driven at each of the
+given concurrency levels and throughput and p50/p99 latency are reported.
+
+Deploy admission control is off unless --deploy-rate is given. Deploys it sheds
+(429) are counted as shed, not as errors, and their tasks are left out of the
+start and stop phases (reported as skipped).
+
+Example:
+    python bench_gateway.py --workers 8 --tasks 200 --concurrency 1 8 32 --latency-ms 2 --failure-rate 0.01
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import time
+from typing import Dict, List, Optional, Set
+
+import httpx
+
+import api_gateway
+import worker_node
+from admission import AdmissionController
+from models.specs import Specs
+from storage_interface.storage_service_wrapper import TestStorage
+
+STUB_PORT = 8001
+
+
+class StubWorker:
+    """ASGI wrapper around a worker app that injects latency and failures."""
+
+    def __init__(self, app, latency: float, jitter: float, failure_rate: float, rng: random.Random):
+        self.app = app
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = rng
+        self.injected_failures = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            delay = self.latency + self.rng.random() * self.jitter
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.rng.random() < self.failure_rate:
+                self.injected_failures += 1
+                await send({"type": "http.response.start", "status": 503,
+                            "headers": [(b"content-type", b"text/plain")]})
+                await send({"type": "http.response.body", "body": b"injected failure"})
+                return
+        await self.app(scope, receive, send)
+
+
+class BenchCluster:
+    """The gateway wired to TestStorage and a set of in-process stub workers."""
+
+    def __init__(self, worker_count: int, latency: float, jitter: float, failure_rate: float, seed: int,
+                 admission: AdmissionController):
+        self.storage = TestStorage()
+        self.rng = random.Random(seed)
+        self.nodes: Dict[str, worker_node.WorkerNode] = {}
+        self.stubs: Dict[str, StubWorker] = {}
+
+        # Point the gateway's process state at the test storage before anything is built
+        api_gateway.storage_client = self.storage
+        api_gateway.placement_index = None
+        api_gateway.worker_directory = None
+        api_gateway.admission_controller = admission
+        # The in-process transport's peer address; lets each bench client have its own bucket
+        api_gateway.trusted_proxies = frozenset({"127.0.0.1"})
+        api_gateway.get_worker_directory()
+
+        mounts = {}
+        for i in range(worker_count):
+            name = f"stub-worker-{i}"
+            # Each node applies its deploy/start/stop requests from storage with its own reconcile loop
+            node = worker_node.WorkerNode(name, api_port=STUB_PORT, advertise_host=name, storage=self.storage)
+            stub = StubWorker(worker_node.create_app(node), latency, jitter, failure_rate, self.rng)
+            self.nodes[name] = node
+            self.stubs[name] = stub
+            mounts[f"http://{name}:{STUB_PORT}"] = httpx.ASGITransport(app=stub)
+
+        api_gateway.http_client = httpx.AsyncClient(mounts=mounts, timeout=30.0)
+        self.gateway = httpx.AsyncClient(transport=httpx.ASGITransport(app=api_gateway.app),
+                                         base_url="http://gateway", timeout=30.0)
+
+    def grow_specs(self, replicas: int) -> None:
+        """Give every stub worker room for the replicas the run will place on it."""
+        for name in self.nodes:
+            specs = Specs.from_dict({"specs": {"cpu": replicas, "ram": replicas, "disk": replicas}})
+            self.storage.put(f"/workers/{name}/specs", specs.to_json_dict())
+
+    async def close(self) -> None:
+        await self.gateway.aclose()
+        await api_gateway.http_client.aclose()
+        for node in self.nodes.values():
+            node.shutdown()
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def build_admission(args) -> AdmissionController:
+    """The gateway's deploy admission control: effectively unlimited unless --deploy-rate is set."""
+    if args.deploy_rate > 0:
+        return AdmissionController(client_rate=args.deploy_rate, client_burst=args.deploy_burst,
+                                   max_queue=args.max_deploy_queue, max_wait=args.max_queue_wait)
+    # Room for every request of a phase in the queue, and a wait no phase will reach
+    return AdmissionController(client_rate=1e9, client_burst=1e9, max_queue=args.tasks + max(args.concurrency),
+                               max_wait=3600.0)
+
+
+async def run_phase(cluster: BenchCluster, label: str, requests: List[dict], concurrency: int,
+                    skipped: int = 0, shed_tasks: Optional[Set[str]] = None) -> dict:
+    """
+    Send the requests with at most `concurrency` in flight and collect latencies.
+    The task of every request shed with 429 is added to `shed_tasks`.
+    """
+    latencies: List[float] = []
+    errors = 0
+    shed = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+
+    async def client_loop(client_number: int):
+        nonlocal errors, shed
+        headers = {"X-Client-Id": f"bench-client-{client_number}"}
+        while True:
+            try:
+                request = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                response = await cluster.gateway.post(request["path"], json=request.get("json"), headers=headers)
+                if response.status_code == 429:
+                    shed += 1
+                    if shed_tasks is not None:
+                        shed_tasks.add(request["task"])
+                elif response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    injected_before = sum(stub.injected_failures for stub in cluster.stubs.values())
+    phase_start = time.perf_counter()
+    await asyncio.gather(*(client_loop(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - phase_start
+
+    latencies.sort()
+    return {
+        "phase": label,
+        "concurrency": concurrency,
+        "requests": len(requests),
+        "errors": errors,
+        "shed": shed,
+        "skipped": skipped,
+        "injected": sum(stub.injected_failures for stub in cluster.stubs.values()) - injected_before,
+        "throughput": len(requests) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": (latencies[-1] * 1000) if latencies else 0.0
+    }
+
+
+async def run_benchmark(args) -> List[dict]:
+    cluster = BenchCluster(args.workers, args.latency_ms / 1000, args.jitter_ms / 1000,
+                           args.failure_rate, args.seed, build_admission(args))
+    # Every deploy places one replica per worker
+    cluster.grow_specs(args.tasks * len(args.concurrency))
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            task_names = [f"bench-c{concurrency}-t{i}" for i in range(args.tasks)]
+            deploys = [{
+                "task": name,
+                "path": "/api/tasks/deploy",
+                "json": {
+                    "service_name": name,
+                    "image_url": "registry.local/bench:latest",
+                    "number_of_replicas": 1,
+                    "requested_resources": {"cpu": 1, "ram": 1, "disk": 1}
+                }
+            } for name in task_names]
+            shed_tasks: Set[str] = set()
+            results.append(await run_phase(cluster, "deploy", deploys, concurrency, shed_tasks=shed_tasks))
+            # A task whose deploy was shed does not exist; starting or stopping it would only 404
+            deployed = [name for name in task_names if name not in shed_tasks]
+            results.append(await run_phase(cluster, "start",
+                                           [{"task": name, "path": f"/api/tasks/start/{name}"} for name in deployed],
+                                           concurrency, skipped=len(shed_tasks)))
+            results.append(await run_phase(cluster, "stop",
+                                           [{"task": name, "path": f"/api/tasks/stop/{name}"} for name in deployed],
+                                           concurrency, skipped=len(shed_tasks)))
+    finally:
+        await cluster.close()
+    return results
+
+
+def print_results(results: List[dict]) -> None:
+    header = f"{'phase':<8}{'conc':>6}{'reqs':>8}{'errors':>8}{'shed':>8}{'skipped':>9}{'injected':>10}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for row in results:
+        print(f"{row['phase']:<8}{row['concurrency']:>6}{row['requests']:>8}{row['errors']:>8}{row['shed']:>8}{row['skipped']:>9}{row['injected']:>10}"
+              f"{row['throughput']:>10.1f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process load test for the API gateway")
+    parser.add_argument("--workers", type=int, default=4, help="Number of stub worker nodes")
+    parser.add_argument("--tasks", type=int, default=100, help="Tasks to deploy, start and stop per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32],
+                        help="Concurrency levels to run")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="Base latency added by each stub worker call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra latency per stub worker call")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Fraction of stub worker calls answered with 503")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for latency and failure injection")
+    parser.add_argument("--dispatch", choices=["http", "storage"], default="http",
+                        help="Send start/stop to the stub workers over HTTP or only through storage")
+    parser.add_argument("--deploy-rate", type=float, default=0.0,
+                        help="Deploys per second allowed per client; 0 disables deploy admission limits")
+    parser.add_argument("--deploy-burst", type=float, default=40.0, help="Deploy burst allowed per client")
+    parser.add_argument("--max-deploy-queue", type=int, default=64,
+                        help="Deploys allowed to wait for the scheduler before new ones get 429 (with --deploy-rate)")
+    parser.add_argument("--max-queue-wait", type=float, default=2.0,
+                        help="Seconds a deploy may wait for the scheduler before it gets 429 (with --deploy-rate)")
+    parser.add_argument("--verbose", action="store_true", help="Keep the gateway and worker log output")
+    args = parser.parse_args()
+    os.environ["GATEWAY_DISPATCH"] = args.dispatch
+
+    if args.verbose:
+        results = asyncio.run(run_benchmark(args))
+    else:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results = asyncio.run(run_benchmark(args))
+    print_results(results)
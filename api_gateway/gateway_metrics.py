@@ -0,0 +1,88 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# Latency buckets in seconds, from sub-millisecond storage reads up to slow worker calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram(
+    "gateway_request_duration_seconds",
+    "End-to-end latency of gateway requests",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "gateway_stage_duration_seconds",
+    "Latency of one stage (scheduler, storage_read, storage_write, worker_fanout) of a request",
+    ["endpoint", "stage"],
+    buckets=LATENCY_BUCKETS
+)
+WORKER_RPC_LATENCY = Histogram(
+    "gateway_worker_rpc_duration_seconds",
+    "Latency of a single call from the gateway to a worker node",
+    # No per-worker label: one series per worker would grow with the cluster
+    ["endpoint", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+IN_FLIGHT = Gauge(
+    "gateway_requests_in_flight",
+    "Requests currently being handled by the gateway",
+    multiprocess_mode="livesum"
+)
+ERRORS = Counter(
+    "gateway_errors_total",
+    "Errors seen by the gateway, by endpoint and the stage that failed",
+    ["endpoint", "stage"]
+)
+
+ADMISSION_REJECTIONS = Counter(
+    "gateway_admission_rejections_total",
+    "Deploys shed by admission control, by reason",
+    ["reason"]
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "gateway_admission_queue_depth",
+    "Deploys waiting for a scheduler slot",
+    multiprocess_mode="livesum"
+)
+
+
+@contextmanager
+def stage_timer(endpoint: str, stage: str):
+    """Time one stage of a request. An exception escaping the stage is counted as an error."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.labels(endpoint=endpoint, stage=stage).inc()
+        raise
+    finally:
+        STAGE_LATENCY.labels(endpoint=endpoint, stage=stage).observe(time.perf_counter() - start)
+
+
+def observe_worker_rpc(endpoint: str, outcome: str, seconds: float) -> None:
+    """Record one call to a worker node."""
+    WORKER_RPC_LATENCY.labels(endpoint=endpoint, outcome=outcome).observe(seconds)
+    if outcome != "ok":
+        ERRORS.labels(endpoint=endpoint, stage="worker_rpc").inc()
+
+
+def render_metrics():
+    """
+    Render metrics in the Prometheus text format. When the gateway runs several
+    processes (PROMETHEUS_MULTIPROC_DIR is set) the values of all of them are merged.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop the live gauges of a process that is shutting down."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
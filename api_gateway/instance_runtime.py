@@ -0,0 +1,392 @@
+import asyncio
+import json
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+from instance_store import InstanceRecord
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+GIB = 1024 ** 3
+CGROUP_ROOT = "/sys/fs/cgroup"
+CPU_PERIOD_US = 100000
+# Exit codes of this many exited instances are kept after their process entry is dropped
+EXITED_HISTORY = 1000
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class InstanceRuntime(ABC):
+    """What actually runs a worker's instances. start/stop are called from plain threads."""
+
+    # Called with (unique_id, exit_code) when an instance exits without being stopped
+    on_exit: Optional[Callable[[str, int], None]] = None
+
+    @abstractmethod
+    def start(self, instance: InstanceRecord) -> None:
+        """Launch an instance. Raises if it could not be launched."""
+        pass
+
+    def start_many(self, instances: List[InstanceRecord]) -> Dict[str, Optional[str]]:
+        """Launch several instances. Returns {unique_id: error message or None}."""
+        results = {}
+        for instance in instances:
+            try:
+                self.start(instance)
+                results[instance.get_unique_id] = None
+            except Exception as e:
+                results[instance.get_unique_id] = str(e)
+        return results
+
+    @abstractmethod
+    def stop(self, unique_id: str) -> Optional[int]:
+        """Stop an instance. Returns its exit code if it had one."""
+        pass
+
+    def get_stats(self) -> dict:
+        return {"runtime": type(self).__name__}
+
+    def get_process(self, unique_id: str) -> Optional[dict]:
+        return None
+
+    def shutdown(self) -> None:
+        pass
+
+
+class NoopRuntime(InstanceRuntime):
+    """Runs nothing; starting and stopping an instance only changes its status."""
+
+    def start(self, instance: InstanceRecord) -> None:
+        pass
+
+    def stop(self, unique_id: str) -> Optional[int]:
+        return None
+
+
+class ManagedProcess:
+    """One instance's process and what the runtime knows about it."""
+
+    def __init__(self, unique_id: str, command: List[str]):
+        self.unique_id = unique_id
+        self.command = command
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.exit_code: Optional[int] = None
+        self.stop_requested = False
+        self.cgroup_path: Optional[str] = None
+
+    def to_json_dict(self) -> dict:
+        return {
+            "unique_id": self.unique_id,
+            "command": self.command,
+            "pid": self.process.pid if self.process else None,
+            "running": self.process is not None and self.exit_code is None,
+            "exit_code": self.exit_code
+        }
+
+
+def load_image_commands(path: str) -> Dict[str, str]:
+    """Read an image allow-list: a JSON object mapping each image_url to the command line it runs."""
+    with open(path, encoding="utf-8") as f:
+        commands = json.load(f)
+    if not isinstance(commands, dict) or not all(isinstance(command, str) for command in commands.values()):
+        raise ValueError(f"{path} must map image names to command lines")
+    return commands
+
+
+class LocalProcessRuntime(InstanceRuntime):
+    """
+    Runs each instance as a local subprocess. image_url is never run itself: it is
+    looked up in `image_commands`, an allow-list set by the worker's operator mapping
+    each image to a command line, and instances of any other image are refused. Processes are launched and supervised on a private asyncio loop in a
+    background thread, so many can be started at once (bounded by max_concurrent_starts)
+    and every exit is reaped and reported through on_exit(unique_id, exit_code).
+
+    requested_resources are enforced with a cgroup v2 per instance (cpu.max, memory.max)
+    when this process may create cgroups, otherwise with rlimits (address space for ram).
+    Disk is limited with RLIMIT_FSIZE either way. CPU has no rlimit equivalent, so it is
+    only enforced with cgroups. Limits are applied from this process right after the
+    spawn (cgroup.procs, prlimit) rather than in a preexec_fn, which is not safe to run
+    in a process with threads.
+    """
+
+    def __init__(self, worker_name: str, image_commands: Optional[Dict[str, str]] = None,
+                 max_concurrent_starts: int = 16, stop_timeout: float = 5.0, log_dir: Optional[str] = None,
+                 on_exit: Optional[Callable[[str, int], None]] = None, use_cgroups: bool = True):
+        self.worker_name = worker_name
+        self.image_commands = {image: shlex.split(command) for image, command in (image_commands or {}).items()}
+        self.max_concurrent_starts = max_concurrent_starts
+        self.stop_timeout = stop_timeout
+        self.log_dir = log_dir
+        self.on_exit = on_exit
+        # Instances being launched or running; exited ones move to _exited
+        self.processes: Dict[str, ManagedProcess] = {}
+        self._exited: "OrderedDict[str, ManagedProcess]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._start_latencies: deque = deque(maxlen=10000)
+        self._last_batch: Optional[dict] = None
+        self._exits = 0
+        self.cgroup_parent = self._prepare_cgroups() if use_cgroups else None
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+
+        self._loop = asyncio.new_event_loop()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    # Called from worker threads
+
+    def start(self, instance: InstanceRecord) -> None:
+        error = self._call(self._start(instance))
+        if error:
+            raise RuntimeError(error)
+
+    def start_many(self, instances: List[InstanceRecord]) -> Dict[str, Optional[str]]:
+        return self._call(self._start_many(instances))
+
+    def stop(self, unique_id: str) -> Optional[int]:
+        return self._call(self._stop(unique_id), timeout=self.stop_timeout + 5)
+
+    def get_stats(self) -> dict:
+        latencies = sorted(self._start_latencies)
+        with self._lock:
+            running = sum(1 for managed in self.processes.values() if managed.exit_code is None)
+        return {
+            "runtime": type(self).__name__,
+            "limits": "cgroup" if self.cgroup_parent else "rlimit",
+            "running": running,
+            "exited": self._exits,
+            "starts": len(latencies),
+            "start_latency_ms": {
+                "p50": percentile(latencies, 0.5) * 1000,
+                "p99": percentile(latencies, 0.99) * 1000,
+                "max": (latencies[-1] if latencies else 0.0) * 1000
+            },
+            "last_batch": self._last_batch
+        }
+
+    def get_process(self, unique_id: str) -> Optional[dict]:
+        with self._lock:
+            managed = self.processes.get(unique_id) or self._exited.get(unique_id)
+        return managed.to_json_dict() if managed else None
+
+    def shutdown(self) -> None:
+        with self._lock:
+            unique_ids = [uid for uid, managed in self.processes.items() if managed.exit_code is None]
+        for unique_id in unique_ids:
+            try:
+                self.stop(unique_id)
+            except Exception as e:
+                print(f"Error stopping {unique_id}: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    # Runtime loop
+
+    def _run_loop(self, ready: threading.Event) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_starts)
+        ready.set()
+        self._loop.run_forever()
+
+    def _call(self, coroutine, timeout: Optional[float] = 60.0):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    async def _start_many(self, instances: List[InstanceRecord]) -> Dict[str, Optional[str]]:
+        started_at = time.perf_counter()
+        errors = await asyncio.gather(*(self._start(instance) for instance in instances))
+        elapsed = time.perf_counter() - started_at
+        self._last_batch = {
+            "instances": len(instances),
+            "failed": sum(1 for error in errors if error),
+            "seconds": elapsed,
+            "starts_per_second": len(instances) / elapsed if elapsed > 0 else 0.0
+        }
+        return {instance.get_unique_id: error for instance, error in zip(instances, errors)}
+
+    async def _start(self, instance: InstanceRecord) -> Optional[str]:
+        """Launch one instance. Returns an error message, or None on success."""
+        unique_id = instance.get_unique_id
+        command = self.image_commands.get(instance.get_image_url)
+        if not command:
+            return f"Image {instance.get_image_url!r} of {unique_id} is not in this worker's image allow-list"
+        with self._lock:
+            if unique_id in self.processes:
+                return None  # Already running or being launched
+            # Claim the instance before launching, so a concurrent start does not launch it twice
+            managed = self.processes[unique_id] = ManagedProcess(unique_id, command)
+
+        async with self._semaphore:
+            requested = time.perf_counter()
+            output = self._open_log(unique_id)
+            try:
+                managed.cgroup_path = self._create_cgroup(unique_id, instance)
+                managed.process = await asyncio.create_subprocess_exec(
+                    *command, stdin=asyncio.subprocess.DEVNULL, stdout=output, stderr=output,
+                    start_new_session=True
+                )
+            except (OSError, ValueError, subprocess.SubprocessError) as e:
+                self._remove_cgroup(managed.cgroup_path)
+                with self._lock:
+                    self.processes.pop(unique_id, None)
+                return f"Could not launch {unique_id}: {e}"
+            finally:
+                if output is not asyncio.subprocess.DEVNULL:
+                    output.close()
+            self._start_latencies.append(time.perf_counter() - requested)
+        managed.cgroup_path = self._apply_limits(managed.process.pid, instance, managed.cgroup_path)
+        self._loop.create_task(self._supervise(managed))
+        if managed.stop_requested:
+            # Stopped while it was being launched
+            self._signal(managed, signal.SIGTERM)
+        return None
+
+    async def _supervise(self, managed: ManagedProcess) -> None:
+        exit_code = await managed.process.wait()
+        managed.exit_code = exit_code
+        self._exits += 1
+        self._remove_cgroup(managed.cgroup_path)
+        with self._lock:
+            if self.processes.get(managed.unique_id) is managed:
+                del self.processes[managed.unique_id]
+            self._exited.pop(managed.unique_id, None)
+            self._exited[managed.unique_id] = managed
+            if len(self._exited) > EXITED_HISTORY:
+                self._exited.popitem(last=False)
+        if not managed.stop_requested:
+            print(f"Instance {managed.unique_id} exited on its own with code {exit_code}")
+            if self.on_exit:
+                try:
+                    self.on_exit(managed.unique_id, exit_code)
+                except Exception as e:
+                    print(f"Error reporting the exit of {managed.unique_id}: {e}")
+
+    async def _stop(self, unique_id: str) -> Optional[int]:
+        with self._lock:
+            managed = self.processes.get(unique_id)
+            if managed is None:
+                exited = self._exited.get(unique_id)
+                return exited.exit_code if exited else None
+            managed.stop_requested = True
+        if managed.process is None:
+            # Still being launched; _start signals it once it has a process
+            return None
+        if managed.exit_code is not None:
+            return managed.exit_code
+        self._signal(managed, signal.SIGTERM)
+        try:
+            return await asyncio.wait_for(managed.process.wait(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            self._signal(managed, signal.SIGKILL)
+            return await managed.process.wait()
+
+    @staticmethod
+    def _signal(managed: ManagedProcess, sig: int) -> None:
+        # Each instance is its own session, so its whole process group gets the signal
+        try:
+            os.killpg(managed.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _open_log(self, unique_id: str):
+        if not self.log_dir:
+            return asyncio.subprocess.DEVNULL
+        return open(os.path.join(self.log_dir, f"{unique_id}.log"), "ab")
+
+    # Resource limits
+
+    def _prepare_cgroups(self) -> Optional[str]:
+        """Create a cgroup for this worker's instances, or return None if cgroups cannot be used."""
+        try:
+            with open("/proc/self/cgroup") as f:
+                lines = f.read().splitlines()
+            # cgroup v2 has a single "0::/path" line
+            own = next((line[3:] for line in lines if line.startswith("0::")), None)
+            if own is None:
+                return None
+            parent = os.path.join(CGROUP_ROOT, own.lstrip("/"), f"worker-{self.worker_name}")
+            os.makedirs(parent, exist_ok=True)
+            with open(os.path.join(os.path.dirname(parent), "cgroup.subtree_control")) as f:
+                available = f.read().split()
+            if "cpu" not in available or "memory" not in available:
+                return None
+            with open(os.path.join(parent, "cgroup.subtree_control"), "w") as f:
+                f.write("+cpu +memory")
+            return parent
+        except (OSError, StopIteration):
+            return None
+
+    def _create_cgroup(self, unique_id: str, instance: InstanceRecord) -> Optional[str]:
+        if not self.cgroup_parent:
+            return None
+        resources = instance.get_requested_resources
+        path = os.path.join(self.cgroup_parent, unique_id)
+        try:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, "cpu.max"), "w") as f:
+                f.write(f"{int(resources.get_cpu * CPU_PERIOD_US)} {CPU_PERIOD_US}")
+            with open(os.path.join(path, "memory.max"), "w") as f:
+                f.write(str(int(resources.get_ram * GIB)))
+        except OSError as e:
+            print(f"Could not set cgroup limits for {unique_id}, using rlimits: {e}")
+            self._remove_cgroup(path)
+            return None
+        return path
+
+    @staticmethod
+    def _remove_cgroup(path: Optional[str]) -> None:
+        if path:
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+
+    def _apply_limits(self, pid: int, instance: InstanceRecord, cgroup_path: Optional[str]) -> Optional[str]:
+        """
+        Put a freshly spawned instance in its cgroup and set its rlimits. Returns the
+        cgroup path, or None if the process could not be moved there.
+        """
+        resources = instance.get_requested_resources
+        if cgroup_path:
+            try:
+                with open(os.path.join(cgroup_path, "cgroup.procs"), "w") as f:
+                    f.write(str(pid))
+            except OSError as e:
+                print(f"Could not move {instance.get_unique_id} into its cgroup, using rlimits: {e}")
+                self._remove_cgroup(cgroup_path)
+                cgroup_path = None
+        if resource is None or not hasattr(resource, "prlimit"):
+            return cgroup_path
+        if not cgroup_path and resources.get_ram > 0:
+            self._set_limit(pid, resource.RLIMIT_AS, int(resources.get_ram * GIB))
+        if resources.get_disk > 0:
+            self._set_limit(pid, resource.RLIMIT_FSIZE, int(resources.get_disk * GIB))
+        return cgroup_path
+
+    @staticmethod
+    def _set_limit(pid: int, limit: int, value: int) -> None:
+        try:
+            # Never ask for more than the hard limit the process already has
+            _, hard = resource.prlimit(pid, limit)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.prlimit(pid, limit, (value, hard))
+        except (ValueError, OSError):
+            pass
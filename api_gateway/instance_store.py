@@ -0,0 +1,178 @@
+import sys
+from typing import Dict, Iterator, Optional, Tuple
+
+from models.service import Service
+from models.service_instance import Status
+
+
+class ResourceSpec:
+    """Requested resources, shared by every instance that asks for the same amounts."""
+
+    __slots__ = ("cpu", "ram", "disk")
+
+    def __init__(self, cpu: int, ram: int, disk: int):
+        self.cpu = cpu
+        self.ram = ram
+        self.disk = disk
+
+    @property
+    def get_cpu(self) -> int:
+        return self.cpu
+
+    @property
+    def get_ram(self) -> int:
+        return self.ram
+
+    @property
+    def get_disk(self) -> int:
+        return self.disk
+
+    def to_json_dict(self) -> dict:
+        return {"cpu": self.cpu, "ram": self.ram, "disk": self.disk}
+
+
+class InstanceSpec:
+    """The Service fields of an instance, shared by every instance of the same service."""
+
+    __slots__ = ("service_name", "image_url", "number_of_replicas", "resources")
+
+    def __init__(self, service_name: str, image_url: str, number_of_replicas: int, resources: ResourceSpec):
+        self.service_name = service_name
+        self.image_url = image_url
+        self.number_of_replicas = number_of_replicas
+        self.resources = resources
+
+
+class InstanceRecord:
+    """
+    One instance on a worker: its id, a shared spec and its status. Has the same getters
+    as ServiceInstance so worker code can use either.
+    """
+
+    __slots__ = ("unique_id", "spec", "status")
+
+    def __init__(self, unique_id: str, spec: InstanceSpec, status: Status):
+        self.unique_id = unique_id
+        self.spec = spec
+        self.status = status
+
+    @property
+    def get_unique_id(self) -> str:
+        return self.unique_id
+
+    @property
+    def get_status(self) -> Status:
+        return self.status
+
+    @property
+    def get_service_name(self) -> str:
+        return self.spec.service_name
+
+    @property
+    def get_image_url(self) -> str:
+        return self.spec.image_url
+
+    @property
+    def get_number_of_replicas(self) -> int:
+        return self.spec.number_of_replicas
+
+    @property
+    def get_requested_resources(self) -> ResourceSpec:
+        return self.spec.resources
+
+    def to_json_dict(self) -> dict:
+        """Same shape as ServiceInstance.to_json_dict(), built without pydantic."""
+        return {
+            "service_name": self.spec.service_name,
+            "image_url": self.spec.image_url,
+            "number_of_replicas": self.spec.number_of_replicas,
+            "requested_resources": self.spec.resources.to_json_dict(),
+            "unique_id": self.unique_id,
+            "status": self.status.value
+        }
+
+
+class InstanceStore:
+    """
+    Compact store of a worker's instances, used like a dict of unique_id -> InstanceRecord.
+
+    Records are slotted and hold a reference to an interned InstanceSpec instead of their
+    own copy of the service fields; strings are interned and equal resource requests
+    share one ResourceSpec. No pydantic model is kept per instance: deploys take a
+    validated Service and reads return plain dicts (InstanceRecord.to_json_dict).
+    """
+
+    def __init__(self):
+        self._records: Dict[str, InstanceRecord] = {}
+        self._specs: Dict[Tuple, InstanceSpec] = {}
+        self._resources: Dict[Tuple[int, int, int], ResourceSpec] = {}
+
+    def put(self, unique_id: str, service: Service, status: Status) -> InstanceRecord:
+        """Add or replace an instance of a service."""
+        resources = service.get_requested_resources
+        record = InstanceRecord(sys.intern(unique_id),
+                                self.intern_spec(service.get_service_name, service.get_image_url,
+                                                 service.get_number_of_replicas,
+                                                 resources.get_cpu, resources.get_ram, resources.get_disk),
+                                status)
+        self._records[record.unique_id] = record
+        return record
+
+    def put_dict(self, data: dict) -> InstanceRecord:
+        """Add or replace an instance from a ServiceInstance-shaped dict (e.g. from the journal)."""
+        resources = data["requested_resources"]
+        spec = self.intern_spec(data["service_name"], data["image_url"], data["number_of_replicas"],
+                                resources["cpu"], resources["ram"], resources["disk"])
+        record = InstanceRecord(sys.intern(data["unique_id"]), spec, Status(data["status"]))
+        self._records[record.unique_id] = record
+        return record
+
+    def intern_spec(self, service_name: str, image_url: str, number_of_replicas: int,
+                    cpu: int, ram: int, disk: int) -> InstanceSpec:
+        key = (service_name, image_url, number_of_replicas, cpu, ram, disk)
+        spec = self._specs.get(key)
+        if spec is None:
+            resources = self._resources.get((cpu, ram, disk))
+            if resources is None:
+                resources = self._resources[(cpu, ram, disk)] = ResourceSpec(cpu, ram, disk)
+            spec = self._specs[key] = InstanceSpec(sys.intern(service_name), sys.intern(image_url),
+                                                   number_of_replicas, resources)
+        return spec
+
+    def prune_specs(self) -> int:
+        """
+        Forget specs (left behind by redeploys with a different spec) that no instance
+        uses any more, and the resource requests only they used. Returns how many specs were dropped.
+        """
+        used = {id(record.spec) for record in self._records.values()}
+        unused = [key for key, spec in self._specs.items() if id(spec) not in used]
+        for key in unused:
+            del self._specs[key]
+        used_resources = {id(spec.resources) for spec in self._specs.values()}
+        for key in [key for key, resources in self._resources.items() if id(resources) not in used_resources]:
+            del self._resources[key]
+        return len(unused)
+
+    def get(self, unique_id: str, default=None) -> Optional[InstanceRecord]:
+        return self._records.get(unique_id, default)
+
+    def __getitem__(self, unique_id: str) -> InstanceRecord:
+        return self._records[unique_id]
+
+    def __contains__(self, unique_id: str) -> bool:
+        return unique_id in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def keys(self):
+        return self._records.keys()
+
+    def values(self):
+        return self._records.values()
+
+    def items(self):
+        return self._records.items()
@@ -0,0 +1,349 @@
+import base64
+import bisect
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.placement_record import PlacementRecord
+from placement_index import PlacementIndex
+from status_stream import INSTANCE_STATUS_PREFIX
+from worker_registry import REGISTRY_PREFIX
+
+import sys
+import os
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage_interface.storage_service_wrapper import StorageService, WatchEvent
+
+ReplicaKey = Tuple[str, int]
+
+
+def encode_cursor(key: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Any:
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+    return tuple(key) if isinstance(key, list) else key
+
+
+def _insert(keys: List, key) -> None:
+    index = bisect.bisect_left(keys, key)
+    if index == len(keys) or keys[index] != key:
+        keys.insert(index, key)
+
+
+def _remove(keys: List, key) -> None:
+    index = bisect.bisect_left(keys, key)
+    if index < len(keys) and keys[index] == key:
+        del keys[index]
+
+
+class InventoryView:
+    """
+    Materialized view of the cluster inventory (tasks, replicas and workers), kept
+    current by storage watches so list requests never touch storage or workers.
+
+    Replicas, tasks and workers are kept in sorted key lists (all, and one per filter
+    value: by worker, by status) so a page is a bisect plus a slice. Every row carries
+    a view version that changes whenever the row does, for a task whenever any of its
+    replicas is added, changed or removed; page ETags are derived from those versions.
+    """
+
+    def __init__(self, storage: StorageService):
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._version = 0
+        self._watch_ids = []
+
+        self._replicas: Dict[ReplicaKey, dict] = {}
+        self._replica_keys: List[ReplicaKey] = []
+        self._by_worker: Dict[str, List[ReplicaKey]] = {}
+        self._by_status: Dict[str, List[ReplicaKey]] = {}
+        self._tasks: Dict[str, List[int]] = {}
+        self._task_keys: List[str] = []
+        self._task_versions: Dict[str, int] = {}
+        # Tasks with a replica on each worker / in each status, and workers with a replica in each status
+        self._tasks_by_worker: Dict[str, List[str]] = {}
+        self._tasks_by_status: Dict[str, List[str]] = {}
+        self._workers_by_status: Dict[str, List[str]] = {}
+        # Replica counts behind those indexes: (worker or status, task or worker) -> replicas
+        self._task_worker_counts: Dict[Tuple[str, str], int] = {}
+        self._task_status_counts: Dict[Tuple[str, str], int] = {}
+        self._worker_status_members: Dict[Tuple[str, str], int] = {}
+        self._by_unique_id: Dict[str, ReplicaKey] = {}
+        # Worker-reported state, kept even before the matching placement is seen
+        self._reported: Dict[str, str] = {}
+
+        self._workers: Dict[str, dict] = {}
+        self._worker_keys: List[str] = []
+        self._worker_versions: Dict[str, int] = {}
+        self._worker_status_counts: Dict[str, Dict[str, int]] = {}
+
+    def start(self) -> None:
+        # Watch first so nothing written during the initial load is missed
+        self._watch_ids.append(self.storage.watch_prefix(PlacementIndex.TASK_PREFIX, self._on_placement_event))
+        self._watch_ids.append(self.storage.watch_prefix(INSTANCE_STATUS_PREFIX, self._on_instance_event))
+        self._watch_ids.append(self.storage.watch_prefix(REGISTRY_PREFIX, self._on_registry_event))
+        for key, value in self.storage.get_prefix(INSTANCE_STATUS_PREFIX).items():
+            self._on_instance_event(WatchEvent(WatchEvent.PUT, key, value, 0))
+        for key, value in self.storage.get_prefix(REGISTRY_PREFIX).items():
+            self._on_registry_event(WatchEvent(WatchEvent.PUT, key, value, 0))
+        for key, value in self.storage.get_prefix(PlacementIndex.TASK_PREFIX).items():
+            self._on_placement_event(WatchEvent(WatchEvent.PUT, key, value, 0))
+
+    def stop(self) -> None:
+        for watch_id in self._watch_ids:
+            self.storage.cancel_watch(watch_id)
+        self._watch_ids = []
+
+    # Queries
+
+    def list_replicas(self, limit: int, cursor: Optional[str] = None, task_name: Optional[str] = None,
+                      worker_name: Optional[str] = None, status: Optional[str] = None) -> dict:
+        after = decode_cursor(cursor)
+        with self._lock:
+            # Walk the smallest index that satisfies one filter, check the others per row
+            if task_name is not None:
+                keys = [(task_name, index) for index in self._tasks.get(task_name, [])]
+            elif worker_name is not None:
+                keys = self._by_worker.get(worker_name, [])
+            elif status is not None:
+                keys = self._by_status.get(status, [])
+            else:
+                keys = self._replica_keys
+
+            def matches(row):
+                return (worker_name is None or row["worker_name"] == worker_name) and \
+                       (status is None or row["status"] == status)
+
+            return self._page(keys, after, limit, lambda key: self._replicas[key], matches)
+
+    def list_tasks(self, limit: int, cursor: Optional[str] = None, worker_name: Optional[str] = None,
+                   status: Optional[str] = None) -> dict:
+        after = decode_cursor(cursor)
+        with self._lock:
+            if worker_name is not None:
+                keys = self._tasks_by_worker.get(worker_name, [])
+            elif status is not None:
+                keys = self._tasks_by_status.get(status, [])
+            else:
+                keys = self._task_keys
+
+            def matches(row):
+                return (worker_name is None or worker_name in row["workers"]) and \
+                       (status is None or status in row["status_counts"])
+
+            return self._page(keys, after, limit, self._task_row, matches)
+
+    def list_workers(self, limit: int, cursor: Optional[str] = None, status: Optional[str] = None) -> dict:
+        after = decode_cursor(cursor)
+        with self._lock:
+            keys = self._workers_by_status.get(status, []) if status is not None else self._worker_keys
+
+            def load_row(worker_name):
+                # Workers with replicas but no registration are not listed
+                return self._worker_row(worker_name) if worker_name in self._workers else None
+
+            return self._page(keys, after, limit, load_row, lambda row: True)
+
+    def _page(self, keys: List, after, limit: int, load_row, matches) -> dict:
+        """Caller holds the lock. Rows that load_row returns None for are skipped."""
+        try:
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+        except TypeError:
+            raise ValueError("Invalid cursor")
+        items = []
+        last_key = None
+        index = start
+        while index < len(keys) and len(items) < limit:
+            key = keys[index]
+            row = load_row(key)
+            if row is not None and matches(row):
+                items.append(row)
+                last_key = key
+            index += 1
+        has_more = index < len(keys)
+        next_cursor = encode_cursor(last_key) if has_more and last_key is not None else None
+
+        digest = hashlib.blake2b(digest_size=12)
+        for row in items:
+            digest.update(f"{row['key']}:{row['version']};".encode())
+        digest.update(str(next_cursor).encode())
+        return {"items": items, "next_cursor": next_cursor, "etag": f'W/"{digest.hexdigest()}"'}
+
+    def _task_row(self, task_name: str) -> dict:
+        replicas = [self._replicas[(task_name, index)] for index in self._tasks.get(task_name, [])]
+        status_counts: Dict[str, int] = {}
+        workers: Dict[str, int] = {}
+        for replica in replicas:
+            status_counts[replica["status"]] = status_counts.get(replica["status"], 0) + 1
+            workers[replica["worker_name"]] = workers.get(replica["worker_name"], 0) + 1
+        return {
+            "key": task_name,
+            "task_name": task_name,
+            "replicas": len(replicas),
+            "status_counts": status_counts,
+            "workers": workers,
+            "version": self._task_versions.get(task_name, 0)
+        }
+
+    def _worker_row(self, worker_name: str) -> dict:
+        row = dict(self._workers[worker_name])
+        row["key"] = worker_name
+        row["replicas"] = len(self._by_worker.get(worker_name, []))
+        row["status_counts"] = {status: count for status, count
+                                in self._worker_status_counts.get(worker_name, {}).items() if count}
+        row["version"] = self._worker_versions.get(worker_name, 0)
+        return row
+
+    # Storage events
+
+    def _next_version(self) -> int:
+        self._version += 1
+        return self._version
+
+    @staticmethod
+    def _count(index: Dict[str, List[str]], counts: Dict[Tuple[str, str], int], group: str, member: str,
+               delta: int) -> None:
+        """Caller holds the lock. Count a replica in or out; `member` is in index[group] while its count is positive."""
+        count = counts.get((group, member), 0) + delta
+        if count > 0:
+            counts[(group, member)] = count
+            if count == delta:
+                _insert(index.setdefault(group, []), member)
+        else:
+            counts.pop((group, member), None)
+            members = index.get(group)
+            if members is not None:
+                _remove(members, member)
+                if not members:
+                    del index[group]
+
+    def _count_replica(self, row: dict, delta: int, status: bool = True, worker: bool = True) -> None:
+        """Caller holds the lock. Add (1) or remove (-1) a replica row from the task and worker indexes."""
+        task_name, worker_name = row["task_name"], row["worker_name"]
+        if worker:
+            self._count(self._tasks_by_worker, self._task_worker_counts, worker_name, task_name, delta)
+        if status:
+            self._count(self._tasks_by_status, self._task_status_counts, row["status"], task_name, delta)
+            self._count(self._workers_by_status, self._worker_status_members, row["status"], worker_name, delta)
+
+    def _on_placement_event(self, event: WatchEvent) -> None:
+        task_name = event.key[len(PlacementIndex.TASK_PREFIX):]
+        records = []
+        if event.event_type == WatchEvent.PUT:
+            records = [PlacementRecord.from_dict(data) for data in (event.value or {}).values()]
+        with self._lock:
+            current = {record.get_replica_index for record in records}
+            for index in list(self._tasks.get(task_name, [])):
+                if index not in current:
+                    self._remove_replica((task_name, index))
+            for record in records:
+                self._put_replica(record)
+            if not self._tasks.get(task_name):
+                self._tasks.pop(task_name, None)
+                _remove(self._task_keys, task_name)
+                self._task_versions.pop(task_name, None)
+
+    def _on_instance_event(self, event: WatchEvent) -> None:
+        unique_id = event.key[len(INSTANCE_STATUS_PREFIX):].split("/", 1)[-1]
+        with self._lock:
+            if event.event_type == WatchEvent.DELETE or not event.value:
+                self._reported.pop(unique_id, None)
+                return
+            self._reported[unique_id] = event.value.get("status")
+            key = self._by_unique_id.get(unique_id)
+            if key is not None:
+                row = self._replicas[key]
+                self._set_replica(key, dict(row, reported_status=self._reported[unique_id],
+                                            status=self._reported[unique_id]))
+
+    def _on_registry_event(self, event: WatchEvent) -> None:
+        worker_name = event.key[len(REGISTRY_PREFIX):]
+        with self._lock:
+            if event.event_type == WatchEvent.DELETE or not event.value:
+                self._workers.pop(worker_name, None)
+                _remove(self._worker_keys, worker_name)
+                return
+            self._workers[worker_name] = dict(event.value)
+            self._worker_versions[worker_name] = self._next_version()
+            _insert(self._worker_keys, worker_name)
+
+    def _put_replica(self, record: PlacementRecord) -> None:
+        """Caller holds the lock."""
+        key = (record.get_task_name, record.get_replica_index)
+        existing = self._replicas.get(key)
+        requested = record.get_status.value
+        if existing is not None and existing["worker_name"] == record.get_worker_name and \
+                existing["requested_status"] == requested and existing["revision"] == record.get_revision:
+            return
+        if existing is not None and existing["worker_name"] != record.get_worker_name:
+            self._remove_replica(key)
+            existing = None
+
+        reported = self._reported.get(record.get_unique_id)
+        if existing is None or existing["requested_status"] != requested:
+            # A new request supersedes whatever the worker reported before it
+            status = requested
+        else:
+            status = existing["status"]
+        if existing is None and reported is not None:
+            status = reported
+        self._by_unique_id[record.get_unique_id] = key
+        self._set_replica(key, {
+            "key": list(key),
+            "unique_id": record.get_unique_id,
+            "task_name": record.get_task_name,
+            "replica_index": record.get_replica_index,
+            "worker_name": record.get_worker_name,
+            "requested_status": requested,
+            "reported_status": reported,
+            "status": status,
+            "revision": record.get_revision
+        })
+
+    def _set_replica(self, key: ReplicaKey, row: dict) -> None:
+        """Caller holds the lock. Replaces the row (rows are never mutated in place)."""
+        previous = self._replicas.get(key)
+        row["version"] = self._next_version()
+        self._replicas[key] = row
+        if previous is None:
+            _insert(self._replica_keys, key)
+            _insert(self._tasks.setdefault(key[0], []), key[1])
+            _insert(self._task_keys, key[0])
+            _insert(self._by_worker.setdefault(row["worker_name"], []), key)
+            self._count_replica(row, 1, status=False)
+        if previous is None or previous["status"] != row["status"]:
+            counts = self._worker_status_counts.setdefault(row["worker_name"], {})
+            if previous is not None:
+                _remove(self._by_status.get(previous["status"], []), key)
+                counts[previous["status"]] -= 1
+                self._count_replica(previous, -1, worker=False)
+            _insert(self._by_status.setdefault(row["status"], []), key)
+            counts[row["status"]] = counts.get(row["status"], 0) + 1
+            self._count_replica(row, 1, worker=False)
+        self._worker_versions[row["worker_name"]] = row["version"]
+        self._task_versions[key[0]] = row["version"]
+
+    def _remove_replica(self, key: ReplicaKey) -> None:
+        """Caller holds the lock."""
+        row = self._replicas.pop(key, None)
+        if row is None:
+            return
+        _remove(self._replica_keys, key)
+        _remove(self._tasks.get(key[0], []), key[1])
+        _remove(self._by_worker.get(row["worker_name"], []), key)
+        _remove(self._by_status.get(row["status"], []), key)
+        self._worker_status_counts[row["worker_name"]][row["status"]] -= 1
+        self._count_replica(row, -1)
+        self._by_unique_id.pop(row["unique_id"], None)
+        version = self._next_version()
+        self._worker_versions[row["worker_name"]] = version
+        self._task_versions[key[0]] = version
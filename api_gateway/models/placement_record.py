@@ -0,0 +1,72 @@
+from pydantic import BaseModel
+from models.service_instance import Status
+
+class PlacementRecord(BaseModel):
+    task_name: str
+    replica_index: int
+    worker_name: str
+    status: Status
+    revision: int = 0
+
+    # Getter for task_name.
+    @property
+    def get_task_name(self) -> str:
+        return self.task_name
+
+    # Getter for replica_index.
+    @property
+    def get_replica_index(self) -> int:
+        return self.replica_index
+
+    # Getter for worker_name.
+    @property
+    def get_worker_name(self) -> str:
+        return self.worker_name
+
+    # Getter for status.
+    @property
+    def get_status(self) -> Status:
+        return self.status
+
+    # Getter for revision.
+    @property
+    def get_revision(self) -> int:
+        return self.revision
+
+    # The id the worker node stores this replica under. It is only ever built
+    # from the record fields, never parsed back apart.
+    @property
+    def get_unique_id(self) -> str:
+        return f"{self.task_name}-{self.worker_name}-{self.replica_index}"
+
+    # Method to convert the object into a JSON-ready dictionary.
+    def to_json_dict(self) -> dict:
+        return self.model_dump(mode="json")
+
+    # A class method that creates an instance from a dictionary.
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls.model_validate(data)
+
+# Example usage
+if __name__ == '__main__':
+    sample_data = {
+        "task_name": "web-frontend",
+        "replica_index": 0,
+        "worker_name": "worker-east-1",
+        "status": "deploy requested",
+        "revision": 1
+    }
+
+    # Create an instance of PlacementRecord from a dictionary.
+    record = PlacementRecord.from_dict(sample_data)
+
+    # Access the fields using the getter properties.
+    print("Task Name:", record.get_task_name)
+    print("Replica Index:", record.get_replica_index)
+    print("Worker Name:", record.get_worker_name)
+    print("Status:", record.get_status)
+    print("Unique ID:", record.get_unique_id)
+
+    # Convert the instance back to a JSON dictionary.
+    print("JSON Dictionary:", record.to_json_dict())
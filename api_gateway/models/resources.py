@@ -39,7 +39,7 @@ class Resources(BaseModel):
         Meant to represent an available resources object.
         """
         total_specs = total.get_specs
-        used_specs = used.get_current_usage
+        used_specs = used.get_resource_usage
         available = cls(
             cpu=total_specs.get_cpu - used_specs.get_cpu,
             ram=total_specs.get_ram - used_specs.get_ram,
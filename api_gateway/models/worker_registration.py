@@ -0,0 +1,64 @@
+from pydantic import BaseModel
+from typing import Any, Dict
+
+class WorkerRegistration(BaseModel):
+    worker_name: str
+    endpoint: str
+    port: int
+    capabilities: Dict[str, Any] = {}
+
+    # Getter for worker_name.
+    @property
+    def get_worker_name(self) -> str:
+        return self.worker_name
+
+    # Getter for endpoint (host name or IP the worker API listens on).
+    @property
+    def get_endpoint(self) -> str:
+        return self.endpoint
+
+    # Getter for port.
+    @property
+    def get_port(self) -> int:
+        return self.port
+
+    # Getter for capabilities.
+    @property
+    def get_capabilities(self) -> Dict[str, Any]:
+        return self.capabilities
+
+    # Base URL of the worker API.
+    @property
+    def get_base_url(self) -> str:
+        return f"http://{self.endpoint}:{self.port}"
+
+    # Method to convert the object into a JSON-ready dictionary.
+    def to_json_dict(self) -> dict:
+        return self.model_dump()
+
+    # A class method that creates an instance from a dictionary.
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls.model_validate(data)
+
+# Example usage
+if __name__ == '__main__':
+    sample_data = {
+        "worker_name": "worker1",
+        "endpoint": "10.0.0.12",
+        "port": 8001,
+        "capabilities": {
+            "runtime": "local"
+        }
+    }
+
+    # Create an instance of WorkerRegistration from a dictionary.
+    registration = WorkerRegistration.from_dict(sample_data)
+
+    # Access the fields using the getter properties.
+    print("Worker Name:", registration.get_worker_name)
+    print("Base URL:", registration.get_base_url)
+    print("Capabilities:", registration.get_capabilities)
+
+    # Convert the instance back to a JSON dictionary.
+    print("JSON Dictionary:", registration.to_json_dict())
@@ -0,0 +1,110 @@
+from typing import Callable, Dict, Iterable, List, Optional
+
+from models.placement_record import PlacementRecord
+from models.service_instance import Status
+
+import sys
+import os
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage_interface.storage_service_wrapper import StorageService
+
+
+class PlacementIndex:
+    """
+    Keeps track of where every replica of a task was placed.
+
+    Each record is stored twice:
+        /placements/tasks/{task_name}                 -> {replica_index: record}
+        /placements/workers/{worker_name}/{unique_id} -> record
+    Lifecycle calls go by task, which is a single keyed read. Worker entries are one
+    key per replica so a busy worker never has a large value rewritten on each deploy.
+    """
+
+    TASK_PREFIX = "/placements/tasks/"
+    WORKER_PREFIX = "/placements/workers/"
+    # Compare-and-swap retries before a contended task write is given up
+    MAX_SWAP_ATTEMPTS = 10
+
+    def __init__(self, storage: StorageService):
+        self.storage = storage
+
+    def task_key(self, task_name: str) -> str:
+        return f"{self.TASK_PREFIX}{task_name}"
+
+    def worker_key(self, worker_name: str, unique_id: str) -> str:
+        return f"{self.WORKER_PREFIX}{worker_name}/{unique_id}"
+
+    def get_replicas(self, task_name: str) -> List[PlacementRecord]:
+        """Get every replica of a task, ordered by replica index."""
+        records = self._read(self.task_key(task_name))
+        return sorted(records.values(), key=lambda record: record.get_replica_index)
+
+    def put_replicas(self, task_name: str, records: List[PlacementRecord]) -> None:
+        """Replace the placement of a task with the given records."""
+        task_records = {str(record.get_replica_index): record for record in records}
+        previous = self._swap(self.task_key(task_name), lambda _: task_records)
+
+        # Drop replicas that are gone or moved, then write the new ones
+        current = {record.get_unique_id for record in records}
+        for record in previous.values():
+            if record.get_unique_id not in current:
+                self.storage.delete(self.worker_key(record.get_worker_name, record.get_unique_id))
+        for record in records:
+            self.storage.put(self.worker_key(record.get_worker_name, record.get_unique_id), record.to_json_dict())
+
+    def update_status(self, task_name: str, status: Status,
+                      replica_indexes: Optional[Iterable[int]] = None) -> List[PlacementRecord]:
+        """
+        Set the status of some (default all) replicas of a task and bump their revision.
+        Returns the updated records.
+        """
+        updated: List[PlacementRecord] = []
+
+        def set_status(task_records: Dict[str, PlacementRecord]) -> Optional[Dict[str, PlacementRecord]]:
+            updated.clear()
+            if replica_indexes is None:
+                selected = list(task_records.keys())
+            else:
+                selected = [str(index) for index in replica_indexes if str(index) in task_records]
+            for index in selected:
+                record = task_records[index].model_copy(
+                    update={"status": status, "revision": task_records[index].get_revision + 1}
+                )
+                task_records[index] = record
+                updated.append(record)
+            return task_records if updated else None
+
+        self._swap(self.task_key(task_name), set_status)
+        for record in updated:
+            self.storage.put(self.worker_key(record.get_worker_name, record.get_unique_id), record.to_json_dict())
+        return updated
+
+    def _swap(self, key: str,
+              change: Callable[[Dict[str, PlacementRecord]], Optional[Dict[str, PlacementRecord]]]
+              ) -> Dict[str, PlacementRecord]:
+        """
+        Read-modify-write the records under a task key. `change` gets the stored records
+        and returns the ones to write (None: write nothing); the write only lands if the
+        key is unchanged since the read, otherwise it is re-read and `change` runs again.
+        Returns the records that were replaced.
+        """
+        for _ in range(self.MAX_SWAP_ATTEMPTS):
+            stored, revision = self.storage.get_with_revision(key)
+            previous = self._decode(stored)
+            records = change(dict(previous))
+            if records is None:
+                return previous
+            encoded = {entry_key: record.to_json_dict() for entry_key, record in records.items()}
+            if self.storage.put_if_revision(key, encoded, revision):
+                return previous
+        raise RuntimeError(f"Placement of {key} kept changing; gave up after {self.MAX_SWAP_ATTEMPTS} attempts")
+
+    def _read(self, key: str) -> Dict[str, PlacementRecord]:
+        return self._decode(self.storage.get(key))
+
+    @staticmethod
+    def _decode(stored: Optional[dict]) -> Dict[str, PlacementRecord]:
+        if not stored:
+            return {}
+        return {entry_key: PlacementRecord.from_dict(data) for entry_key, data in stored.items()}
@@ -0,0 +1,200 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from models.placement_record import PlacementRecord
+from placement_index import PlacementIndex
+
+import sys
+import os
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage_interface.storage_service_wrapper import StorageService, WatchEvent
+
+# Worker nodes report the state of each instance they run under this prefix
+INSTANCE_STATUS_PREFIX = "/instance_status/"
+
+
+def instance_status_key(worker_name: str, unique_id: str) -> str:
+    return f"{INSTANCE_STATUS_PREFIX}{worker_name}/{unique_id}"
+
+
+def parse_token(token: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Resume tokens are '{storage revision}-{position within that revision}'."""
+    if not token:
+        return None
+    try:
+        revision, position = token.split("-", 1)
+        return int(revision), int(position)
+    except ValueError:
+        return None
+
+
+class Subscription:
+    """One client's view of the stream: a queue of events matching its filters."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, task_name: Optional[str], worker_name: Optional[str],
+                 max_pending: int):
+        self.loop = loop
+        self.task_name = task_name
+        self.worker_name = worker_name
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.replay: List[dict] = []
+        # Set when the client must start over: its token is too old, or it fell too far behind
+        self.resync_required = False
+        self.overflowed = False
+
+    def matches(self, event: dict) -> bool:
+        if self.task_name is not None and event["task_name"] != self.task_name:
+            return False
+        if self.worker_name is not None and event["worker_name"] != self.worker_name:
+            return False
+        return True
+
+    def deliver(self, event: dict) -> None:
+        """Runs on the subscriber's event loop."""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class StatusEventBroker:
+    """
+    Turns storage change events into task and replica state transitions and fans them
+    out to streaming clients. Placement writes from the gateway give the requested
+    states; instance status keys from the workers give the reported states. A bounded
+    history lets clients resume from a token instead of resyncing.
+    """
+
+    def __init__(self, storage: StorageService, history_size: int = 10000, max_pending: int = 1000):
+        self.storage = storage
+        self.max_pending = max_pending
+        self._history: deque = deque(maxlen=history_size)
+        self._subscribers: List[Subscription] = []
+        self._lock = threading.Lock()
+        # Last known status per (task, replica index), to turn whole-task placement writes into transitions
+        self._placement_status: Dict[Tuple[str, int], str] = {}
+        # unique_id -> (task, replica index), so worker reports can be tied back to a replica
+        self._replicas: Dict[str, Tuple[str, int]] = {}
+        self._last_revision = 0
+        self._position = 0
+        # Token of the newest event that has fallen out of history
+        self._dropped_upto: Optional[Tuple[int, int]] = None
+        # Oldest storage revision this broker has seen; anything before it happened before the watch
+        self._first_revision: Optional[int] = None
+        self._watch_ids = []
+
+    def start(self) -> None:
+        self._watch_ids.append(self.storage.watch_prefix(PlacementIndex.TASK_PREFIX, self._on_placement_event))
+        self._watch_ids.append(self.storage.watch_prefix(INSTANCE_STATUS_PREFIX, self._on_instance_event))
+        # Learn the current placements without replaying them as transitions
+        for key, value in self.storage.get_prefix(PlacementIndex.TASK_PREFIX).items():
+            with self._lock:
+                for data in (value or {}).values():
+                    record = PlacementRecord.from_dict(data)
+                    self._remember(record)
+
+    def stop(self) -> None:
+        for watch_id in self._watch_ids:
+            self.storage.cancel_watch(watch_id)
+        self._watch_ids = []
+
+    def subscribe(self, task_name: Optional[str] = None, worker_name: Optional[str] = None,
+                  resume_token: Optional[str] = None) -> Subscription:
+        """Register a client. Must be called from the event loop that will consume it."""
+        subscription = Subscription(asyncio.get_running_loop(), task_name, worker_name, self.max_pending)
+        resume = parse_token(resume_token)
+        with self._lock:
+            if resume is not None:
+                if self._first_revision is None or resume[0] < self._first_revision or \
+                        (self._dropped_upto is not None and resume < self._dropped_upto):
+                    # Events after the token were never seen by this broker (it started later,
+                    # e.g. a restart or another gateway process) or have been dropped from history
+                    subscription.resync_required = True
+                else:
+                    subscription.replay = [event for event in self._history
+                                           if self._token_key(event) > resume and subscription.matches(event)]
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def _remember(self, record: PlacementRecord) -> None:
+        self._placement_status[(record.get_task_name, record.get_replica_index)] = record.get_status.value
+        self._replicas[record.get_unique_id] = (record.get_task_name, record.get_replica_index)
+
+    def _on_placement_event(self, event: WatchEvent) -> None:
+        task_name = event.key[len(PlacementIndex.TASK_PREFIX):]
+        with self._lock:
+            self._observe(event.revision)
+            if event.event_type == WatchEvent.DELETE:
+                for key in [key for key in self._placement_status if key[0] == task_name]:
+                    del self._placement_status[key]
+                for unique_id in [uid for uid, replica in self._replicas.items() if replica[0] == task_name]:
+                    del self._replicas[unique_id]
+                return
+            for data in (event.value or {}).values():
+                record = PlacementRecord.from_dict(data)
+                previous = self._placement_status.get((record.get_task_name, record.get_replica_index))
+                self._remember(record)
+                if previous != record.get_status.value:
+                    self._publish({
+                        "task_name": record.get_task_name,
+                        "replica_index": record.get_replica_index,
+                        "worker_name": record.get_worker_name,
+                        "unique_id": record.get_unique_id,
+                        "status": record.get_status.value,
+                        "reported_by": "gateway"
+                    }, event.revision)
+
+    def _on_instance_event(self, event: WatchEvent) -> None:
+        if event.event_type == WatchEvent.DELETE or not event.value:
+            return
+        worker_name, unique_id = event.key[len(INSTANCE_STATUS_PREFIX):].split("/", 1)
+        with self._lock:
+            self._observe(event.revision)
+            task_name, replica_index = self._replicas.get(unique_id, (event.value.get("task_name"), None))
+            self._publish({
+                "task_name": task_name,
+                "replica_index": replica_index,
+                "worker_name": worker_name,
+                "unique_id": unique_id,
+                "status": event.value.get("status"),
+                "reported_by": "worker"
+            }, event.revision)
+
+    def _observe(self, revision: int) -> None:
+        """Caller holds the lock."""
+        if self._first_revision is None or revision < self._first_revision:
+            self._first_revision = revision
+
+    def _publish(self, event: dict, revision: int) -> None:
+        """Caller holds the lock."""
+        if revision != self._last_revision:
+            self._last_revision = revision
+            self._position = 0
+        else:
+            self._position += 1
+        event["revision"] = revision
+        event["id"] = f"{revision}-{self._position}"
+        if len(self._history) == self._history.maxlen:
+            self._dropped_upto = self._token_key(self._history[0])
+        self._history.append(event)
+        for subscription in self._subscribers:
+            if subscription.matches(event):
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+                except RuntimeError:
+                    # The subscriber's loop is gone; it is dropped when its stream ends
+                    pass
+
+    @staticmethod
+    def _token_key(event: dict) -> Tuple[int, int]:
+        return parse_token(event["id"])
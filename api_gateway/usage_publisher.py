@@ -0,0 +1,121 @@
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import sys
+import os
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage_interface.storage_service_wrapper import StorageService
+
+
+def _numeric_leaves(value: Any, prefix: str = "") -> Dict[str, float]:
+    """Flatten the numbers in a nested dict, e.g. {"a": {"b": 1}} -> {"a.b": 1}."""
+    leaves = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            leaves.update(_numeric_leaves(child, f"{prefix}{key}."))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        leaves[prefix.rstrip(".")] = value
+    return leaves
+
+
+class UsagePublisher:
+    """
+    Write-behind publisher for values a worker reports to storage (current usage and
+    the like). Updates only replace the pending value; a background thread writes the
+    latest one every `interval` seconds, or right away when a number moved by more than
+    `threshold` (a fraction of its last published value). Unchanged values are never
+    rewritten, so a burst of deploys costs one write instead of one per deploy.
+    """
+
+    def __init__(self, storage: StorageService, interval: float = 1.0, threshold: float = 0.1,
+                 encode: Optional[Callable[[Any], Any]] = None):
+        self.storage = storage
+        # Applied to a value just before it is written, e.g. json.dumps
+        self.encode = encode
+        self.interval = interval
+        self.threshold = threshold
+        self._pending: Dict[str, Any] = {}
+        self._published: Dict[str, Any] = {}
+        self._cond = threading.Condition()
+        # Flushes run one at a time, so an older value can never be written after a newer one
+        self._flush_lock = threading.Lock()
+        self._urgent = False
+        self._running = True
+        self.writes = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def update(self, key: str, value: Any) -> None:
+        """Record the newest value for a key; it is written at the next flush."""
+        with self._cond:
+            if value == self._published.get(key, None) and key not in self._pending:
+                return
+            self._pending[key] = value
+            if self._crosses_threshold(self._published.get(key), value):
+                self._urgent = True
+                self._cond.notify()
+
+    def mark_published(self, key: str, value: Any) -> None:
+        """Tell the publisher a value was written to storage by someone else."""
+        with self._cond:
+            self._published[key] = value
+            if self._pending.get(key) == value:
+                del self._pending[key]
+
+    def flush(self) -> int:
+        """Write every pending value that differs from what was last published. Returns the writes made."""
+        with self._flush_lock:
+            with self._cond:
+                pending = self._pending
+                self._pending = {}
+                self._urgent = False
+            written = 0
+            for key, value in pending.items():
+                if self._published.get(key) == value:
+                    continue
+                try:
+                    self.storage.put(key, self.encode(value) if self.encode else value)
+                except Exception as e:
+                    print(f"Error publishing {key}: {e}")
+                    # Keep it for the next flush unless something newer arrived meanwhile
+                    with self._cond:
+                        self._pending.setdefault(key, value)
+                    continue
+                with self._cond:
+                    self._published[key] = value
+                written += 1
+            self.writes += written
+            return written
+
+    def stop(self) -> None:
+        """Stop the background thread after a final flush."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=self.interval + 1)
+        self.flush()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._urgent and self._running:
+                    self._cond.wait(self.interval)
+                if not self._running:
+                    return
+            self.flush()
+
+    def _crosses_threshold(self, published: Optional[Any], value: Any) -> bool:
+        if published is None:
+            return True
+        old_leaves = _numeric_leaves(published)
+        for name, new in _numeric_leaves(value).items():
+            old = old_leaves.get(name)
+            if old is None:
+                return True
+            if old == 0:
+                if new != 0:
+                    return True
+            elif abs(new - old) / abs(old) >= self.threshold:
+                return True
+        return False
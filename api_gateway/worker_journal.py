@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+
+from models.service_instance import Status
+from instance_store import InstanceRecord, InstanceStore
+
+
+class WorkerJournal:
+    """
+    Local, append-only record of a worker's instances, so a restarted worker gets its
+    state back from disk instead of starting empty.
+
+    Every change is one JSON line in journal.log. Once `snapshot_every` lines have been
+    written the full state goes to snapshot.json (written to a temp file, then renamed)
+    and the log starts over. Loading reads the snapshot and replays the log after it;
+    a torn last line from a crash mid-write is ignored.
+    """
+
+    SNAPSHOT_FILE = "snapshot.json"
+    LOG_FILE = "journal.log"
+
+    def __init__(self, directory: str, snapshot_every: int = 1000, sync: bool = False):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        # fsync after every entry; safer against power loss, much slower
+        self.sync = sync
+        self.snapshot_path = os.path.join(directory, self.SNAPSHOT_FILE)
+        self.log_path = os.path.join(directory, self.LOG_FILE)
+        self.entries_since_snapshot = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._log = open(self.log_path, "a", encoding="utf-8")
+        # End a torn last line so the next entry does not get glued onto it
+        if self._log.tell() > 0:
+            with open(self.log_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._log.write("\n")
+                    self._log.flush()
+
+    @property
+    def snapshot_due(self) -> bool:
+        return self.entries_since_snapshot >= self.snapshot_every
+
+    def load(self) -> InstanceStore:
+        """Rebuild the instances from the snapshot and the log entries written after it."""
+        instances = InstanceStore()
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                for data in json.load(f).values():
+                    instances.put_dict(data)
+
+        replayed = 0
+        with open(self.log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Ignoring damaged journal entry in {self.log_path}")
+                    continue
+                self._replay(instances, entry)
+                replayed += 1
+        self.entries_since_snapshot = replayed
+        return instances
+
+    def record_put(self, instance: InstanceRecord) -> None:
+        self._append({"op": "put", "instance": instance.to_json_dict()})
+
+    def record_status(self, unique_id: str, status: Status) -> None:
+        self._append({"op": "status", "unique_id": unique_id, "status": status.value})
+
+    def snapshot(self, instances: InstanceStore) -> None:
+        """Write the full state and start a new, empty log."""
+        data = {unique_id: instance.to_json_dict() for unique_id, instance in instances.items()}
+        temp_path = self.snapshot_path + ".tmp"
+        with self._lock:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.snapshot_path)
+            self._log.close()
+            self._log = open(self.log_path, "w", encoding="utf-8")
+            self.entries_since_snapshot = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._log.close()
+
+    def _append(self, entry: dict) -> None:
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._log.write(line)
+            self._log.flush()
+            if self.sync:
+                os.fsync(self._log.fileno())
+            self.entries_since_snapshot += 1
+
+    @staticmethod
+    def _replay(instances: InstanceStore, entry: dict) -> None:
+        op = entry.get("op")
+        if op == "put":
+            instances.put_dict(entry["instance"])
+        elif op == "status":
+            instance = instances.get(entry["unique_id"])
+            if instance is not None:
+                instance.status = Status(entry["status"])
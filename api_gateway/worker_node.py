@@ -3,6 +3,9 @@ import os
 import signal
 import sys
 import argparse
+import threading
+import time
+import uuid
 from enum import Enum
 from typing import Dict, Any, Optional, List
 
@@ -15,35 +18,97 @@ sys.path.append(current_dir)
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Body, Request, Response
 from pydantic import BaseModel
 import uvicorn
-from storage_interface.storage_service_wrapper import EtcdStorage, StorageService
+from storage_interface.storage_service_wrapper import EtcdStorage, StorageService, WatchEvent
 
 # Import existing models
 from models.service import Service
-from models.service_instance import ServiceInstance, Status
+from models.service_instance import Status
 from models.resources import Resources
 from models.specs import Specs
 from models.resource_usage import ResourceUsage
+from models.worker_registration import WorkerRegistration
+from worker_registry import register_worker
+from status_stream import instance_status_key
+from usage_publisher import UsagePublisher
+from worker_reconciler import WorkerReconciler
+from worker_journal import WorkerJournal
+from instance_runtime import InstanceRuntime, LocalProcessRuntime, NoopRuntime, load_image_commands
+from instance_store import InstanceRecord, InstanceStore
+
+# Instances in these states hold their requested resources on the node
+RESOURCE_HOLDING_STATUSES = (Status.DEPLOYED, Status.STARTED)
 
 class WorkerNode:
-    def __init__(self, worker_name, storage_type="etcd", storage_host="127.0.0.1", storage_port=2379, **storage_kwargs):
+    def __init__(self, worker_name, storage_type="etcd", storage_host="127.0.0.1", storage_port=2379,
+                 api_port=None, advertise_host="localhost", capabilities=None,
+                 storage: Optional[StorageService] = None, usage_check_interval: Optional[float] = None,
+                 usage_publish_interval: float = 1.0, usage_publish_threshold: float = 0.1,
+                 reconcile: bool = True, reconcile_batch_size: int = 100, state_dir: Optional[str] = None,
+                 snapshot_every: int = 1000, runtime: Optional[InstanceRuntime] = None, **storage_kwargs):
         self.worker_name = worker_name
-        self.services: Dict[str, ServiceInstance] = {}
-        self.api_port = None
-        # Connect to storage
-        self.storage = EtcdStorage(host="127.0.0.1", port=2379)
+        # Compact records; pydantic models are only built at the API boundary
+        self.services = InstanceStore()
+        # Bumped on every instance change; _changed_at keeps each instance's last change, oldest first
+        self.state_version = 0
+        self._changed_at: Dict[str, int] = {}
+        self._boot_id = uuid.uuid4().hex[:8]
+        self._services_cache = None
+        # Running totals of the resources held by instances, updated on every status change
+        self._usage_totals = [0, 0, 0]
+        # Resources of stopped instances being started, held until they are recorded as started
+        self._reservations: Dict[str, InstanceRecord] = {}
+        self._lock = threading.RLock()
+        self.api_port = api_port
+        self.advertise_host = advertise_host
+        self.capabilities = capabilities or {}
+        # What actually runs the instances; by default nothing does and only the status changes
+        self.runtime = runtime if runtime is not None else NoopRuntime()
+        self.runtime.on_exit = self._on_instance_exit
+        # Connect to storage (an already-built storage can be passed in, e.g. TestStorage)
+        self.storage = storage if storage is not None else EtcdStorage(host=storage_host, port=storage_port)
         print(f"Worker node {worker_name} initialized and connected to storage")
+        # Usage is written behind: bursts of deploys are coalesced into one write
+        self.usage_path = f"/workers/{self.worker_name}/current_usage"
+        self.headroom_path = f"/workers/{self.worker_name}/headroom"
+        # Local copy of this worker's specs, kept current by a watch on the specs key
+        self.specs_path = f"/workers/{self.worker_name}/specs"
+        self._specs: Optional[Specs] = None
+        self.usage_publisher = UsagePublisher(self.storage, interval=usage_publish_interval,
+                                              threshold=usage_publish_threshold, encode=json.dumps)
         
+        # Get the instances back from the local journal after a restart
+        self.journal = None
+        if state_dir:
+            self.journal = WorkerJournal(state_dir, snapshot_every=snapshot_every)
+            self.restore_from_journal()
+
         # Register with storage
         self.register_with_storage()
+        self.storage.watch_prefix(self.specs_path, self._on_specs_event)
+        self._set_specs(self.storage.get(self.specs_path))
+        if self.services:
+            self.reconcile_with_storage()
+            self.restart_restored_instances()
+
+        # Apply the deploy/start/stop requests the gateway writes to storage for this worker
+        self.reconciler = WorkerReconciler(self, self.storage, batch_size=reconcile_batch_size)
+        if reconcile:
+            self.reconciler.start()
+
+        # Periodically recount usage from scratch to catch any drift in the running totals
+        if usage_check_interval:
+            self._usage_checker = threading.Thread(target=self._usage_check_loop, args=(usage_check_interval,),
+                                                   daemon=True)
+            self._usage_checker.start()
 
     def register_with_storage(self):
         """Register this worker with storage"""
         try:
             # Set default specs if not already set
-            specs_path = f"/workers/{self.worker_name}/specs"
+            specs_path = self.specs_path
             specs_exists = self.storage.get(specs_path)
             
             if not specs_exists:
@@ -60,8 +125,7 @@ class WorkerNode:
                 print(f"Worker {self.worker_name} already registered")
                 
             # Initialize current usage if not set
-            usage_path = f"/workers/{self.worker_name}/current_usage"
-            usage_exists = self.storage.get(usage_path)
+            usage_exists = self.storage.get(self.usage_path)
             
             if not usage_exists:
                 default_usage = {
@@ -71,14 +135,20 @@ class WorkerNode:
                         "disk": 0
                     }
                 }
-                self.storage.put(usage_path, json.dumps(default_usage))
+                self.storage.put(self.usage_path, json.dumps(default_usage))
+                self.usage_publisher.mark_published(self.usage_path, default_usage)
                 print(f"Initialized current usage for worker {self.worker_name}")
                 
-            # Register worker's API endpoint in storage
+            # Register worker's API endpoint in the worker registry
             if self.api_port:
-                endpoint_path = f"/workers/{self.worker_name}/endpoint"
-                self.storage.put(endpoint_path, f"http://localhost:{self.api_port}")
-                print(f"Registered worker endpoint in storage")
+                registration = WorkerRegistration(
+                    worker_name=self.worker_name,
+                    endpoint=self.advertise_host,
+                    port=self.api_port,
+                    capabilities=self.capabilities
+                )
+                register_worker(self.storage, registration)
+                print(f"Registered worker endpoint {registration.get_base_url} in storage")
             
         except Exception as e:
             print(f"Error registering worker with storage: {e}")
@@ -87,29 +157,50 @@ class WorkerNode:
         """Deploy a new service"""
         print(f"Deploying service: {service.get_service_name} with ID {unique_id}")
         try:
-            # Create a service instance
-            service_instance = ServiceInstance(
-                service_name=service.get_service_name,
-                image_url=service.get_image_url,
-                number_of_replicas=service.get_number_of_replicas,
-                requested_resources=service.get_requested_resources,
-                unique_id=unique_id,
-                status=Status.DEPLOYED
-            )
-            
+            # Refuse what does not fit before anything is stopped or written
+            with self._lock:
+                self._check_deploy_fits(service, self.services.get(unique_id))
+            # A redeploy replaces the instance; one that is running is stopped first, so its
+            # process does not keep running behind the new DEPLOYED status
+            previous = self.services.get(unique_id)
+            if previous is not None and previous.get_status == Status.STARTED:
+                exit_code = self.runtime.stop(unique_id)
+                self._set_status(unique_id, Status.STOPPED)
+                self._publish_instance_status(unique_id, exit_code)
             # Store service instance
-            self.services[unique_id] = service_instance
+            with self._lock:
+                previous = self.services.get(unique_id)
+                self._check_deploy_fits(service, previous)
+                if previous is not None:
+                    self._apply_usage(previous, -1)
+                service_instance = self.services.put(unique_id, service, Status.DEPLOYED)
+                self._apply_usage(service_instance, 1)
+                self._mark_changed(unique_id)
+                if self.journal:
+                    self.journal.record_put(service_instance)
+                    self._snapshot_if_due()
+            self._publish_instance_status(unique_id)
             
             # Update current usage in storage
             self._update_resource_usage()
             
             print(f"Successfully deployed service: {service.get_service_name} with ID {unique_id}")
             return {"status": "success", "message": f"Service {service.get_service_name} deployed successfully"}
+        except HTTPException:
+            raise
         except Exception as e:
             error_msg = f"Error deploying service {service.get_service_name}: {e}"
             print(error_msg)
             raise HTTPException(status_code=500, detail=error_msg)
 
+    def _check_deploy_fits(self, service: Service, previous: Optional[InstanceRecord]):
+        """Caller holds the lock. Raise 409 if the service does not fit in place of `previous`"""
+        shortfall = self._shortfall(service.get_requested_resources, previous)
+        if shortfall:
+            error_msg = f"Service {service.get_service_name} does not fit on {self.worker_name}: {shortfall}"
+            print(error_msg)
+            raise HTTPException(status_code=409, detail=error_msg)
+
     def start_service(self, unique_id: str):
         """Start a deployed service"""
         print(f"Starting service with ID: {unique_id}")
@@ -118,15 +209,24 @@ class WorkerNode:
             print(error_msg)
             raise HTTPException(status_code=404, detail=error_msg)
         
+        # Refuse what does not fit (a stopped instance no longer holds its resources)
+        error_msg = self._reserve_start(unique_id)
+        if error_msg:
+            print(error_msg)
+            raise HTTPException(status_code=409, detail=error_msg)
         try:
-            # Update service status
-            self.services[unique_id].status = Status.STARTED
+            # Launch the instance, then record that it runs
+            self.runtime.start(self.services[unique_id])
+            self._mark_started(unique_id)
+            self._update_resource_usage()
             print(f"Successfully started service with ID: {unique_id}")
             return {"status": "success", "message": f"Service with ID {unique_id} started successfully"}
         except Exception as e:
             error_msg = f"Error starting service with ID {unique_id}: {e}"
             print(error_msg)
             raise HTTPException(status_code=500, detail=error_msg)
+        finally:
+            self._release_start(unique_id)
 
     def stop_service(self, unique_id: str):
         """Stop a running service"""
@@ -137,8 +237,10 @@ class WorkerNode:
             raise HTTPException(status_code=404, detail=error_msg)
         
         try:
-            # Update service status
-            self.services[unique_id].status = Status.STOPPED
+            exit_code = self.runtime.stop(unique_id)
+            self._set_status(unique_id, Status.STOPPED)
+            self._publish_instance_status(unique_id, exit_code)
+            self._update_resource_usage()
             print(f"Successfully stopped service with ID: {unique_id}")
             return {"status": "success", "message": f"Service with ID {unique_id} stopped successfully"}
         except Exception as e:
@@ -146,6 +248,49 @@ class WorkerNode:
             print(error_msg)
             raise HTTPException(status_code=500, detail=error_msg)
 
+    def start_services(self, unique_ids: List[str]) -> Dict[str, Optional[str]]:
+        """Start several deployed services at once. Returns {unique_id: error message or None}"""
+        results = {}
+        instances = []
+        for unique_id in unique_ids:
+            if unique_id not in self.services:
+                results[unique_id] = f"Service with ID {unique_id} not deployed"
+                continue
+            results[unique_id] = self._reserve_start(unique_id)
+            if not results[unique_id]:
+                instances.append(self.services[unique_id])
+        try:
+            results.update(self.runtime.start_many(instances))
+            for unique_id, error in results.items():
+                if error:
+                    print(f"Error starting service with ID {unique_id}: {error}")
+                elif unique_id in self.services:
+                    self._mark_started(unique_id)
+        finally:
+            for instance in instances:
+                self._release_start(instance.get_unique_id)
+        self._update_resource_usage()
+        return results
+
+    def _reserve_start(self, unique_id: str) -> Optional[str]:
+        """
+        Check that an instance about to be started fits and hold its resources until
+        _release_start. Returns why it does not fit, or None.
+        """
+        with self._lock:
+            instance = self.services[unique_id]
+            shortfall = self._shortfall(instance.get_requested_resources, instance)
+            if shortfall:
+                return f"Service with ID {unique_id} does not fit on {self.worker_name}: {shortfall}"
+            # A deployed instance already holds its resources
+            if instance.status not in RESOURCE_HOLDING_STATUSES:
+                self._reservations[unique_id] = instance
+            return None
+
+    def _release_start(self, unique_id: str):
+        with self._lock:
+            self._reservations.pop(unique_id, None)
+
     def get_service_status(self, unique_id: str = None):
         """Get status of all services or a specific service"""
         if unique_id:
@@ -156,115 +301,390 @@ class WorkerNode:
         return {id: service.to_json_dict() for id, service in self.services.items()}
 
     def get_worker_specs(self):
-        """Get the worker's specs"""
+        """Get the worker's specs (from the local copy, refreshed whenever they change in storage)"""
+        if self._specs is None:
+            raise HTTPException(status_code=404, detail=f"Specs for worker {self.worker_name} not found")
+        return self._specs
+
+    def get_headroom(self) -> Optional[Resources]:
+        """Spare capacity: specs minus current usage, or None while the specs are unknown"""
+        specs = self._specs
+        if specs is None:
+            return None
+        return Resources.from_two_specs(specs, self.get_resource_usage())
+
+    def _shortfall(self, requested, previous: Optional[InstanceRecord] = None) -> Dict[str, int]:
+        """
+        Caller holds the lock. How much of each resource is missing to add the request
+        (replacing `previous` if given); empty if it fits or the specs are unknown.
+        """
+        if self._specs is None:
+            return {}
+        specs = self._specs.get_specs
+        used = list(self._usage_totals)
+        for reserved in self._reservations.values():
+            held = reserved.get_requested_resources
+            used = [used[0] + held.get_cpu, used[1] + held.get_ram, used[2] + held.get_disk]
+        if previous is not None and previous.status in RESOURCE_HOLDING_STATUSES:
+            held = previous.get_requested_resources
+            used = [used[0] - held.get_cpu, used[1] - held.get_ram, used[2] - held.get_disk]
+        shortfall = {}
+        for name, total, in_use, wanted in (("cpu", specs.get_cpu, used[0], requested.get_cpu),
+                                            ("ram", specs.get_ram, used[1], requested.get_ram),
+                                            ("disk", specs.get_disk, used[2], requested.get_disk)):
+            if in_use + wanted > total:
+                shortfall[name] = in_use + wanted - total
+        return shortfall
+
+    def _on_specs_event(self, event: WatchEvent):
+        if event.key == self.specs_path:
+            self._set_specs(event.value if event.event_type == WatchEvent.PUT else None)
+
+    def _set_specs(self, value):
         try:
-            specs_path = f"/workers/{self.worker_name}/specs"
-            specs_json = self.storage.get(specs_path)
-            if specs_json:
-                specs_dict = json.loads(specs_json)
-                return Specs.from_dict(specs_dict)
-            else:
-                raise HTTPException(status_code=404, detail=f"Specs for worker {self.worker_name} not found")
+            if isinstance(value, (str, bytes)):
+                value = json.loads(value)
+            self._specs = Specs.from_dict(value) if value else None
         except Exception as e:
-            error_msg = f"Error getting specs for worker {self.worker_name}: {e}"
-            print(error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
+            print(f"Ignoring invalid specs for {self.worker_name}: {e}")
+            return
+        self._update_resource_usage()
 
     def get_resource_usage(self):
-        """Get the worker's current resource usage"""
-        try:
-            # Calculate current usage based on deployed services
-            cpu_usage = 0
-            ram_usage = 0
-            disk_usage = 0
-            
+        """Get the worker's current resource usage (from the running totals, constant time)"""
+        with self._lock:
+            cpu_usage, ram_usage, disk_usage = self._usage_totals
+        resources = Resources(cpu=cpu_usage, ram=ram_usage, disk=disk_usage)
+        return ResourceUsage(resource_usage=resources)
+
+    def recount_resource_usage(self):
+        """Calculate current usage from scratch by walking every deployed service"""
+        cpu_usage = 0
+        ram_usage = 0
+        disk_usage = 0
+        with self._lock:
             for service in self.services.values():
-                if service.status in [Status.DEPLOYED, Status.STARTED]:
-                    resources = service.get_requested_resources
-                    cpu_usage += resources.get_cpu
-                    ram_usage += resources.get_ram
-                    disk_usage += resources.get_disk
-            
-            resources = Resources(cpu=cpu_usage, ram=ram_usage, disk=disk_usage)
-            resource_usage = ResourceUsage(resource_usage=resources)
-            
-            return resource_usage
+                if service.status in RESOURCE_HOLDING_STATUSES:
+                    resources = service.spec.resources
+                    cpu_usage += resources.cpu
+                    ram_usage += resources.ram
+                    disk_usage += resources.disk
+        return [cpu_usage, ram_usage, disk_usage]
+
+    def verify_resource_usage(self) -> bool:
+        """
+        Compare the running totals with a full recount and repair them if they drifted.
+        Returns True if they matched.
+        """
+        with self._lock:
+            recounted = self.recount_resource_usage()
+            if recounted == self._usage_totals:
+                self.services.prune_specs()
+                return True
+            print(f"Resource usage drift on {self.worker_name}: totals {self._usage_totals}, recount {recounted}")
+            self._usage_totals = recounted
+            self.services.prune_specs()
+        self._update_resource_usage()
+        return False
+
+    def _usage_check_loop(self, interval: float):
+        """Background loop that runs the usage consistency check"""
+        while True:
+            time.sleep(interval)
+            try:
+                self.verify_resource_usage()
+            except Exception as e:
+                print(f"Error checking resource usage: {e}")
+
+    def _apply_usage(self, instance: InstanceRecord, sign: int):
+        """Add (sign=1) or remove (sign=-1) an instance's resources from the totals if it holds them"""
+        if instance.status in RESOURCE_HOLDING_STATUSES:
+            resources = instance.get_requested_resources
+            self._usage_totals[0] += sign * resources.get_cpu
+            self._usage_totals[1] += sign * resources.get_ram
+            self._usage_totals[2] += sign * resources.get_disk
+
+    def _set_status(self, unique_id: str, status: Status):
+        """Change an instance's status, keeping the usage totals in step"""
+        with self._lock:
+            instance = self.services[unique_id]
+            self._apply_usage(instance, -1)
+            instance.status = status
+            self._apply_usage(instance, 1)
+            self._mark_changed(unique_id)
+            if self.journal:
+                self.journal.record_status(unique_id, status)
+                self._snapshot_if_due()
+
+    def _mark_changed(self, unique_id: str):
+        """Caller holds the lock. Record a change for /services versioning"""
+        self.state_version += 1
+        self._changed_at.pop(unique_id, None)
+        self._changed_at[unique_id] = self.state_version
+        self._services_cache = None
+
+    def _version_token(self) -> str:
+        """Caller holds the lock. State version qualified by this run, since versions restart with the process"""
+        return f"{self._boot_id}-{self.state_version}"
+
+    def get_services_snapshot(self):
+        """
+        All instances as serialized JSON, with an ETag for the current state version.
+        The body is only rebuilt after an instance changed. Returns (version token, etag, body).
+        """
+        with self._lock:
+            if self._services_cache is None:
+                body = json.dumps({unique_id: instance.to_json_dict()
+                                   for unique_id, instance in self.services.items()}).encode()
+                token = self._version_token()
+                self._services_cache = (token, f'"{token}"', body)
+            return self._services_cache
+
+    def get_services_since(self, token: str) -> dict:
+        """
+        Instances changed after a version token. A token from another run (or one that
+        cannot be read) gets every instance, with reset=True so the client replaces its copy.
+        """
+        boot_id, _, version = token.rpartition("-")
+        with self._lock:
+            try:
+                version = int(version)
+            except ValueError:
+                version = -1
+            reset = boot_id != self._boot_id or version > self.state_version or version < 0
+            if reset:
+                changed = list(self.services.keys())
+            else:
+                changed = []
+                for unique_id, changed_at in reversed(self._changed_at.items()):
+                    if changed_at <= version:
+                        break
+                    changed.append(unique_id)
+            return {
+                "version": self._version_token(),
+                "reset": reset,
+                "services": {unique_id: self.services[unique_id].to_json_dict()
+                             for unique_id in changed if unique_id in self.services}
+            }
+
+    def _snapshot_if_due(self):
+        """Caller holds the lock. Snapshot the instances once the journal log is long enough"""
+        if self.journal.snapshot_due:
+            self.journal.snapshot(self.services)
+
+    def restore_from_journal(self):
+        """Rebuild the instances and usage totals from the local journal"""
+        start = time.perf_counter()
+        with self._lock:
+            self.services = self.journal.load()
+            self._usage_totals = self.recount_resource_usage()
+            for unique_id in self.services:
+                self._mark_changed(unique_id)
+        print(f"Restored {len(self.services)} instances of {self.worker_name} from {self.journal.directory} "
+              f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def reconcile_with_storage(self):
+        """
+        After a restore, bring storage in line with the restored instances using one prefix
+        read: re-report instances whose status in storage is missing or out of date, drop
+        reports for instances this worker no longer has, and publish the usage right away.
+        """
+        try:
+            prefix = instance_status_key(self.worker_name, "")
+            reported = self.storage.get_prefix(prefix)
+            with self._lock:
+                instances = dict(self.services)
+            for unique_id, instance in instances.items():
+                value = reported.get(prefix + unique_id)
+                if not isinstance(value, dict) or value.get("status") != instance.get_status.value:
+                    self._publish_instance_status(unique_id)
+            for key in reported:
+                if key[len(prefix):] not in instances:
+                    self.storage.delete(key)
         except Exception as e:
-            error_msg = f"Error calculating resource usage for worker {self.worker_name}: {e}"
-            print(error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
+            print(f"Error reconciling restored instances with storage: {e}")
+        self._update_resource_usage()
+        self.usage_publisher.flush()
+
+    def restart_restored_instances(self):
+        """
+        Processes do not survive a restart: launch the restored running instances again,
+        and record the ones that could not be launched as stopped.
+        """
+        with self._lock:
+            instances = [instance for instance in self.services.values() if instance.get_status == Status.STARTED]
+        results = self.runtime.start_many(instances)
+        failed = [unique_id for unique_id, error in results.items() if error]
+        for unique_id in failed:
+            print(f"Could not restart restored instance {unique_id}: {results[unique_id]}")
+            self._set_status(unique_id, Status.STOPPED)
+            self._publish_instance_status(unique_id)
+        if failed:
+            self._update_resource_usage()
+
+    def _mark_started(self, unique_id: str):
+        """Record that the runtime launched an instance, unless it has already exited again"""
+        self._set_status(unique_id, Status.STARTED)
+        self._publish_instance_status(unique_id)
+        process = self.runtime.get_process(unique_id)
+        if process is not None and process["exit_code"] is not None:
+            self._on_instance_exit(unique_id, process["exit_code"])
+
+    def _on_instance_exit(self, unique_id: str, exit_code: int):
+        """Called by the runtime when an instance exits without being stopped"""
+        with self._lock:
+            instance = self.services.get(unique_id)
+            if instance is None or instance.get_status != Status.STARTED:
+                return
+            self._set_status(unique_id, Status.STOPPED)
+        self._publish_instance_status(unique_id, exit_code)
+        self._update_resource_usage()
+
+    def publish_rejection(self, unique_id: str, task_name: str, reason: str):
+        """Report a deploy request this worker refused, so the gateway sees why it never ran"""
+        try:
+            self.storage.put(instance_status_key(self.worker_name, unique_id), {
+                "task_name": task_name,
+                "status": "rejected",
+                "reason": reason
+            })
+        except Exception as e:
+            print(f"Error publishing rejection of {unique_id}: {e}")
+
+    def _publish_instance_status(self, unique_id: str, exit_code: Optional[int] = None):
+        """Report an instance's state in storage so the gateway can stream it"""
+        try:
+            instance = self.services[unique_id]
+            value = {
+                "task_name": instance.get_service_name,
+                "status": instance.get_status.value
+            }
+            if exit_code is not None:
+                value["exit_code"] = exit_code
+            self.storage.put(instance_status_key(self.worker_name, unique_id), value)
+        except Exception as e:
+            print(f"Error publishing status of {unique_id}: {e}")
 
     def _update_resource_usage(self):
-        """Update the worker's current resource usage in storage"""
+        """Hand the worker's current resource usage to the publisher, which writes it to storage"""
         try:
             resource_usage = self.get_resource_usage()
-            usage_path = f"/workers/{self.worker_name}/current_usage"
-            self.storage.put(usage_path, json.dumps(resource_usage.to_json_dict()))
+            self.usage_publisher.update(self.usage_path, resource_usage.to_json_dict())
+            # Spare capacity, so the scheduler can skip workers a request does not fit on
+            headroom = self.get_headroom()
+            if headroom is not None:
+                self.usage_publisher.update(self.headroom_path, {"headroom": headroom.to_json_dict()})
         except Exception as e:
             print(f"Error updating resource usage in storage: {e}")
 
-# Create FastAPI app
-app = FastAPI(title=f"Worker Node API")
+    def shutdown(self):
+        """Stop taking requests from storage and flush anything not yet written"""
+        self.reconciler.stop()
+        self.runtime.shutdown()
+        self.usage_publisher.stop()
+        if self.journal:
+            with self._lock:
+                self.journal.snapshot(self.services)
+            self.journal.close()
+
+# API endpoints. The router is shared so several apps (each serving its own
+# WorkerNode) can be built from it, e.g. for in-process load tests.
+router = APIRouter()
 worker_instance = None
 
-# API endpoints
-@app.post("/services/{unique_id}/deploy")
-async def deploy_service(unique_id: str, service: Service):
-    """Deploy a service"""
-    if not worker_instance:
+def get_worker(request: Request) -> "WorkerNode":
+    """Worker served by this app: app.state.worker_instance, falling back to the module global"""
+    worker = getattr(request.app.state, "worker_instance", None) or worker_instance
+    if not worker:
         raise HTTPException(status_code=500, detail="Worker node not initialized")
-    return worker_instance.deploy_service(service, unique_id)
+    return worker
+
+@router.post("/services/{unique_id}/deploy")
+def deploy_service(unique_id: str, service: Service, worker: WorkerNode = Depends(get_worker)):
+    """Deploy a service"""
+    return worker.deploy_service(service, unique_id)
 
-@app.post("/services/{unique_id}/start")
-async def start_service(unique_id: str):
+@router.post("/services/{unique_id}/start")
+def start_service(unique_id: str, worker: WorkerNode = Depends(get_worker)):
     """Start a service"""
-    if not worker_instance:
-        raise HTTPException(status_code=500, detail="Worker node not initialized")
-    return worker_instance.start_service(unique_id)
+    return worker.start_service(unique_id)
 
-@app.post("/services/{unique_id}/stop")
-async def stop_service(unique_id: str):
+@router.post("/services/{unique_id}/stop")
+def stop_service(unique_id: str, worker: WorkerNode = Depends(get_worker)):
     """Stop a service"""
-    if not worker_instance:
-        raise HTTPException(status_code=500, detail="Worker node not initialized")
-    return worker_instance.stop_service(unique_id)
+    return worker.stop_service(unique_id)
 
-@app.get("/services/{unique_id}")
-async def get_service_status(unique_id: str):
+@router.get("/services/{unique_id}")
+async def get_service_status(unique_id: str, worker: WorkerNode = Depends(get_worker)):
     """Get status of a specific service"""
-    if not worker_instance:
-        raise HTTPException(status_code=500, detail="Worker node not initialized")
-    return worker_instance.get_service_status(unique_id)
+    return worker.get_service_status(unique_id)
 
-@app.get("/services")
-async def get_all_services():
-    """Get status of all services"""
-    if not worker_instance:
-        raise HTTPException(status_code=500, detail="Worker node not initialized")
-    return worker_instance.get_service_status()
+@router.get("/services")
+async def get_all_services(request: Request, since: Optional[str] = None, worker: WorkerNode = Depends(get_worker)):
+    """
+    Get status of all services. Sends 304 when If-None-Match has the current ETag;
+    with ?since=<X-State-Version token> only the services changed after that version are returned.
+    """
+    if since is not None:
+        return worker.get_services_since(since)
+    version, etag, body = worker.get_services_snapshot()
+    headers = {"ETag": etag, "X-State-Version": str(version)}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
-@app.get("/specs")
-async def get_worker_specs():
+@router.get("/specs")
+async def get_worker_specs(worker: WorkerNode = Depends(get_worker)):
     """Get worker specs"""
-    if not worker_instance:
-        raise HTTPException(status_code=500, detail="Worker node not initialized")
-    return worker_instance.get_worker_specs().to_json_dict()
+    return worker.get_worker_specs().to_json_dict()
 
-@app.get("/usage")
-async def get_resource_usage():
+@router.get("/usage")
+async def get_resource_usage(worker: WorkerNode = Depends(get_worker)):
     """Get current resource usage"""
-    if not worker_instance:
-        raise HTTPException(status_code=500, detail="Worker node not initialized")
-    return worker_instance.get_resource_usage().to_json_dict()
+    return worker.get_resource_usage().to_json_dict()
+
+@router.get("/headroom")
+async def get_headroom(worker: WorkerNode = Depends(get_worker)):
+    """Spare capacity (specs minus current usage)"""
+    headroom = worker.get_headroom()
+    if headroom is None:
+        raise HTTPException(status_code=404, detail=f"Specs for worker {worker.worker_name} not found")
+    return {"headroom": headroom.to_json_dict()}
+
+@router.get("/runtime")
+async def get_runtime_stats(worker: WorkerNode = Depends(get_worker)):
+    """Runtime statistics: running instances, start latency and the last batch's start throughput"""
+    return worker.runtime.get_stats()
 
-@app.get("/health")
-async def health_check():
+@router.get("/runtime/{unique_id}")
+async def get_instance_process(unique_id: str, worker: WorkerNode = Depends(get_worker)):
+    """Process of an instance (pid, exit code), if the runtime runs one"""
+    process = worker.runtime.get_process(unique_id)
+    if process is None:
+        raise HTTPException(status_code=404, detail=f"No process for service with ID {unique_id}")
+    return process
+
+@router.get("/health")
+async def health_check(request: Request):
     """Health check endpoint"""
-    return {"status": "healthy", "worker_name": worker_instance.worker_name if worker_instance else "not_initialized"}
+    worker = getattr(request.app.state, "worker_instance", None) or worker_instance
+    return {"status": "healthy", "worker_name": worker.worker_name if worker else "not_initialized"}
+
+def create_app(worker: Optional[WorkerNode] = None) -> FastAPI:
+    """Build a worker API app. Without a worker it serves the module-global worker_instance."""
+    worker_app = FastAPI(title=f"Worker Node API")
+    worker_app.include_router(router)
+    worker_app.state.worker_instance = worker
+    return worker_app
+
+# Create FastAPI app
+app = create_app()
 
 def signal_handler(sig, frame):
     """Handle termination signals"""
     print("Received termination signal, shutting down...")
+    if worker_instance:
+        worker_instance.shutdown()
     sys.exit(0)
 
 if __name__ == "__main__":
@@ -280,12 +700,54 @@ if __name__ == "__main__":
     parser.add_argument('--port', type=int, default=8001, help='Port to bind the server to')
     parser.add_argument('--etcd-host', type=str, default='127.0.0.1', help='Etcd host')
     parser.add_argument('--etcd-port', type=int, default=2379, help='Etcd port')
+    parser.add_argument('--advertise-host', type=str, default='localhost',
+                        help='Host name or IP the API gateway should use to reach this worker')
+    parser.add_argument('--capability', action='append', default=[], metavar='KEY=VALUE',
+                        help='Capability to advertise in the worker registry (repeatable)')
+    parser.add_argument('--usage-check-interval', type=float, default=60.0,
+                        help='Seconds between full recounts that verify the running resource totals')
+    parser.add_argument('--usage-publish-interval', type=float, default=1.0,
+                        help='Seconds between writes of the current usage to storage')
+    parser.add_argument('--usage-publish-threshold', type=float, default=0.1,
+                        help='Relative change in usage that is written right away instead of at the next interval')
+    parser.add_argument('--reconcile-batch-size', type=int, default=100,
+                        help='Most deploy/start/stop requests from storage applied in one batch')
+    parser.add_argument('--state-dir', type=str, default=os.environ.get("WORKER_STATE_DIR"),
+                        help='Directory for the local instance journal; the worker restores its instances from it on restart')
+    parser.add_argument('--snapshot-every', type=int, default=1000,
+                        help='Journal entries between snapshots of the instance state')
+    parser.add_argument('--runtime', type=str, choices=['noop', 'process'], default='noop',
+                        help='What runs instances: nothing (status only) or a local process per instance')
+    parser.add_argument('--image-commands', type=str, default=None,
+                        help='JSON file mapping each image_url the process runtime may run to its command line; '
+                             'instances of other images are refused')
+    parser.add_argument('--max-concurrent-starts', type=int, default=16,
+                        help='Instances the process runtime launches at once')
+    parser.add_argument('--stop-timeout', type=float, default=5.0,
+                        help='Seconds an instance gets to exit after SIGTERM before it is killed')
+    parser.add_argument('--instance-log-dir', type=str, default=None,
+                        help='Directory for instance stdout/stderr (discarded when not set)')
     
     args = parser.parse_args()
+    capabilities = dict(item.split('=', 1) for item in args.capability)
+    runtime = None
+    if args.runtime == 'process':
+        image_commands = load_image_commands(args.image_commands) if args.image_commands else {}
+        if not image_commands:
+            print("Warning: no --image-commands allow-list, the process runtime will refuse every instance")
+        runtime = LocalProcessRuntime(args.worker_name, image_commands=image_commands,
+                                      max_concurrent_starts=args.max_concurrent_starts,
+                                      stop_timeout=args.stop_timeout, log_dir=args.instance_log_dir)
     
-    # Create worker instance
-    worker_instance = WorkerNode(args.worker_name, etcd_host=args.etcd_host, etcd_port=args.etcd_port)
-    worker_instance.api_port = args.port
+    # Create worker instance (the port is known up front so the registration is complete)
+    worker_instance = WorkerNode(args.worker_name, storage_host=args.etcd_host, storage_port=args.etcd_port,
+                                 api_port=args.port, advertise_host=args.advertise_host, capabilities=capabilities,
+                                 usage_check_interval=args.usage_check_interval,
+                                 usage_publish_interval=args.usage_publish_interval,
+                                 usage_publish_threshold=args.usage_publish_threshold,
+                                 reconcile_batch_size=args.reconcile_batch_size,
+                                 state_dir=args.state_dir, snapshot_every=args.snapshot_every,
+                                 runtime=runtime)
     
     print(f"Worker node {args.worker_name} API running at http://{args.host}:{args.port}")
     
@@ -0,0 +1,189 @@
+import json
+import queue
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from models.service import Service
+from models.service_instance import Status
+
+import sys
+import os
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage_interface.storage_service_wrapper import StorageService, WatchEvent
+
+# Request kinds the gateway writes under /workers/{worker_name}/{kind}/{unique_id}
+DEPLOY_REQUEST = "deploy-req"
+START_REQUEST = "start_req"
+STOP_REQUEST = "stop_req"
+REQUEST_KINDS = (DEPLOY_REQUEST, START_REQUEST, STOP_REQUEST)
+
+# Keys whose applied revision is remembered, to drop a request delivered twice
+RECENT_KEYS = 10000
+
+
+def request_prefix(worker_name: str, kind: str) -> str:
+    return f"/workers/{worker_name}/{kind}/"
+
+
+def request_key(worker_name: str, kind: str, unique_id: str) -> str:
+    return f"{request_prefix(worker_name, kind)}{unique_id}"
+
+
+class WorkerReconciler:
+    """
+    Applies the requests the gateway writes for one worker (deploy, start, stop) to
+    the worker's instances. Requests arrive through storage watches and are applied in
+    batches by a background thread, in revision order. Each applied request is
+    acknowledged by deleting its key, so every request still to apply is a key: on
+    start the watches begin at the current revision and the waiting requests are read
+    with one prefix read each. Nothing depends on old revisions, so a restart works
+    however far etcd has compacted its history. The prefix read keeps each key's
+    revision, and the revision each recent key was applied at is remembered, so a
+    request seen both by the read and by a watch is applied once.
+    """
+
+    def __init__(self, node, storage: StorageService, batch_size: int = 100):
+        # node is the WorkerNode the requests are applied to
+        self.node = node
+        self.storage = storage
+        self.batch_size = batch_size
+        self.last_revision = 0
+        self.applied = 0
+        self._applied_revisions: "OrderedDict[str, int]" = OrderedDict()
+        self._queue: queue.Queue = queue.Queue()
+        self._watch_ids = []
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        worker_name = self.node.worker_name
+        # Watch first, then pick up the requests already waiting
+        for kind in REQUEST_KINDS:
+            self._watch_ids.append(self.storage.watch_prefix(request_prefix(worker_name, kind), self._on_event))
+        for kind in REQUEST_KINDS:
+            for key, (value, revision) in self.storage.get_prefix_revisions(request_prefix(worker_name, kind)).items():
+                self._on_event(WatchEvent(WatchEvent.PUT, key, value, revision))
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        for watch_id in self._watch_ids:
+            self.storage.cancel_watch(watch_id)
+        self._watch_ids = []
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _on_event(self, event: WatchEvent) -> None:
+        # Deletes are our own acknowledgements
+        if event.event_type == WatchEvent.PUT:
+            self._queue.put(event)
+
+    def _run(self) -> None:
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            batch = [event]
+            while len(batch) < self.batch_size:
+                try:
+                    event = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if event is None:
+                    self.apply_batch(batch)
+                    return
+                batch.append(event)
+            self.apply_batch(batch)
+
+    def apply_batch(self, events: List[WatchEvent]) -> int:
+        """Apply a batch of request events, acknowledge them and save the revision. Returns the requests applied."""
+        # A key written twice in the batch only needs its latest value
+        latest: Dict[str, WatchEvent] = {}
+        for event in events:
+            # Already applied, e.g. seen by both the initial read and a watch
+            if self._applied_revisions.get(event.key, 0) >= event.revision:
+                continue
+            previous = latest.get(event.key)
+            if previous is None or event.revision >= previous.revision:
+                latest[event.key] = event
+
+        applied = 0
+        # Consecutive start requests are launched together
+        starts: List[WatchEvent] = []
+        for event in sorted(latest.values(), key=lambda e: e.revision):
+            kind, unique_id = event.key.rsplit("/", 2)[-2:]
+            if kind == START_REQUEST:
+                starts.append(event)
+                continue
+            applied += self._apply_starts(starts)
+            starts = []
+            try:
+                self._apply(kind, unique_id, event.value)
+                applied += 1
+            except Exception as e:
+                # Keep going; a request that cannot be applied is still acknowledged so it does not pile up
+                print(f"Error applying {kind} for {unique_id}: {getattr(e, 'detail', e)}")
+            self._acknowledge(event)
+        applied += self._apply_starts(starts)
+
+        newest = max((event.revision for event in events), default=0)
+        if newest > self.last_revision:
+            self.last_revision = newest
+        self.applied += applied
+        return applied
+
+    def _apply_starts(self, events: List[WatchEvent]) -> int:
+        if not events:
+            return 0
+        unique_ids = [event.key.rsplit("/", 1)[-1] for event in events]
+        # Already applied, e.g. the gateway also called the worker's HTTP endpoint
+        pending = [unique_id for unique_id in unique_ids if not self._has_status(unique_id, Status.STARTED)]
+        applied = len(unique_ids) - len(pending)
+        if pending:
+            results = self.node.start_services(pending)
+            applied += sum(1 for error in results.values() if not error)
+        for event in events:
+            self._acknowledge(event)
+        return applied
+
+    def _acknowledge(self, event: WatchEvent) -> None:
+        self._applied_revisions.pop(event.key, None)
+        self._applied_revisions[event.key] = event.revision
+        if len(self._applied_revisions) > RECENT_KEYS:
+            self._applied_revisions.popitem(last=False)
+        try:
+            self.storage.delete(event.key)
+        except Exception as e:
+            print(f"Error acknowledging {event.key}: {e}")
+
+    def _apply(self, kind: str, unique_id: str, value: Any) -> None:
+        if kind == DEPLOY_REQUEST:
+            if isinstance(value, (str, bytes)):
+                value = json.loads(value)
+            service = Service.from_dict(value)
+            try:
+                self.node.deploy_service(service, unique_id)
+            except HTTPException as e:
+                if e.status_code == 409:
+                    self.node.publish_rejection(unique_id, service.get_service_name, e.detail)
+                raise
+        elif kind == START_REQUEST:
+            if self._has_status(unique_id, Status.STARTED):
+                return
+            self.node.start_service(unique_id)
+        elif kind == STOP_REQUEST:
+            if self._has_status(unique_id, Status.STOPPED):
+                return
+            self.node.stop_service(unique_id)
+        else:
+            print(f"Unknown request kind {kind} for {unique_id}")
+
+    def _has_status(self, unique_id: str, status: Status) -> bool:
+        instance = self.node.services.get(unique_id)
+        return instance is not None and instance.get_status == status
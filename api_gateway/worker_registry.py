@@ -0,0 +1,140 @@
+import threading
+from typing import Dict, List, Optional, Set
+
+from models.worker_registration import WorkerRegistration
+
+import sys
+import os
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage_interface.storage_service_wrapper import StorageService, WatchEvent
+
+# Every worker keeps exactly one registration key under this prefix
+REGISTRY_PREFIX = "/registry/workers/"
+
+# Heartbeat records written by the heartbeat system: {"timestamp": ..., "status": "alive" | "suspect" | "dead"}
+HEARTBEAT_PREFIX = "/heartbeats/"
+UNHEALTHY_STATUSES = ("suspect", "dead")
+
+
+def registration_key(worker_name: str) -> str:
+    return f"{REGISTRY_PREFIX}{worker_name}"
+
+
+def register_worker(storage: StorageService, registration: WorkerRegistration) -> None:
+    """Publish (or refresh) a worker's endpoint, port and capabilities."""
+    storage.put(registration_key(registration.get_worker_name), registration.to_json_dict())
+
+
+class WorkerDirectory:
+    """
+    In-memory copy of the worker registry, kept current by a storage watch.
+    Lookups never touch storage, so they are safe to use on the request path.
+
+    The heartbeat status of each worker is watched the same way, so the scheduler
+    can skip workers the heartbeat system suspects or considers dead.
+
+    A reload from storage is merged into the copy rather than replacing it: a worker
+    changed by a watch event while the reload was reading keeps the event's value,
+    which is newer than what the reload read.
+    """
+
+    def __init__(self, storage: StorageService):
+        self.storage = storage
+        self._workers: Dict[str, WorkerRegistration] = {}
+        self._health: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        # Workers changed by watch events while a reload is in progress, or None
+        self._changed_during_load: Optional[Set[str]] = None
+        self._health_changed_during_load: Optional[Set[str]] = None
+        self._watch_id = None
+        self._health_watch_id = None
+
+    def start(self) -> None:
+        """Subscribe to registry and heartbeat changes, then load the current state."""
+        # Watch first so nothing registered during the initial load is missed
+        self._watch_id = self.storage.watch_prefix(REGISTRY_PREFIX, self._on_event)
+        self._health_watch_id = self.storage.watch_prefix(HEARTBEAT_PREFIX, self._on_heartbeat_event)
+        self.refresh()
+        self.refresh_health()
+
+    def stop(self) -> None:
+        if self._watch_id is not None:
+            self.storage.cancel_watch(self._watch_id)
+            self._watch_id = None
+        if self._health_watch_id is not None:
+            self.storage.cancel_watch(self._health_watch_id)
+            self._health_watch_id = None
+
+    def refresh(self) -> None:
+        """Reload the whole registry from storage."""
+        with self._lock:
+            self._changed_during_load = set()
+        workers = {}
+        for key, value in self.storage.get_prefix(REGISTRY_PREFIX).items():
+            try:
+                registration = WorkerRegistration.from_dict(value)
+            except Exception as e:
+                print(f"Ignoring malformed registration at {key}: {e}")
+                continue
+            workers[registration.get_worker_name] = registration
+        with self._lock:
+            self._merge(self._workers, workers, self._changed_during_load)
+            self._changed_during_load = None
+
+    def refresh_health(self) -> None:
+        """Reload every worker's heartbeat status from storage."""
+        with self._lock:
+            self._health_changed_during_load = set()
+        health = {}
+        for key, value in self.storage.get_prefix(HEARTBEAT_PREFIX).items():
+            if isinstance(value, dict):
+                health[key[len(HEARTBEAT_PREFIX):]] = value.get("status")
+        with self._lock:
+            self._merge(self._health, health, self._health_changed_during_load)
+            self._health_changed_during_load = None
+
+    @staticmethod
+    def _merge(current: dict, loaded: dict, changed: Set[str]) -> None:
+        """Caller holds the lock. Bring `current` in line with `loaded`, except for entries in `changed`."""
+        for name in [name for name in current if name not in loaded and name not in changed]:
+            del current[name]
+        for name, value in loaded.items():
+            if name not in changed:
+                current[name] = value
+
+    def resolve(self, worker_name: str) -> Optional[str]:
+        """Base URL of a worker's API, or None if the worker is not registered."""
+        registration = self._workers.get(worker_name)
+        return registration.get_base_url if registration else None
+
+    def is_healthy(self, worker_name: str) -> bool:
+        """False for workers the heartbeat system marks suspect or dead; workers without a heartbeat record count as healthy."""
+        return self._health.get(worker_name) not in UNHEALTHY_STATUSES
+
+    def worker_names(self) -> List[str]:
+        with self._lock:
+            return sorted(self._workers.keys())
+
+    def _on_event(self, event: WatchEvent) -> None:
+        worker_name = event.key[len(REGISTRY_PREFIX):]
+        with self._lock:
+            if self._changed_during_load is not None:
+                self._changed_during_load.add(worker_name)
+            if event.event_type == WatchEvent.DELETE:
+                self._workers.pop(worker_name, None)
+                return
+            try:
+                self._workers[worker_name] = WorkerRegistration.from_dict(event.value)
+            except Exception as e:
+                print(f"Ignoring malformed registration for {worker_name}: {e}")
+
+    def _on_heartbeat_event(self, event: WatchEvent) -> None:
+        worker_name = event.key[len(HEARTBEAT_PREFIX):]
+        with self._lock:
+            if self._health_changed_during_load is not None:
+                self._health_changed_during_load.add(worker_name)
+            if event.event_type == WatchEvent.DELETE or not isinstance(event.value, dict):
+                self._health.pop(worker_name, None)
+            else:
+                self._health[worker_name] = event.value.get("status")
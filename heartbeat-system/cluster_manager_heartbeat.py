@@ -1,71 +1,305 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
+import argparse
+import asyncio
+import os
+import socket
 import threading
 import time
 import uvicorn
 
+from heartbeat_delta import APPLY, GAP, METRICS, DeltaState, merge_delta
+from heartbeat_relay import BATCH_ENDPOINT, HeartbeatRelay, decode_batch
+from heartbeat_wire import HeartbeatDecoder
+from liveness_tracker import LivenessTracker
+from metric_series import RAW, ROLLUPS, MetricSeries
+from phi_accrual import PhiAccrualDetector
+
 app = FastAPI()
 
 # Timeout after which a worker is considered dead (in seconds)
 HEARTBEAT_TIMEOUT = 30
 
-# In-memory registry to store heartbeat information
-# Structure: {worker_id: {"timestamp": datetime, "cpu_usage": float, "ram_usage": float, "disk_usage": float, "additional_info": dict, "status": "alive" or "dead"}}
-heartbeats: Dict[str, Dict[str, Any]] = {}
+# "phi" adapts to each worker's heartbeat rhythm (suspect, then dead, at most after the timeout);
+# "timeout" is the plain fixed timeout
+DETECTOR_ENV = "HEARTBEAT_DETECTOR"
+SUSPECT_PHI_ENV = "HEARTBEAT_SUSPECT_PHI"
+DEAD_PHI_ENV = "HEARTBEAT_DEAD_PHI"
+INTERVAL_ENV = "HEARTBEAT_INTERVAL"
+
+# UDP port for binary heartbeats (see heartbeat_wire.py); unset leaves only the JSON endpoint
+UDP_PORT_ENV = "HEARTBEAT_UDP_PORT"
+
+# "root" keeps liveness for the cluster; "relay" also forwards batches to HEARTBEAT_UPSTREAM
+MODE_ENV = "HEARTBEAT_MODE"
+UPSTREAM_ENV = "HEARTBEAT_UPSTREAM"
+RELAY_INTERVAL_ENV = "HEARTBEAT_RELAY_INTERVAL"
+RELAY_ID_ENV = "HEARTBEAT_RELAY_ID"
+
+relay = None
+
+# Last applied sequence number of each worker sending delta heartbeats
+delta_state = DeltaState()
+
+# Bounded cpu/ram/disk history of every worker, at raw, 1 minute and 10 minute resolution
+MAX_SERIES_WORKERS_ENV = "HEARTBEAT_MAX_SERIES_WORKERS"
+series = MetricSeries(max_workers=int(os.environ.get(MAX_SERIES_WORKERS_ENV, "10000")))
+
+def create_tracker() -> LivenessTracker:
+    if os.environ.get(DETECTOR_ENV, "phi") == "timeout":
+        return LivenessTracker(HEARTBEAT_TIMEOUT)
+    return PhiAccrualDetector(HEARTBEAT_TIMEOUT,
+                              suspect_phi=float(os.environ.get(SUSPECT_PHI_ENV, "3")),
+                              dead_phi=float(os.environ.get(DEAD_PHI_ENV, "8")),
+                              first_interval=float(os.environ.get(INTERVAL_ENV, "10")))
+
+# In-memory registry of heartbeat information, with workers kept in alive/(suspect/)dead sets by deadline
+# Info structure: {worker_id: {"timestamp": datetime, "cpu_usage": float, "ram_usage": float, "disk_usage": float, "additional_info": dict}}
+tracker = create_tracker()
 
 # Pydantic model for heartbeat data sent by worker nodes
+# Heartbeats without `seq` are always complete. With `seq`, only `full` ones are; the others
+# (deltas, see heartbeat_delta.py) carry just the metrics and additional_info keys that changed.
 class HeartbeatData(BaseModel):
     worker_id: str
-    cpu_usage: float
-    ram_usage: float
-    disk_usage: float
+    cpu_usage: Optional[float] = None
+    ram_usage: Optional[float] = None
+    disk_usage: Optional[float] = None
     additional_info: Dict[str, Any] = {}
+    seq: Optional[int] = None
+    full: bool = True
+    removed_info: List[str] = []
 
 @app.post("/heartbeat")
 def receive_heartbeat(update: HeartbeatData):
-    """Receive a heartbeat update from a worker node."""
+    """
+    Receive a heartbeat update from a worker node. Responds with resync=True when a delta
+    heartbeat cannot be applied because earlier ones were lost; the worker then sends a
+    full snapshot.
+    """
     now = datetime.utcnow()
-    heartbeats[update.worker_id] = {
-        "timestamp": now,
-        "cpu_usage": update.cpu_usage,
-        "ram_usage": update.ram_usage,
-        "disk_usage": update.disk_usage,
-        "additional_info": update.additional_info,
-        "status": "alive"
-    }
-    return {"message": f"Heartbeat received from {update.worker_id} at {now.isoformat()}"}
+    if update.seq is None or update.full:
+        missing = [metric for metric in METRICS if getattr(update, metric) is None]
+        if missing:
+            raise HTTPException(status_code=422, detail=f"Full heartbeat is missing {', '.join(missing)}")
+        if update.seq is None:
+            delta_state.forget(update.worker_id)
+        else:
+            delta_state.check(update.worker_id, update.seq, True)
+        record_heartbeat(update.worker_id, {
+            "timestamp": now,
+            "cpu_usage": update.cpu_usage,
+            "ram_usage": update.ram_usage,
+            "disk_usage": update.disk_usage,
+            "additional_info": update.additional_info
+        })
+        return {"message": f"Heartbeat received from {update.worker_id} at {now.isoformat()}", "resync": False}
 
-def evaluate_heartbeats():
-    """Cycle through stored heartbeats and mark workers as dead if the last heartbeat is too old."""
+    outcome = delta_state.check(update.worker_id, update.seq, False)
+    previous = tracker.info.get(update.worker_id)
+    if previous is None:
+        # Nothing to apply the delta to
+        outcome = GAP
+    elif outcome == APPLY:
+        info = merge_delta(previous, {metric: getattr(update, metric) for metric in METRICS},
+                           update.additional_info, update.removed_info)
+        info["timestamp"] = now
+        record_heartbeat(update.worker_id, info)
+    else:
+        # The worker is alive either way, but its metrics are unknown until the resync:
+        # refresh liveness only, without recording the old metrics as a new sample
+        tracker.beat(update.worker_id, dict(previous, timestamp=now))
+    if outcome == GAP:
+        print(f"Heartbeat gap from {update.worker_id} at seq {update.seq}, asking for a resync")
+        return {"message": f"Heartbeat from {update.worker_id} needs a full resync", "resync": True}
+    return {"message": f"Heartbeat received from {update.worker_id} at {now.isoformat()}", "resync": False}
+
+@app.post(BATCH_ENDPOINT)
+async def receive_heartbeat_batch(request: Request):
+    """
+    Receive a batch of heartbeats forwarded by a relay. Each entry carries its age in
+    seconds, which is subtracted from our own clock to place the heartbeat in time.
+    Malformed entries are skipped and counted in the response; the rest are recorded.
+    """
+    try:
+        batch = decode_batch(await request.body(), request.headers.get("content-encoding", ""))
+        entries = batch["heartbeats"]
+        if not isinstance(entries, list):
+            raise ValueError("heartbeats is not a list")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid heartbeat batch: {e}")
     now = datetime.utcnow()
-    for worker_id, info in heartbeats.items():
-        last_time = info.get("timestamp")
-        if last_time and (now - last_time).total_seconds() > HEARTBEAT_TIMEOUT:
-            info["status"] = "dead"
-        else:
-            info["status"] = "alive"
+    received = 0
+    skipped = 0
+    for entry in entries:
+        try:
+            worker_id = entry["worker_id"]
+            if not isinstance(worker_id, str) or not worker_id:
+                raise ValueError("worker_id must be a non-empty string")
+            age = max(float(entry.get("age", 0.0)), 0.0)
+            info = {
+                "timestamp": now - timedelta(seconds=age),
+                "cpu_usage": float(entry.get("cpu_usage", 0.0)),
+                "ram_usage": float(entry.get("ram_usage", 0.0)),
+                "disk_usage": float(entry.get("disk_usage", 0.0)),
+                "additional_info": dict(entry.get("additional_info") or {})
+            }
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            print(f"Skipping malformed heartbeat from relay {batch.get('relay')}: {e!r}")
+            skipped += 1
+            continue
+        info["additional_info"].setdefault("relay", batch.get("relay"))
+        record_heartbeat(worker_id, info, age)
+        received += 1
+    return {"message": f"Received {received} heartbeats from relay {batch.get('relay')}", "skipped": skipped}
+
+def record_heartbeat(worker_id: str, info: Dict[str, Any], age: float = 0.0):
+    """Update liveness for a heartbeat received `age` seconds ago, and queue it upstream when relaying."""
+    received = time.monotonic() - age
+    tracker.beat(worker_id, info, now=received)
+    series.record(worker_id, time.time() - age, info["cpu_usage"], info["ram_usage"], info["disk_usage"])
+    if relay is not None:
+        relay.add(worker_id, info, received)
+
+def receive_binary_heartbeat(worker_id: str, seq: int, flags: int, cpu_usage: float, ram_usage: float,
+                             disk_usage: float, pod_count: int):
+    """
+    Fast path for binary heartbeats: the decoded values go straight into a new info dict,
+    with no JSON parsing or model validation. The tracker swaps it in under its lock, so
+    readers never see a half-updated info.
+    """
+    record_heartbeat(worker_id, {
+        "timestamp": datetime.utcnow(),
+        "cpu_usage": cpu_usage,
+        "ram_usage": ram_usage,
+        "disk_usage": disk_usage,
+        "additional_info": {"pod_count": pod_count, "seq": seq}
+    })
+
+class HeartbeatDatagramProtocol(asyncio.DatagramProtocol):
+    """Receives binary heartbeat datagrams on the server's event loop."""
+
+    def __init__(self):
+        self.decoder = HeartbeatDecoder(receive_binary_heartbeat)
+
+    def datagram_received(self, data, addr):
+        self.decoder.feed(data)
+
+udp_protocol = None
+
+@app.on_event("startup")
+async def start_udp_receiver():
+    """Listen for binary heartbeats if a UDP port is configured."""
+    global udp_protocol
+    port = os.environ.get(UDP_PORT_ENV)
+    if not port:
+        return
+    loop = asyncio.get_running_loop()
+    _, udp_protocol = await loop.create_datagram_endpoint(HeartbeatDatagramProtocol, local_addr=("0.0.0.0", int(port)))
+    print(f"Receiving binary heartbeats on UDP port {port}")
+
+@app.on_event("startup")
+def start_relay():
+    """In relay mode, start forwarding heartbeats upstream."""
+    global relay
+    if os.environ.get(MODE_ENV, "root") != "relay":
+        return
+    upstream = os.environ.get(UPSTREAM_ENV)
+    if not upstream:
+        raise RuntimeError(f"Relay mode needs an upstream heartbeat service ({UPSTREAM_ENV})")
+    relay = HeartbeatRelay(upstream, os.environ.get(RELAY_ID_ENV, socket.gethostname()),
+                           interval=float(os.environ.get(RELAY_INTERVAL_ENV, "1.0")))
+    relay.start()
+    print(f"Relaying heartbeats to {upstream} every {relay.interval}s")
+
+@app.on_event("shutdown")
+def stop_relay():
+    if relay is not None:
+        relay.flush()
+        relay.stop()
+
+@app.get("/heartbeat/relay-stats")
+def get_relay_stats():
+    """Counters of the upstream forwarding in relay mode."""
+    if relay is None:
+        return {"mode": "root"}
+    return {"mode": "relay", "upstream": relay.upstream_url, "batches": relay.batches_sent,
+            "heartbeats": relay.heartbeats_sent, "bytes": relay.bytes_sent}
+
+@app.get("/heartbeat/udp-stats")
+def get_udp_stats():
+    """Counters of the binary heartbeat receiver."""
+    if udp_protocol is None:
+        return {"enabled": False}
+    return {"enabled": True, "records": udp_protocol.decoder.records, "errors": udp_protocol.decoder.errors}
+
+def evaluate_heartbeats():
+    """Mark workers suspect or dead whose heartbeats are overdue (only the expired deadlines are looked at)."""
+    if isinstance(tracker, PhiAccrualDetector):
+        transitions = tracker.advance()
+    else:
+        transitions = [(worker_id, "dead") for worker_id in tracker.expire()]
+    for worker_id, state in transitions:
+        print(f"Worker {worker_id} missed its heartbeat deadline, marked {state}")
 
 @app.get("/workers/alive")
 def get_alive_workers():
     """Return a list of workers currently marked as alive."""
-    evaluate_heartbeats()
-    alive_workers = {wid: info for wid, info in heartbeats.items() if info["status"] == "alive"}
-    return {"alive_workers": alive_workers}
+    return {"alive_workers": tracker.alive_workers()}
+
+@app.get("/workers/suspect")
+def get_suspect_workers():
+    """Return workers whose heartbeats are late but who are not yet considered dead."""
+    return {"suspect_workers": tracker.suspect_workers()}
+
+@app.get("/workers/{worker_id}/phi")
+def get_worker_phi(worker_id: str):
+    """Current suspicion level of a worker."""
+    if worker_id not in tracker.info:
+        raise HTTPException(status_code=404, detail="Worker not found")
+    if not isinstance(tracker, PhiAccrualDetector):
+        return {"worker_id": worker_id, "detector": "timeout"}
+    tracker.expire()
+    return {"worker_id": worker_id, "detector": "phi", "phi": tracker.phi(worker_id), "state": tracker.state(worker_id)}
+
+@app.get("/metrics/workers/{worker_id}")
+def get_worker_metrics(worker_id: str, resolution: str = "1m", seconds: float = 3600):
+    """
+    A worker's cpu, ram and disk history over the last `seconds`, as columns:
+    raw heartbeats, or 1m/10m buckets with min, max and avg.
+    """
+    if resolution != RAW and resolution not in ROLLUPS:
+        raise HTTPException(status_code=400, detail=f"Unknown resolution {resolution}")
+    window = series.worker_window(worker_id, resolution, seconds, time.time())
+    if window is None:
+        raise HTTPException(status_code=404, detail="Worker not found")
+    return {"worker_id": worker_id, **window}
+
+@app.get("/metrics/cluster")
+def get_cluster_metrics(resolution: str = "1m", seconds: float = 3600):
+    """Cluster-wide min, max and avg of cpu, ram and disk per 1m or 10m bucket, over the last `seconds`."""
+    if resolution not in ROLLUPS:
+        raise HTTPException(status_code=400, detail=f"Cluster metrics are kept at {', '.join(ROLLUPS)}")
+    return series.cluster_window(resolution, seconds, time.time())
+
+@app.get("/metrics/stats")
+def get_metric_series_stats():
+    """Memory held by the metric history."""
+    return {"workers": len(series.workers), "max_workers": series.max_workers, "bytes": series.nbytes,
+            "bytes_per_worker": series.bytes_per_worker, "dropped_samples": series.dropped,
+            "reclaimed_workers": series.reclaimed}
 
 @app.get("/workers/dead")
 def get_dead_workers():
     """Return a list of workers currently marked as dead."""
-    evaluate_heartbeats()
-    dead_workers = {wid: info for wid, info in heartbeats.items() if info["status"] == "dead"}
-    return {"dead_workers": dead_workers}
+    return {"dead_workers": tracker.dead_workers()}
 
 @app.post("/workers/mark-dead")
 def mark_worker_dead(worker_id: str):
     """Manually mark a worker as dead."""
-    if worker_id in heartbeats:
-        heartbeats[worker_id]["status"] = "dead"
+    if tracker.mark_dead(worker_id):
         return {"message": f"Worker {worker_id} manually marked as dead"}
     else:
         raise HTTPException(status_code=404, detail="Worker not found")
@@ -74,10 +308,44 @@ def heartbeat_monitor_loop():
     """Background loop that periodically evaluates heartbeats."""
     while True:
         evaluate_heartbeats()
-        time.sleep(HEARTBEAT_TIMEOUT / 2)  # Adjust the frequency as needed
+        # Wake up for the next deadline, but at least every half timeout
+        next_deadline = tracker.next_deadline()
+        wait = HEARTBEAT_TIMEOUT / 2
+        if next_deadline is not None:
+            wait = min(wait, max(next_deadline - time.monotonic(), 0.01))
+        time.sleep(wait)
 
 # Start the heartbeat monitor in a background thread
 threading.Thread(target=heartbeat_monitor_loop, daemon=True).start()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8002)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Start the Cluster Manager Heartbeat Service")
+    parser.add_argument("--port", type=int, default=8002, help="HTTP port")
+    parser.add_argument("--udp-port", type=int, default=None, help="Also accept binary heartbeats on this UDP port")
+    parser.add_argument("--mode", type=str, choices=["root", "relay"], default="root",
+                        help="root tracks the cluster; relay aggregates a rack or zone and forwards batches upstream")
+    parser.add_argument("--upstream", type=str, default=None, help="URL of the heartbeat service a relay forwards to")
+    parser.add_argument("--relay-interval", type=float, default=1.0, help="Seconds between batches sent upstream")
+    parser.add_argument("--relay-id", type=str, default=None, help="Name of this relay (defaults to the hostname)")
+    parser.add_argument("--detector", type=str, choices=["phi", "timeout"], default="phi",
+                        help="Adaptive phi-accrual failure detection, or a fixed timeout")
+    parser.add_argument("--suspect-phi", type=float, default=3.0, help="Phi at which a worker becomes suspect")
+    parser.add_argument("--dead-phi", type=float, default=8.0, help="Phi at which a worker is considered dead")
+    parser.add_argument("--heartbeat-interval", type=float, default=10.0,
+                        help="Expected seconds between heartbeats, used until a worker's real rhythm is known")
+    args = parser.parse_args()
+    os.environ[DETECTOR_ENV] = args.detector
+    os.environ[SUSPECT_PHI_ENV] = str(args.suspect_phi)
+    os.environ[DEAD_PHI_ENV] = str(args.dead_phi)
+    os.environ[INTERVAL_ENV] = str(args.heartbeat_interval)
+    tracker = create_tracker()
+    if args.udp_port:
+        os.environ[UDP_PORT_ENV] = str(args.udp_port)
+    os.environ[MODE_ENV] = args.mode
+    if args.upstream:
+        os.environ[UPSTREAM_ENV] = args.upstream
+    os.environ[RELAY_INTERVAL_ENV] = str(args.relay_interval)
+    if args.relay_id:
+        os.environ[RELAY_ID_ENV] = args.relay_id
+
+    uvicorn.run(app, host="0.0.0.0", port=args.port)
\ No newline at end of file
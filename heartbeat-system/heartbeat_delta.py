@@ -0,0 +1,124 @@
+import copy
+import threading
+from typing import Any, Dict, Optional
+
+METRICS = ("cpu_usage", "ram_usage", "disk_usage")
+
+# Outcomes of DeltaState.check
+APPLY = "apply"
+STALE = "stale"
+GAP = "gap"
+
+
+def changed(old: Any, new: Any, epsilon: float) -> bool:
+    """Whether a value moved enough to be sent; floats (also nested in dicts) compare with epsilon, counts exactly."""
+    if isinstance(new, float) and isinstance(old, (int, float)) and not isinstance(old, bool):
+        return abs(new - old) > epsilon
+    if isinstance(new, dict) and isinstance(old, dict):
+        if old.keys() != new.keys():
+            return True
+        return any(changed(old[key], value, epsilon) for key, value in new.items())
+    return old != new
+
+
+class DeltaEncoder:
+    """
+    Worker side of delta heartbeats. Each heartbeat gets the next sequence number; a full
+    snapshot goes out every `full_every` beats (and after request_resync()), and in
+    between only the metrics and top-level additional_info keys that moved by more than
+    `epsilon` since they were last sent.
+    """
+
+    def __init__(self, epsilon: float = 1.0, full_every: int = 10):
+        self.epsilon = epsilon
+        self.full_every = max(full_every, 1)
+        self.seq = 0
+        self._sent: Optional[Dict[str, Any]] = None
+        self._since_full = 0
+
+    def request_resync(self) -> None:
+        """Send a full snapshot next, e.g. after a failed send or when the service asks for one."""
+        self._sent = None
+
+    def encode(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn a full heartbeat (HeartbeatData fields) into the payload to send."""
+        self.seq += 1
+        payload = {"worker_id": state["worker_id"], "seq": self.seq}
+        if self._sent is None or self._since_full >= self.full_every - 1:
+            self._sent = copy.deepcopy(state)
+            self._since_full = 0
+            payload["full"] = True
+            for metric in METRICS:
+                payload[metric] = state[metric]
+            payload["additional_info"] = state.get("additional_info", {})
+            return payload
+
+        self._since_full += 1
+        payload["full"] = False
+        for metric in METRICS:
+            if changed(self._sent[metric], state[metric], self.epsilon):
+                payload[metric] = self._sent[metric] = state[metric]
+
+        sent_info = self._sent.setdefault("additional_info", {})
+        info = state.get("additional_info", {})
+        updates = {}
+        for key, value in info.items():
+            if key not in sent_info or changed(sent_info[key], value, self.epsilon):
+                updates[key] = value
+                sent_info[key] = copy.deepcopy(value)
+        removed = [key for key in sent_info if key not in info]
+        for key in removed:
+            del sent_info[key]
+        if updates:
+            payload["additional_info"] = updates
+        if removed:
+            payload["removed_info"] = removed
+        return payload
+
+
+class DeltaState:
+    """Service side: the last sequence number applied for each worker."""
+
+    def __init__(self):
+        self._last_seq: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def check(self, worker_id: str, seq: int, full: bool) -> str:
+        """
+        APPLY if the heartbeat continues the worker's sequence (or is a full snapshot),
+        STALE for a duplicate or reordered one, GAP if heartbeats were lost and the
+        worker has to resync.
+        """
+        with self._lock:
+            last = self._last_seq.get(worker_id)
+            if full:
+                self._last_seq[worker_id] = seq
+                return APPLY
+            if last is None:
+                return GAP
+            if seq <= last:
+                return STALE
+            if seq != last + 1:
+                return GAP
+            self._last_seq[worker_id] = seq
+            return APPLY
+
+    def forget(self, worker_id: str) -> None:
+        """For heartbeats without a sequence number: the next delta needs a full snapshot first."""
+        with self._lock:
+            self._last_seq.pop(worker_id, None)
+
+
+def merge_delta(previous: Dict[str, Any], metrics: Dict[str, Optional[float]], additional_info: Dict[str, Any],
+                removed_info) -> Dict[str, Any]:
+    """Full heartbeat info rebuilt from the previous one and a delta."""
+    info = dict(previous)
+    for metric, value in metrics.items():
+        if value is not None:
+            info[metric] = value
+    merged_info = dict(previous.get("additional_info", {}))
+    merged_info.update(additional_info)
+    for key in removed_info:
+        merged_info.pop(key, None)
+    info["additional_info"] = merged_info
+    return info
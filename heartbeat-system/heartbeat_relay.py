@@ -0,0 +1,97 @@
+import gzip
+import json
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+BATCH_ENDPOINT = "/heartbeat/batch"
+
+
+def encode_batch(relay_id: str, entries: List[dict], level: int = 5) -> bytes:
+    return gzip.compress(json.dumps({"relay": relay_id, "heartbeats": entries}, separators=(",", ":")).encode("utf-8"),
+                         compresslevel=level)
+
+
+def decode_batch(body: bytes, content_encoding: str = "") -> dict:
+    if content_encoding == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+class HeartbeatRelay:
+    """
+    Rack or zone aggregator: collects the heartbeats a heartbeat service receives and
+    forwards them upstream as one gzip-compressed batch every `interval` seconds.
+
+    Only the latest heartbeat of each worker is kept between flushes. Entries carry
+    the heartbeat's age in seconds instead of a timestamp, so the upstream service can
+    rebuild the real arrival time without relying on the relay's clock. Batches that
+    fail to send are kept and retried with the next flush, unless a newer heartbeat
+    from the same worker arrived in the meantime.
+    """
+
+    def __init__(self, upstream_url: str, relay_id: str, interval: float = 1.0, timeout: float = 5.0,
+                 compress_level: int = 5):
+        self.upstream_url = upstream_url.rstrip("/")
+        self.relay_id = relay_id
+        self.interval = interval
+        self.compress_level = compress_level
+        self.client = httpx.Client(timeout=timeout)
+        self._pending: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self.batches_sent = 0
+        self.heartbeats_sent = 0
+        self.bytes_sent = 0
+
+    def add(self, worker_id: str, info: Dict[str, Any], received: float) -> None:
+        """Queue a worker's latest heartbeat; `received` is its time.monotonic() arrival time."""
+        with self._lock:
+            self._pending[worker_id] = (received, info)
+
+    def start(self) -> None:
+        self._running = True
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def stop(self) -> None:
+        self._running = False
+        self.client.close()
+
+    def flush(self) -> int:
+        """Send everything queued as one batch. Returns how many heartbeats were sent."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        now = time.monotonic()
+        entries = [{
+            "worker_id": worker_id,
+            "age": round(now - received, 3),
+            "cpu_usage": info.get("cpu_usage", 0.0),
+            "ram_usage": info.get("ram_usage", 0.0),
+            "disk_usage": info.get("disk_usage", 0.0),
+            "additional_info": info.get("additional_info", {})
+        } for worker_id, (received, info) in pending.items()]
+        body = encode_batch(self.relay_id, entries, self.compress_level)
+        try:
+            response = self.client.post(f"{self.upstream_url}{BATCH_ENDPOINT}", content=body,
+                                        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Error forwarding {len(entries)} heartbeats upstream: {e}")
+            with self._lock:
+                for worker_id, entry in pending.items():
+                    self._pending.setdefault(worker_id, entry)
+            return 0
+        self.batches_sent += 1
+        self.heartbeats_sent += len(entries)
+        self.bytes_sent += len(body)
+        return len(entries)
+
+    def _loop(self) -> None:
+        while self._running:
+            started = time.monotonic()
+            self.flush()
+            time.sleep(max(self.interval - (time.monotonic() - started), 0.0))
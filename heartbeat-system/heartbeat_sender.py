@@ -0,0 +1,152 @@
+import asyncio
+import random
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from heartbeat_delta import DeltaEncoder
+from heartbeat_wire import MAX_DATAGRAM, encode_heartbeat
+
+
+class HeartbeatSender:
+    """
+    Sends a worker's heartbeats from an asyncio task.
+
+    - HTTP goes through one persistent httpx.AsyncClient connection with strict
+      timeouts, so a hung cluster manager costs at most `timeout` per attempt.
+    - The first beat waits a random part of the interval and every interval is
+      jittered, so a fleet started together does not beat in sync.
+    - When the manager is unavailable, attempts back off exponentially (with jitter)
+      up to `max_backoff`. Only the latest sample is kept: every attempt sends a fresh
+      one, never a backlog.
+    - With a DeltaEncoder only changed metrics are sent (see heartbeat_delta.py); with
+      a UDP target heartbeats go out as binary datagrams (see heartbeat_wire.py).
+    """
+
+    def __init__(self, sample: Callable[[], Dict[str, Any]], cluster_manager_url: Optional[str] = None,
+                 interval: float = 10.0, timeout: float = 2.0, jitter: float = 0.1, retry_base: float = 1.0,
+                 max_backoff: float = 60.0, delta_encoder: Optional[DeltaEncoder] = None,
+                 udp_target: Optional[Tuple[str, int]] = None):
+        """
+        :param sample: Returns the current heartbeat (HeartbeatData fields)
+        :param interval: Seconds between heartbeats
+        :param timeout: Seconds allowed for connecting to and answering one heartbeat
+        :param jitter: Fraction by which each interval is randomly shortened or stretched
+        :param retry_base: Delay before the first retry after a failed heartbeat; doubles per failure
+        """
+        self.sample = sample
+        self.url = f"{cluster_manager_url.rstrip('/')}/heartbeat" if cluster_manager_url else None
+        self.interval = interval
+        self.timeout = timeout
+        self.jitter = jitter
+        self.retry_base = retry_base
+        self.max_backoff = max_backoff
+        self.delta_encoder = delta_encoder
+        self.udp_target = udp_target
+        self.latest: Optional[Dict[str, Any]] = None
+        self.sent = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.last_success: Optional[float] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._udp_transport = None
+        self._udp_seq = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the heartbeat loop on the running event loop."""
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+            self._udp_transport = None
+
+    async def run(self) -> None:
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            try:
+                ok = await self.beat()
+            except Exception as e:
+                print(f"Error building heartbeat: {e}")
+                ok = False
+            await asyncio.sleep(self.next_delay(ok))
+
+    def next_delay(self, ok: bool) -> float:
+        if ok:
+            return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        backoff = min(self.retry_base * 2 ** (self.consecutive_failures - 1), self.max_backoff)
+        return backoff * random.uniform(0.5, 1.0)
+
+    async def beat(self) -> bool:
+        """Take a fresh sample and send it. Returns whether it was delivered (or handed to UDP)."""
+        self.latest = self.sample()
+        return await self.send(self.latest)
+
+    async def send(self, heartbeat: Dict[str, Any]) -> bool:
+        try:
+            if self.udp_target:
+                await self._send_udp(heartbeat)
+            else:
+                await self._send_http(heartbeat)
+        except Exception as e:
+            self.failed += 1
+            self.consecutive_failures += 1
+            self.last_error = str(e) or type(e).__name__
+            if self.delta_encoder:
+                # The manager may have missed this one; the next heartbeat is a full snapshot
+                self.delta_encoder.request_resync()
+            print(f"Error sending heartbeat ({self.consecutive_failures} in a row): {self.last_error}")
+            return False
+        self.sent += 1
+        self.consecutive_failures = 0
+        self.last_success = time.time()
+        return True
+
+    async def _send_http(self, heartbeat: Dict[str, Any]) -> None:
+        if not self.url:
+            raise RuntimeError("Cluster Manager URL not configured.")
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout),
+                                             limits=httpx.Limits(max_connections=1, max_keepalive_connections=1))
+        payload = self.delta_encoder.encode(heartbeat) if self.delta_encoder else heartbeat
+        response = await self._client.post(self.url, json=payload)
+        response.raise_for_status()
+        if self.delta_encoder and response.json().get("resync"):
+            self.delta_encoder.request_resync()
+
+    async def _send_udp(self, heartbeat: Dict[str, Any]) -> None:
+        if self._udp_transport is None:
+            self._udp_transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=self.udp_target)
+        self._udp_seq += 1
+        record = encode_heartbeat(heartbeat["worker_id"], self._udp_seq, heartbeat["cpu_usage"],
+                                  heartbeat["ram_usage"], heartbeat["disk_usage"],
+                                  heartbeat.get("additional_info", {}).get("pod_count", 0))
+        if len(record) > MAX_DATAGRAM:
+            raise ValueError(f"Heartbeat of {len(record)} bytes does not fit in one datagram")
+        self._udp_transport.sendto(record)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "transport": "udp" if self.udp_target else "http",
+            "delta": self.delta_encoder is not None,
+            "sent": self.sent,
+            "failed": self.failed,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "last_success": self.last_success,
+            "latest": self.latest
+        }
@@ -1,6 +1,11 @@
 import argparse
 from fastapi import FastAPI
-from storage_wrapper import StorageFactory
+
+import sys
+import os
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage_interface.storage_service_wrapper import StorageFactory
 from heartbeat_system import HeartbeatManager
 
 app = FastAPI()
@@ -30,6 +35,14 @@ def get_alive_workers():
 
     return {"alive_workers": heartbeat_manager.get_alive_workers()}
 
+@app.get("/workers/suspect")
+def get_suspect_workers():
+    """Get a list of workers whose heartbeats are late but who are not yet considered dead."""
+    if heartbeat_manager is None:
+        return {"error": "Storage not initialized"}
+
+    return {"suspect_workers": heartbeat_manager.get_suspect_workers()}
+
 @app.get("/workers/dead")
 def get_dead_workers():
     """Get a list of dead workers."""
@@ -1,60 +1,139 @@
 import time
 import threading
 from typing import Dict, List
-from storage_wrapper import StorageService  # Import the StorageService class from storage-service-wrapper.py
+
+import sys
+import os
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from storage_interface.storage_service_wrapper import StorageService, WatchEvent
+
+from phi_accrual import ALIVE, DEAD, PhiAccrualDetector
+
+# One record per worker: {"timestamp": float, "status": "alive" | "suspect" | "dead"}
+HEARTBEAT_PREFIX = "/heartbeats/"
+
+
+def heartbeat_key(worker_id: str) -> str:
+    return f"{HEARTBEAT_PREFIX}{worker_id}"
 
 
 class HeartbeatManager:
-    """Manages worker heartbeats and marks nodes as dead after timeout."""
+    """
+    Manages worker heartbeats and marks nodes as suspect, then dead, when they go quiet.
+
+    Each worker has a single record under /heartbeats/, written once per beat. The
+    manager keeps a local copy of that prefix, updated by a storage watch, and feeds
+    the heartbeat timestamps to a phi-accrual detector, so liveness queries never
+    read storage. State changes found by the detector are written back to the
+    worker's record, where the API gateway's scheduler picks them up.
+    """
 
-    def __init__(self, storage: StorageService, timeout: int = 30, cleanup_interval: int = 10):
+    def __init__(self, storage: StorageService, timeout: int = 30, cleanup_interval: int = 10,
+                 suspect_phi: float = 3.0, dead_phi: float = 8.0, heartbeat_interval: float = 10.0):
         """
         :param storage: Instance of StorageService (EtcdStorage or TestStorage)
-        :param timeout: Time in seconds before marking a worker as dead
-        :param cleanup_interval: Interval in seconds for cleanup of dead workers
+        :param timeout: Time in seconds after which a silent worker is dead whatever its phi
+        :param cleanup_interval: Longest time in seconds between checks for overdue workers
+        :param suspect_phi: Phi at which a worker becomes suspect
+        :param dead_phi: Phi at which a worker is considered dead
+        :param heartbeat_interval: Expected seconds between heartbeats, until a worker's rhythm is known
         """
         self.storage = storage
         self.timeout = timeout
+        self.cleanup_interval = cleanup_interval
+        # Heartbeat timestamps are unix times, so the detector runs on time.time()
+        self.detector = PhiAccrualDetector(timeout, suspect_phi=suspect_phi, dead_phi=dead_phi,
+                                           first_interval=heartbeat_interval)
+        self._records: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+        # Watch first so nothing written during the initial load is missed
+        self._watch_id = self.storage.watch_prefix(HEARTBEAT_PREFIX, self._on_event)
+        self.refresh()
 
         # Start background thread to clean up dead workers
         self.cleanup_thread = threading.Thread(target=self._cleanup_dead_workers, daemon=True)
         self.cleanup_thread.start()
 
+    def refresh(self) -> None:
+        """Reload every heartbeat record from storage."""
+        for key, value in self.storage.get_prefix(HEARTBEAT_PREFIX).items():
+            self._apply_record(key[len(HEARTBEAT_PREFIX):], value)
+
+    def stop(self) -> None:
+        if self._watch_id is not None:
+            self.storage.cancel_watch(self._watch_id)
+            self._watch_id = None
+
     def update_heartbeat(self, worker_id: str):
         """Worker sends a heartbeat to indicate it is alive."""
-        timestamp = time.time()
-        self.storage.put(f"/workers/{worker_id}/heartbeat", timestamp)
-        self.storage.put(f"/workers/{worker_id}/status", "alive")
+        record = {"timestamp": time.time(), "status": ALIVE}
+        self.storage.put(heartbeat_key(worker_id), record)
+        self._apply_record(worker_id, record)
 
     def get_alive_workers(self) -> List[str]:
         """Retrieve a list of workers that are alive."""
-        all_workers = self.storage.get_prefix("/workers")
-        alive_workers = [
-            worker.split("/")[-1]
-            for worker, status in all_workers.items()
-            if "/status" in worker and status == "alive"
-        ]
-        return alive_workers
+        self._advance()
+        return sorted(self.detector.alive)
+
+    def get_suspect_workers(self) -> List[str]:
+        """Retrieve a list of workers whose heartbeats are late but who are not yet considered dead."""
+        self._advance()
+        return sorted(self.detector.suspect)
 
     def get_dead_workers(self) -> List[str]:
-        """Retrieve a list of workers that have timed out."""
-        all_workers = self.storage.get_prefix("/workers")
-        current_time = time.time()
-        dead_workers = [
-            worker.split("/")[-1]
-            for worker, timestamp in all_workers.items()
-            if "/heartbeat" in worker and (current_time - float(timestamp)) >= self.timeout
-        ]
-        return dead_workers
+        """Retrieve a list of workers that have timed out or were marked dead."""
+        self._advance()
+        return sorted(self.detector.dead)
 
     def mark_worker_dead(self, worker_id: str):
         """Mark a worker as dead and update its status in storage."""
-        self.storage.put(f"/workers/{worker_id}/status", "dead")
+        self._write_status(worker_id, DEAD)
+
+    def _write_status(self, worker_id: str, status: str):
+        with self._lock:
+            previous = self._records.get(worker_id, {})
+        record = {"timestamp": previous.get("timestamp", 0), "status": status}
+        self.storage.put(heartbeat_key(worker_id), record)
+        self._apply_record(worker_id, record)
+
+    def _apply_record(self, worker_id: str, record) -> None:
+        """Feed a record to the detector: a newer timestamp is a heartbeat, a dead status a manual mark."""
+        if not isinstance(record, dict):
+            return
+        timestamp = record.get("timestamp", 0)
+        with self._lock:
+            previous = self._records.get(worker_id)
+            self._records[worker_id] = record
+        if previous is None or timestamp > previous.get("timestamp", 0):
+            self.detector.beat(worker_id, record, now=timestamp)
+        if record.get("status") == DEAD and worker_id not in self.detector.dead:
+            self.detector.mark_dead(worker_id)
+
+    def _on_event(self, event: WatchEvent) -> None:
+        worker_id = event.key[len(HEARTBEAT_PREFIX):]
+        if event.event_type == WatchEvent.DELETE:
+            with self._lock:
+                self._records.pop(worker_id, None)
+            return
+        self._apply_record(worker_id, event.value)
+
+    def _advance(self):
+        """Apply overdue deadlines and write each worker's new state to its record."""
+        for worker_id, state in self.detector.advance(time.time()):
+            with self._lock:
+                current = self._records.get(worker_id, {}).get("status")
+            # Written once per transition; another manager may already have written it
+            if current != state:
+                self._write_status(worker_id, state)
 
     def _cleanup_dead_workers(self):
-        """Background task to remove dead workers if they exceed timeout."""
+        """Background task that marks workers suspect or dead as their deadlines pass."""
         while True:
-            time.sleep(self.timeout)
-            dead_workers = self.get_dead_workers()
-            for worker in dead_workers:
-                self.mark_worker_dead(worker)
\ No newline at end of file
+            self._advance()
+            wait = self.cleanup_interval
+            next_deadline = self.detector.next_deadline()
+            if next_deadline is not None:
+                wait = min(wait, max(next_deadline - time.time(), 0.01))
+            time.sleep(wait)
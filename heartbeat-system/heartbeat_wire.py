@@ -0,0 +1,75 @@
+import struct
+import sys
+from typing import Callable, Dict
+
+# Binary heartbeat record, network byte order:
+#   magic "HB" | version u8 | flags u8 | seq u32 | cpu f32 | ram f32 | disk f32 | pod_count u16 | id_len u8
+# followed by id_len bytes of UTF-8 worker id. A datagram may carry several records back to back.
+MAGIC = b"HB"
+VERSION = 1
+HEADER = struct.Struct("!2sBBIfffHB")
+MAX_WORKER_ID = 255
+# Largest UDP payload we build, leaves room under a typical 1500 byte MTU
+MAX_DATAGRAM = 1400
+
+
+class WireError(ValueError):
+    pass
+
+
+def encode_heartbeat(worker_id: str, seq: int, cpu_usage: float, ram_usage: float, disk_usage: float,
+                     pod_count: int = 0, flags: int = 0) -> bytes:
+    """Encode one heartbeat record (23 bytes + the worker id)."""
+    raw_id = worker_id.encode("utf-8")
+    if len(raw_id) > MAX_WORKER_ID:
+        raise WireError(f"Worker id longer than {MAX_WORKER_ID} bytes: {worker_id}")
+    return HEADER.pack(MAGIC, VERSION, flags, seq & 0xFFFFFFFF, cpu_usage, ram_usage, disk_usage,
+                       min(pod_count, 0xFFFF), len(raw_id)) + raw_id
+
+
+class HeartbeatDecoder:
+    """
+    Decodes datagrams of binary heartbeat records straight into a callback
+    handle(worker_id, seq, flags, cpu, ram, disk, pod_count), with no intermediate
+    objects. Worker ids are decoded once and reused from a cache afterwards.
+    """
+
+    def __init__(self, handle: Callable, max_cached_ids: int = 200000):
+        self.handle = handle
+        self.max_cached_ids = max_cached_ids
+        self._ids: Dict[bytes, str] = {}
+        self.records = 0
+        self.errors = 0
+
+    def feed(self, data: bytes) -> int:
+        """Decode every record in a datagram. Returns how many were handled; stops at the first bad one."""
+        unpack_from = HEADER.unpack_from
+        header_size = HEADER.size
+        end = len(data)
+        offset = 0
+        handled = 0
+        while offset < end:
+            if end - offset < header_size:
+                self.errors += 1
+                break
+            magic, version, flags, seq, cpu, ram, disk, pod_count, id_len = unpack_from(data, offset)
+            offset += header_size
+            if magic != MAGIC or version != VERSION or end - offset < id_len:
+                self.errors += 1
+                break
+            raw_id = data[offset:offset + id_len]
+            offset += id_len
+            worker_id = self._ids.get(raw_id)
+            if worker_id is None:
+                try:
+                    worker_id = sys.intern(raw_id.decode("utf-8"))
+                except UnicodeDecodeError:
+                    self.errors += 1
+                    break
+                if len(self._ids) >= self.max_cached_ids:
+                    self._ids.clear()
+                self._ids[raw_id] = worker_id
+            self.handle(worker_id, seq, flags, cpu, ram, disk, pod_count)
+            handled += 1
+        self.records += handled
+        return handled
@@ -0,0 +1,88 @@
+import heapq
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+class LivenessTracker:
+    """
+    Tracks which workers are alive from their heartbeats, without scanning every worker.
+
+    Each heartbeat pushes the worker's new deadline (last beat + timeout) on a min-heap,
+    O(log n). Expiring pops only the deadlines that have passed, so a check costs
+    O(expired * log n) instead of O(workers), and the alive and dead sets are updated
+    as workers move between them. Old heap entries are skipped when popped (the worker
+    has a newer deadline) and the heap is rebuilt when they pile up. All state is
+    guarded by one lock, as heartbeats arrive on several server threads.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        self.info: Dict[str, Dict[str, Any]] = {}
+        self.alive: Set[str] = set()
+        self.dead: Set[str] = set()
+
+    def beat(self, worker_id: str, info: Dict[str, Any], now: Optional[float] = None) -> None:
+        """Record a heartbeat: the worker is alive until now + timeout."""
+        deadline = (now if now is not None else time.monotonic()) + self.timeout
+        with self._lock:
+            self.info[worker_id] = info
+            self._deadlines[worker_id] = deadline
+            heapq.heappush(self._heap, (deadline, worker_id))
+            self.dead.discard(worker_id)
+            self.alive.add(worker_id)
+            if len(self._heap) > 2 * len(self._deadlines) + 1024:
+                self._compact()
+
+    def expire(self, now: Optional[float] = None) -> List[str]:
+        """Move workers whose deadline has passed to the dead set. Returns the workers that just died."""
+        now = now if now is not None else time.monotonic()
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, worker_id = heapq.heappop(self._heap)
+                # Entries superseded by a later heartbeat (or a manual mark) are skipped
+                if self._deadlines.get(worker_id) != deadline:
+                    continue
+                del self._deadlines[worker_id]
+                self.alive.discard(worker_id)
+                self.dead.add(worker_id)
+                expired.append(worker_id)
+        return expired
+
+    def mark_dead(self, worker_id: str) -> bool:
+        """Mark a worker dead until its next heartbeat. Returns False for an unknown worker."""
+        with self._lock:
+            if worker_id not in self.info:
+                return False
+            self._deadlines.pop(worker_id, None)
+            self.alive.discard(worker_id)
+            self.dead.add(worker_id)
+            return True
+
+    def alive_workers(self) -> Dict[str, Dict[str, Any]]:
+        self.expire()
+        with self._lock:
+            return {worker_id: dict(self.info[worker_id], status="alive") for worker_id in self.alive}
+
+    def dead_workers(self) -> Dict[str, Dict[str, Any]]:
+        self.expire()
+        with self._lock:
+            return {worker_id: dict(self.info[worker_id], status="dead") for worker_id in self.dead}
+
+    def suspect_workers(self) -> Dict[str, Dict[str, Any]]:
+        """A fixed timeout has no suspect state; see PhiAccrualDetector."""
+        return {}
+
+    def next_deadline(self) -> Optional[float]:
+        """Earliest deadline still on the heap (may belong to a superseded entry)."""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def _compact(self) -> None:
+        """Caller holds the lock. Rebuild the heap from the current deadlines only."""
+        self._heap = [(deadline, worker_id) for worker_id, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
@@ -0,0 +1,237 @@
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+METRICS = ("cpu_usage", "ram_usage", "disk_usage")
+RAW = "raw"
+
+# Rollup resolutions: name -> bucket width in seconds
+ROLLUPS = {"1m": 60, "10m": 600}
+
+
+class Rollup:
+    """
+    min/max/sum/count per time bucket, one ring of `slots` buckets per worker row.
+    Bucket b lives in slot b % slots; a slot holding an older bucket is reset when
+    the first sample of a new bucket arrives. Samples older than the bucket a slot
+    already holds have fallen out of the ring and are ignored.
+    """
+
+    def __init__(self, width: int, slots: int, rows: int):
+        self.width = width
+        self.slots = slots
+        self.bucket = np.full((rows, slots), -1, dtype=np.int32)
+        self.count = np.zeros((rows, slots), dtype=np.uint16)
+        self.min = np.zeros((rows, slots, len(METRICS)), dtype=np.float32)
+        self.max = np.zeros((rows, slots, len(METRICS)), dtype=np.float32)
+        self.sum = np.zeros((rows, slots, len(METRICS)), dtype=np.float32)
+
+    def grow(self, rows: int) -> None:
+        extra = rows - self.bucket.shape[0]
+        self.bucket = np.concatenate([self.bucket, np.full((extra, self.slots), -1, dtype=np.int32)])
+        self.count = np.concatenate([self.count, np.zeros((extra, self.slots), dtype=np.uint16)])
+        shape = (extra, self.slots, len(METRICS))
+        self.min = np.concatenate([self.min, np.zeros(shape, dtype=np.float32)])
+        self.max = np.concatenate([self.max, np.zeros(shape, dtype=np.float32)])
+        self.sum = np.concatenate([self.sum, np.zeros(shape, dtype=np.float32)])
+
+    @property
+    def span(self) -> int:
+        """Seconds of history the ring holds."""
+        return self.width * self.slots
+
+    def add(self, row: int, timestamp: float, values: np.ndarray) -> None:
+        bucket = int(timestamp // self.width)
+        slot = bucket % self.slots
+        if self.bucket[row, slot] > bucket:
+            return
+        if self.bucket[row, slot] != bucket:
+            self.bucket[row, slot] = bucket
+            self.count[row, slot] = 0
+            self.min[row, slot] = values
+            self.max[row, slot] = values
+            self.sum[row, slot] = 0
+        else:
+            np.minimum(self.min[row, slot], values, out=self.min[row, slot])
+            np.maximum(self.max[row, slot], values, out=self.max[row, slot])
+        self.sum[row, slot] += values
+        self.count[row, slot] += 1
+
+    def clear(self, row: int) -> None:
+        self.bucket[row] = -1
+        self.count[row] = 0
+
+    def window(self, now: float, seconds: float):
+        """Bucket numbers covering the last `seconds` (at most a full ring) and their slots."""
+        last = int(now // self.width)
+        length = max(min(int(seconds // self.width) + 1, self.slots), 1)
+        buckets = np.arange(last - length + 1, last + 1, dtype=np.int64)
+        return buckets, buckets % self.slots
+
+    @property
+    def nbytes(self) -> int:
+        return self.bucket.nbytes + self.count.nbytes + self.min.nbytes + self.max.nbytes + self.sum.nbytes
+
+
+class MetricSeries:
+    """
+    Bounded history of every worker's cpu, ram and disk usage, in preallocated NumPy
+    arrays: a ring of the last `raw_slots` heartbeats per worker, plus 1-minute and
+    10-minute rollups (min, max, avg) kept as rings of buckets. Each worker is a row,
+    so memory is fixed per worker (see bytes_per_worker) and capped by `max_workers`,
+    and cluster-wide aggregates are computed across rows without Python loops.
+
+    With the defaults a worker keeps 1 hour of 10-second heartbeats, 6 hours of
+    minutes and 3 days of 10-minute buckets. A worker silent for longer than that has
+    nothing left to show, so when the arrays are full its row is cleared and given to
+    a new worker before they grow (or samples are dropped at max_workers).
+    """
+
+    def __init__(self, max_workers: int = 10000, raw_slots: int = 360, minute_slots: int = 360,
+                 ten_minute_slots: int = 432, initial_rows: int = 64):
+        self.max_workers = max_workers
+        self.raw_slots = raw_slots
+        rows = min(initial_rows, max_workers)
+        self._rows: Dict[str, int] = {}
+        # Rows handed out so far (some may be free again), free rows, and each row's latest sample time
+        self._used = 0
+        self._free: List[int] = []
+        self._last_seen = np.zeros(rows, dtype=np.float64)
+        self._raw_time = np.zeros((rows, raw_slots), dtype=np.float64)
+        self._raw_values = np.zeros((rows, raw_slots, len(METRICS)), dtype=np.float32)
+        self._raw_next = np.zeros(rows, dtype=np.int64)
+        self.rollups = {"1m": Rollup(ROLLUPS["1m"], minute_slots, rows),
+                        "10m": Rollup(ROLLUPS["10m"], ten_minute_slots, rows)}
+        self.retention = max(rollup.span for rollup in self.rollups.values())
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.reclaimed = 0
+
+    @property
+    def workers(self) -> List[str]:
+        return list(self._rows)
+
+    @property
+    def nbytes(self) -> int:
+        return (self._raw_time.nbytes + self._raw_values.nbytes + self._raw_next.nbytes + self._last_seen.nbytes
+                + sum(rollup.nbytes for rollup in self.rollups.values()))
+
+    @property
+    def bytes_per_worker(self) -> int:
+        return self.nbytes // self._raw_time.shape[0]
+
+    def record(self, worker_id: str, timestamp: float, cpu_usage: float, ram_usage: float, disk_usage: float) -> bool:
+        """Add one sample. Returns False if the worker is new and max_workers is reached."""
+        values = np.array((cpu_usage, ram_usage, disk_usage), dtype=np.float32)
+        with self._lock:
+            row = self._rows.get(worker_id)
+            if row is None:
+                row = self._add_row(worker_id, timestamp)
+                if row is None:
+                    self.dropped += 1
+                    return False
+            self._last_seen[row] = max(self._last_seen[row], timestamp)
+            position = self._raw_next[row] % self.raw_slots
+            self._raw_time[row, position] = timestamp
+            self._raw_values[row, position] = values
+            self._raw_next[row] += 1
+            for rollup in self.rollups.values():
+                rollup.add(row, timestamp, values)
+        return True
+
+    def worker_window(self, worker_id: str, resolution: str, seconds: float, now: float) -> Optional[dict]:
+        """A worker's samples (raw) or buckets (rollups) from the last `seconds`, oldest first, as columns."""
+        with self._lock:
+            row = self._rows.get(worker_id)
+            if row is None:
+                return None
+            if resolution == RAW:
+                times = self._raw_time[row]
+                keep = np.nonzero(times >= max(now - seconds, np.finfo(np.float64).tiny))[0]
+                keep = keep[np.argsort(times[keep], kind="stable")]
+                values = self._raw_values[row, keep]
+                return {"resolution": RAW, "timestamps": times[keep].tolist(),
+                        **{metric: values[:, i].tolist() for i, metric in enumerate(METRICS)}}
+
+            rollup = self.rollups[resolution]
+            buckets, slots = rollup.window(now, seconds)
+            present = rollup.bucket[row, slots] == buckets
+            slots = slots[present]
+            counts = rollup.count[row, slots].astype(np.float32)
+            mins, maxs = rollup.min[row, slots], rollup.max[row, slots]
+            avgs = rollup.sum[row, slots] / counts[:, None]
+            return {"resolution": resolution, "timestamps": (buckets[present] * rollup.width).tolist(),
+                    "samples": counts.astype(np.int64).tolist(),
+                    **{metric: {"min": mins[:, i].tolist(), "max": maxs[:, i].tolist(), "avg": avgs[:, i].tolist()}
+                       for i, metric in enumerate(METRICS)}}
+
+    def cluster_window(self, resolution: str, seconds: float, now: float) -> dict:
+        """
+        Cluster-wide min, max and avg per bucket over every worker, plus how many
+        workers reported in each bucket. The avg weighs every sample equally.
+        """
+        rollup = self.rollups[resolution]
+        buckets, slots = rollup.window(now, seconds)
+        with self._lock:
+            rows = self._used
+            present = rollup.bucket[:rows, slots] == buckets[None, :]
+            mins = np.where(present[..., None], rollup.min[:rows, slots], np.inf).min(axis=0, initial=np.inf)
+            maxs = np.where(present[..., None], rollup.max[:rows, slots], -np.inf).max(axis=0, initial=-np.inf)
+            sums = np.where(present[..., None], rollup.sum[:rows, slots], 0).sum(axis=0)
+            counts = np.where(present, rollup.count[:rows, slots], 0).sum(axis=0)
+        reported = present.sum(axis=0)
+        keep = reported > 0
+        avgs = sums[keep] / counts[keep][:, None]
+        return {"resolution": resolution, "timestamps": (buckets[keep] * rollup.width).tolist(),
+                "workers": reported[keep].tolist(), "samples": counts[keep].tolist(),
+                **{metric: {"min": mins[keep, i].tolist(), "max": maxs[keep, i].tolist(), "avg": avgs[:, i].tolist()}
+                   for i, metric in enumerate(METRICS)}}
+
+    def _add_row(self, worker_id: str, now: float) -> Optional[int]:
+        """
+        Caller holds the lock. Gives a new worker a row: a free one, a fresh one, or once
+        the arrays are full one reclaimed from idle workers, doubling the arrays only
+        when none are idle.
+        """
+        capacity = self._raw_time.shape[0]
+        if not self._free and self._used >= capacity:
+            self._reclaim_idle(now)
+        if self._free:
+            row = self._free.pop()
+        elif self._used < capacity:
+            row = self._used
+            self._used += 1
+        elif capacity < self.max_workers:
+            grown = min(capacity * 2, self.max_workers)
+            extra = grown - capacity
+            self._raw_time = np.concatenate([self._raw_time, np.zeros((extra, self.raw_slots))])
+            self._raw_values = np.concatenate(
+                [self._raw_values, np.zeros((extra, self.raw_slots, len(METRICS)), dtype=np.float32)])
+            self._raw_next = np.concatenate([self._raw_next, np.zeros(extra, dtype=np.int64)])
+            self._last_seen = np.concatenate([self._last_seen, np.zeros(extra)])
+            for rollup in self.rollups.values():
+                rollup.grow(grown)
+            row = self._used
+            self._used += 1
+        else:
+            return None
+        self._rows[worker_id] = row
+        return row
+
+    def _reclaim_idle(self, now: float) -> None:
+        """Caller holds the lock. Free the rows of workers with no sample within the retention."""
+        idle = np.nonzero(self._last_seen[:self._used] < now - self.retention)[0]
+        if len(idle) == 0:
+            return
+        idle_rows = set(idle.tolist())
+        for worker_id in [worker_id for worker_id, row in self._rows.items() if row in idle_rows]:
+            row = self._rows.pop(worker_id)
+            self._raw_time[row] = 0
+            self._raw_values[row] = 0
+            self._raw_next[row] = 0
+            self._last_seen[row] = 0
+            for rollup in self.rollups.values():
+                rollup.clear(row)
+            self._free.append(row)
+        self.reclaimed += len(idle_rows)
@@ -0,0 +1,206 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+PROC_STAT = "/proc/stat"
+PROC_MEMINFO = "/proc/meminfo"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+MB = 1024 * 1024
+
+
+def read_from_start(handle) -> bytes:
+    """
+    Re-read an open /proc file. The handles are unbuffered: a buffered reader would
+    serve a seek(0) from its old buffer and return stale numbers.
+    """
+    handle.seek(0)
+    chunks = []
+    while True:
+        chunk = handle.read(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+class ProcessStat:
+    """Open handle on /proc/{pid}/stat plus the counters from the previous read."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.handle = open(f"/proc/{pid}/stat", "rb", buffering=0)
+        self.last_ticks: Optional[int] = None
+
+    def read(self):
+        """Returns (utime + stime in clock ticks, resident set size in bytes)."""
+        data = read_from_start(self.handle)
+        # The command name is in parentheses and may contain spaces; fields follow the last ')'
+        fields = data[data.rindex(b")") + 2:].split()
+        ticks = int(fields[11]) + int(fields[12])
+        rss = int(fields[21]) * PAGE_SIZE
+        return ticks, rss
+
+    def close(self):
+        self.handle.close()
+
+
+class NodeMetricsSampler:
+    """
+    Samples real node utilization from /proc without spawning anything: CPU from
+    /proc/stat deltas, RAM from /proc/meminfo (MemTotal - MemAvailable), disk from
+    statvfs, and CPU/RSS of each tracked instance process from /proc/{pid}/stat.
+    The /proc files stay open and are re-read from the start on every sample.
+
+    Samples are kept in a short window so heartbeats can report an average over the
+    last heartbeat interval instead of a single spike.
+    """
+
+    def __init__(self, disk_path: str = "/", interval: float = 1.0, window: int = 60):
+        self.disk_path = disk_path
+        self.interval = interval
+        self.samples: deque = deque(maxlen=window)
+        self.processes: Dict[str, ProcessStat] = {}
+        self._lock = threading.Lock()
+        self._last_cpu = None
+        self._last_time = None
+        self._sampling_seconds = 0.0
+        self._started_at = time.monotonic()
+        self._running = False
+        try:
+            self._stat = open(PROC_STAT, "rb", buffering=0)
+            self._meminfo = open(PROC_MEMINFO, "rb", buffering=0)
+            self.available = True
+        except OSError:
+            print("No /proc on this system, node metrics will read as zero")
+            self._stat = self._meminfo = None
+            self.available = False
+
+    def start(self) -> None:
+        """Sample every `interval` seconds on a background thread."""
+        self._running = True
+        self.sample()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def stop(self) -> None:
+        self._running = False
+
+    def track(self, pod_id: str, pid: int) -> bool:
+        """Start sampling an instance's process. Returns False if the process does not exist."""
+        with self._lock:
+            existing = self.processes.get(pod_id)
+            if existing is not None:
+                if existing.pid == pid:
+                    return True
+                existing.close()
+            try:
+                self.processes[pod_id] = ProcessStat(pid)
+            except OSError:
+                self.processes.pop(pod_id, None)
+                return False
+        return True
+
+    def untrack(self, pod_id: str) -> None:
+        with self._lock:
+            process = self.processes.pop(pod_id, None)
+        if process is not None:
+            process.close()
+
+    def sample(self) -> dict:
+        """Take one sample and add it to the window."""
+        started = time.thread_time()
+        now = time.monotonic()
+        sample = {
+            "timestamp": time.time(),
+            "cpu_usage": self._cpu_percent(),
+            "ram_usage": self._ram_used_mb(),
+            "disk_usage": self._disk_used_mb(),
+            "pods": self._process_stats(now)
+        }
+        self._last_time = now
+        self.samples.append(sample)
+        self._sampling_seconds += time.thread_time() - started
+        return sample
+
+    def summary(self, seconds: float) -> dict:
+        """Average CPU and RAM over the last `seconds`, with the latest disk and per-pod numbers."""
+        if not self.samples:
+            self.sample()
+        cutoff = time.time() - seconds
+        recent: List[dict] = [sample for sample in self.samples if sample["timestamp"] >= cutoff] or [self.samples[-1]]
+        latest = recent[-1]
+        return {
+            "cpu_usage": sum(sample["cpu_usage"] for sample in recent) / len(recent),
+            "ram_usage": sum(sample["ram_usage"] for sample in recent) / len(recent),
+            "disk_usage": latest["disk_usage"],
+            "pods": latest["pods"],
+            "samples": len(recent)
+        }
+
+    @property
+    def overhead_percent(self) -> float:
+        """CPU time spent sampling, as a percentage of the time the sampler has existed."""
+        elapsed = time.monotonic() - self._started_at
+        return 100.0 * self._sampling_seconds / elapsed if elapsed > 0 else 0.0
+
+    def _loop(self) -> None:
+        while self._running:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Error sampling node metrics: {e}")
+
+    def _cpu_percent(self) -> float:
+        if not self.available:
+            return 0.0
+        # First line: cpu user nice system idle iowait irq softirq steal ...
+        first_line = read_from_start(self._stat).split(b"\n", 1)[0]
+        values = [int(value) for value in first_line.split()[1:9]]
+        idle = values[3] + values[4]
+        total = sum(values)
+        previous = self._last_cpu
+        self._last_cpu = (idle, total)
+        if previous is None or total == previous[1]:
+            return 0.0
+        return 100.0 * (1.0 - (idle - previous[0]) / (total - previous[1]))
+
+    def _ram_used_mb(self) -> float:
+        if not self.available:
+            return 0.0
+        fields = {}
+        for line in read_from_start(self._meminfo).splitlines():
+            name, value = line.split(b":", 1)
+            if name in (b"MemTotal", b"MemAvailable"):
+                fields[name] = int(value.split()[0])  # kB
+                if len(fields) == 2:
+                    break
+        return (fields.get(b"MemTotal", 0) - fields.get(b"MemAvailable", 0)) / 1024.0
+
+    def _disk_used_mb(self) -> float:
+        try:
+            stats = os.statvfs(self.disk_path)
+        except (OSError, AttributeError):
+            return 0.0
+        return (stats.f_blocks - stats.f_bfree) * stats.f_frsize / MB
+
+    def _process_stats(self, now: float) -> Dict[str, dict]:
+        elapsed = now - self._last_time if self._last_time is not None else None
+        stats = {}
+        gone = []
+        with self._lock:
+            for pod_id, process in self.processes.items():
+                try:
+                    ticks, rss = process.read()
+                except (OSError, ValueError, IndexError):
+                    gone.append(pod_id)
+                    continue
+                cpu = 0.0
+                if process.last_ticks is not None and elapsed:
+                    cpu = 100.0 * (ticks - process.last_ticks) / CLOCK_TICKS / elapsed
+                process.last_ticks = ticks
+                stats[pod_id] = {"pid": process.pid, "cpu_usage": cpu, "ram_usage": rss / MB}
+            for pod_id in gone:
+                self.processes.pop(pod_id).close()
+        return stats
@@ -0,0 +1,189 @@
+import heapq
+import math
+import time
+from collections import deque
+from statistics import NormalDist
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from liveness_tracker import LivenessTracker
+
+ALIVE = "alive"
+SUSPECT = "suspect"
+DEAD = "dead"
+
+_STANDARD_NORMAL = NormalDist()
+
+# Reported phi is capped here, so it stays a finite (JSON-safe) number for long-silent workers
+MAX_PHI = 1000.0
+
+
+class ArrivalWindow:
+    """The last `size` intervals between a worker's heartbeats, with a running mean and deviation."""
+
+    __slots__ = ("intervals", "total", "squares", "last_arrival")
+
+    def __init__(self, size: int):
+        self.intervals: Deque[float] = deque(maxlen=size)
+        self.total = 0.0
+        self.squares = 0.0
+        self.last_arrival: Optional[float] = None
+
+    def add(self, arrival: float) -> None:
+        if self.last_arrival is not None and arrival > self.last_arrival:
+            interval = arrival - self.last_arrival
+            if len(self.intervals) == self.intervals.maxlen:
+                oldest = self.intervals[0]
+                self.total -= oldest
+                self.squares -= oldest * oldest
+            self.intervals.append(interval)
+            self.total += interval
+            self.squares += interval * interval
+        if self.last_arrival is None or arrival > self.last_arrival:
+            self.last_arrival = arrival
+
+    def stats(self, first_interval: float) -> Tuple[float, float]:
+        """Mean and standard deviation; before any interval is known, a guess from first_interval."""
+        count = len(self.intervals)
+        if count == 0:
+            return first_interval, first_interval / 4
+        mean = self.total / count
+        variance = max(self.squares / count - mean * mean, 0.0)
+        return mean, math.sqrt(variance)
+
+
+class PhiAccrualDetector(LivenessTracker):
+    """
+    Phi-accrual failure detector (Hayashibara et al.). For each worker the intervals
+    between heartbeats are kept in a bounded window and modelled as a normal
+    distribution; phi = -log10(P(the next heartbeat is still to come)) grows the longer
+    a worker is silent compared to its usual rhythm.
+
+    A worker becomes suspect when phi passes `suspect_phi` and dead when it passes
+    `dead_phi`, or in any case after `timeout` seconds of silence. Because phi only
+    grows with time since the last heartbeat, both thresholds turn into deadlines
+    (via the inverse normal CDF) when the heartbeat arrives. They go on the same
+    min-heap as in LivenessTracker, so heartbeats stay O(log n) and only due
+    deadlines are looked at.
+    """
+
+    def __init__(self, timeout: float, suspect_phi: float = 3.0, dead_phi: float = 8.0, window: int = 100,
+                 first_interval: float = 10.0, min_std: float = 1.0, acceptable_pause: float = 0.0):
+        super().__init__(timeout)
+        self.suspect_phi = suspect_phi
+        self.dead_phi = dead_phi
+        self.window = window
+        self.first_interval = first_interval
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        self.suspect: Set[str] = set()
+        self._arrivals: Dict[str, ArrivalWindow] = {}
+        self._suspect_deadlines: Dict[str, float] = {}
+        # Standard normal quantile at which each threshold is reached
+        self._suspect_z = self._quantile(suspect_phi)
+        self._dead_z = self._quantile(dead_phi)
+
+    @staticmethod
+    def _quantile(phi: float) -> float:
+        # Mirrored form: 1 - 10**-phi rounds to 1.0 (out of range for inv_cdf) once phi reaches ~16
+        return -_STANDARD_NORMAL.inv_cdf(10.0 ** -phi)
+
+    def beat(self, worker_id: str, info: Dict[str, Any], now: Optional[float] = None) -> None:
+        """Record a heartbeat and schedule the worker's suspect and dead deadlines."""
+        arrival = now if now is not None else time.monotonic()
+        with self._lock:
+            arrivals = self._arrivals.get(worker_id)
+            if arrivals is None:
+                arrivals = self._arrivals[worker_id] = ArrivalWindow(self.window)
+            arrivals.add(arrival)
+            mean, std = arrivals.stats(self.first_interval)
+            mean += self.acceptable_pause
+            std = max(std, self.min_std)
+            hard_deadline = arrivals.last_arrival + self.timeout
+            dead_at = min(arrivals.last_arrival + mean + self._dead_z * std, hard_deadline)
+            suspect_at = min(arrivals.last_arrival + mean + self._suspect_z * std, dead_at)
+
+            self.info[worker_id] = info
+            self._deadlines[worker_id] = dead_at
+            self._suspect_deadlines[worker_id] = suspect_at
+            heapq.heappush(self._heap, (suspect_at, worker_id, SUSPECT))
+            heapq.heappush(self._heap, (dead_at, worker_id, DEAD))
+            self.dead.discard(worker_id)
+            self.suspect.discard(worker_id)
+            self.alive.add(worker_id)
+            if len(self._heap) > 4 * len(self._deadlines) + 1024:
+                self._compact()
+
+    def advance(self, now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """Apply every deadline that has passed. Returns the (worker_id, new state) transitions."""
+        now = now if now is not None else time.monotonic()
+        transitions = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, worker_id, state = heapq.heappop(self._heap)
+                if state == SUSPECT:
+                    if self._suspect_deadlines.get(worker_id) != deadline or worker_id not in self.alive:
+                        continue
+                    self.alive.discard(worker_id)
+                    self.suspect.add(worker_id)
+                elif self._deadlines.get(worker_id) == deadline:
+                    del self._deadlines[worker_id]
+                    self._suspect_deadlines.pop(worker_id, None)
+                    self.alive.discard(worker_id)
+                    self.suspect.discard(worker_id)
+                    self.dead.add(worker_id)
+                else:
+                    continue
+                transitions.append((worker_id, state))
+        return transitions
+
+    def expire(self, now: Optional[float] = None) -> List[str]:
+        """Same as LivenessTracker.expire: apply due deadlines, return the workers that just died."""
+        return [worker_id for worker_id, state in self.advance(now) if state == DEAD]
+
+    def mark_dead(self, worker_id: str) -> bool:
+        with self._lock:
+            if worker_id not in self.info:
+                return False
+            self._deadlines.pop(worker_id, None)
+            self._suspect_deadlines.pop(worker_id, None)
+            self.alive.discard(worker_id)
+            self.suspect.discard(worker_id)
+            self.dead.add(worker_id)
+            return True
+
+    def state(self, worker_id: str) -> Optional[str]:
+        with self._lock:
+            if worker_id in self.alive:
+                return ALIVE
+            if worker_id in self.suspect:
+                return SUSPECT
+            if worker_id in self.dead:
+                return DEAD
+            return None
+
+    def phi(self, worker_id: str, now: Optional[float] = None) -> float:
+        """Current suspicion level of a worker (0 right after a heartbeat)."""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            arrivals = self._arrivals.get(worker_id)
+            if arrivals is None or arrivals.last_arrival is None:
+                return 0.0
+            mean, std = arrivals.stats(self.first_interval)
+            elapsed = now - arrivals.last_arrival
+        mean += self.acceptable_pause
+        std = max(std, self.min_std)
+        # Upper tail via symmetry, which keeps precision far out where 1 - cdf rounds to 0
+        remaining = NormalDist(mean, std).cdf(2 * mean - elapsed)
+        return min(-math.log10(remaining), MAX_PHI) if remaining > 0 else MAX_PHI
+
+    def suspect_workers(self) -> Dict[str, Dict[str, Any]]:
+        self.expire()
+        with self._lock:
+            return {worker_id: dict(self.info[worker_id], status=SUSPECT) for worker_id in self.suspect}
+
+    def _compact(self) -> None:
+        """Caller holds the lock. Rebuild the heap from the current deadlines only."""
+        self._heap = [(deadline, worker_id, DEAD) for worker_id, deadline in self._deadlines.items()]
+        self._heap.extend((deadline, worker_id, SUSPECT) for worker_id, deadline in self._suspect_deadlines.items()
+                          if worker_id in self.alive)
+        heapq.heapify(self._heap)
@@ -1,16 +1,23 @@
 import argparse
 import time
-import threading
-import requests
 from fastapi import FastAPI
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import uvicorn
 
+from heartbeat_delta import DeltaEncoder
+from heartbeat_sender import HeartbeatSender
+from node_metrics import NodeMetricsSampler
+
 app = FastAPI()
 
-# Global variable for the cluster manager URL (to which heartbeats are sent)
-CLUSTER_MANAGER_URL = None
+HEARTBEAT_INTERVAL = 10
+
+# Sends this worker's heartbeats to the cluster manager; set up from the command line
+sender: Optional[HeartbeatSender] = None
+
+# Real node utilization, sampled from /proc in the background
+sampler = NodeMetricsSampler()
 
 # Define a model for the heartbeat data (includes node metrics and any pod info)
 class HeartbeatData(BaseModel):
@@ -32,63 +39,99 @@ class PodStatusUpdate(BaseModel):
 @app.post("/pod-status")
 def receive_pod_status(update: PodStatusUpdate):
     print(f"Worker received pod update from {update.pod_id}: {update.status}")
-    # Here you might update local metrics or state based on pod info.
+    # A running pod that reports its pid gets its CPU and memory sampled
+    pid = update.additional_info.get("pid")
+    if update.status == "running" and pid:
+        if not sampler.track(update.pod_id, int(pid)):
+            print(f"Pod {update.pod_id} reported pid {pid}, which does not exist")
+    elif update.status != "running":
+        sampler.untrack(update.pod_id)
     return {"message": "Pod status processed"}
 
-def send_heartbeat(heartbeat_data: HeartbeatData):
-    """Send a heartbeat to the cluster manager."""
-    if not CLUSTER_MANAGER_URL:
-        print("Cluster Manager URL not configured.")
-        return
-    try:
-        response = requests.post(f"{CLUSTER_MANAGER_URL}/heartbeat", json=heartbeat_data.dict())
-        print(f"Heartbeat sent from {heartbeat_data.worker_id}, response status: {response.status_code}")
-    except Exception as e:
-        print(f"Error sending heartbeat: {e}")
-
-def aggregate_and_send_heartbeat(worker_id: str):
+def build_heartbeat(worker_id: str) -> HeartbeatData:
     """
-    Gather node metrics (and any aggregated pod info) and send a heartbeat.
-    In a production system, replace these simulated metrics with actual measurements.
+    Gather node metrics (and any aggregated pod info) into a heartbeat.
+    CPU (percent) and RAM (MB) are averaged over the last heartbeat interval; disk (MB used) is the latest sample.
     """
-    # Simulated metrics
-    cpu_usage = 42.0             # Replace with real CPU usage
-    ram_usage = 2048.0           # Replace with real RAM usage in MB
-    disk_usage = 50000.0         # Replace with real Disk usage (MB or GB)
+    metrics = sampler.summary(HEARTBEAT_INTERVAL)
     additional_info = {
-        "pod_count": 3,
-        "timestamp": time.time()
+        "pod_count": len(metrics["pods"]),
+        "pods": metrics["pods"],
+        "samples": metrics["samples"],
+        "sampler_overhead_pct": sampler.overhead_percent
     }
-    heartbeat = HeartbeatData(
+    # Delta heartbeats leave the send time out, it would change on every beat; the manager stamps arrival
+    if sender is None or sender.delta_encoder is None:
+        additional_info["timestamp"] = time.time()
+    return HeartbeatData(
         worker_id=worker_id,
-        cpu_usage=cpu_usage,
-        ram_usage=ram_usage,
-        disk_usage=disk_usage,
+        cpu_usage=metrics["cpu_usage"],
+        ram_usage=metrics["ram_usage"],
+        disk_usage=metrics["disk_usage"],
         additional_info=additional_info
     )
-    send_heartbeat(heartbeat)
+
+@app.on_event("startup")
+async def start_heartbeats():
+    if sender is not None:
+        sender.start()
+
+@app.on_event("shutdown")
+async def stop_heartbeats():
+    if sender is not None:
+        await sender.stop()
 
 @app.get("/trigger-heartbeat")
-def trigger_heartbeat(worker_id: str):
+async def trigger_heartbeat(worker_id: str):
     """Endpoint to manually trigger a heartbeat (for testing purposes)."""
-    aggregate_and_send_heartbeat(worker_id)
-    return {"message": f"Heartbeat triggered for {worker_id}"}
+    if sender is None:
+        return {"message": "Cluster Manager URL not configured."}
+    delivered = await sender.send(build_heartbeat(worker_id).dict())
+    return {"message": f"Heartbeat triggered for {worker_id}", "delivered": delivered}
+
+@app.get("/heartbeat/sender")
+def get_sender_stats():
+    """Delivery counters of the heartbeat sender, with the latest sample it took."""
+    if sender is None:
+        return {"message": "Cluster Manager URL not configured."}
+    return sender.stats()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Start the Worker Node Heartbeat Service")
     parser.add_argument("--cluster-manager-url", type=str, required=True, help="URL of the cluster manager heartbeat service")
     parser.add_argument("--worker-id", type=str, required=True, help="Unique worker node ID")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between node metric samples")
+    parser.add_argument("--disk-path", type=str, default="/", help="Filesystem whose usage is reported")
+    parser.add_argument("--udp-target", type=str, default=None,
+                        help="host:port of the cluster manager's UDP receiver; sends binary heartbeats instead of HTTP")
+    parser.add_argument("--delta", action="store_true",
+                        help="Send only the metrics that changed, with a full snapshot every --full-every beats")
+    parser.add_argument("--delta-epsilon", type=float, default=1.0,
+                        help="Smallest change of a metric (percent or MB) that is sent in a delta heartbeat")
+    parser.add_argument("--full-every", type=int, default=10, help="Send a full snapshot every N delta heartbeats")
+    parser.add_argument("--heartbeat-interval", type=float, default=HEARTBEAT_INTERVAL, help="Seconds between heartbeats")
+    parser.add_argument("--heartbeat-timeout", type=float, default=2.0,
+                        help="Seconds allowed for the cluster manager to answer a heartbeat")
+    parser.add_argument("--max-backoff", type=float, default=60.0,
+                        help="Longest wait between attempts while the cluster manager is unavailable")
     args = parser.parse_args()
     
-    CLUSTER_MANAGER_URL = args.cluster_manager_url
+    HEARTBEAT_INTERVAL = args.heartbeat_interval
     worker_id = args.worker_id
+    udp_target = None
+    if args.udp_target:
+        host, port = args.udp_target.rsplit(":", 1)
+        udp_target = (host, int(port))
 
-    # Start a background thread to periodically send heartbeats (e.g., every 10 seconds)
-    def heartbeat_loop():
-        while True:
-            aggregate_and_send_heartbeat(worker_id)
-            time.sleep(10)
-    
-    threading.Thread(target=heartbeat_loop, daemon=True).start()
+    sampler = NodeMetricsSampler(disk_path=args.disk_path, interval=args.sample_interval)
+    sampler.start()
+
+    # Heartbeats go out from the server's event loop once it starts
+    sender = HeartbeatSender(lambda: build_heartbeat(worker_id).dict(), args.cluster_manager_url,
+                             interval=HEARTBEAT_INTERVAL, timeout=args.heartbeat_timeout,
+                             max_backoff=args.max_backoff,
+                             delta_encoder=DeltaEncoder(epsilon=args.delta_epsilon, full_every=args.full_every)
+                             if args.delta else None,
+                             udp_target=udp_target)
     
     uvicorn.run(app, host="0.0.0.0", port=8003)
\ No newline at end of file
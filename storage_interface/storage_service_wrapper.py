@@ -1,6 +1,24 @@
 from abc import ABC, abstractmethod
 import json
-from typing import Dict, List, Optional, Tuple, Any, Union
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple, Any, Union
+
+
+class WatchEvent:
+    """A single change to a watched key."""
+
+    PUT = "put"
+    DELETE = "delete"
+
+    def __init__(self, event_type: str, key: str, value: Any, revision: int):
+        self.event_type = event_type
+        self.key = key
+        self.value = value
+        self.revision = revision
+
+    def __repr__(self):
+        return f"WatchEvent({self.event_type}, {self.key}, revision={self.revision})"
 
 
 class StorageService(ABC):
@@ -20,17 +38,49 @@ class StorageService(ABC):
     def delete(self, key: str) -> bool:
         """Delete a key. Returns True if key existed and was deleted."""
         pass
+
+    @abstractmethod
+    def get_with_revision(self, key: str) -> Tuple[Optional[Any], int]:
+        """Retrieve a value and the revision it was last written at; (None, 0) if the key doesn't exist."""
+        pass
+
+    @abstractmethod
+    def put_if_revision(self, key: str, value: Any, revision: int) -> bool:
+        """
+        Store a value only if the key was last written at `revision` (0: only if it
+        doesn't exist). Returns False, writing nothing, if the key changed meanwhile.
+        """
+        pass
     
     @abstractmethod
     def get_prefix(self, prefix: str) -> Dict[str, Any]:
         """Get all keys and values with the given prefix."""
         pass
     
+    @abstractmethod
+    def get_prefix_revisions(self, prefix: str) -> Dict[str, Tuple[Any, int]]:
+        """Get all keys with the given prefix as {key: (value, revision it was last written at)}."""
+        pass
+
     @abstractmethod
     def delete_prefix(self, prefix: str) -> int:
         """Delete all keys with the given prefix. Returns count of deleted keys."""
         pass
 
+    @abstractmethod
+    def watch_prefix(self, prefix: str, callback: Callable[[WatchEvent], None],
+                     start_revision: Optional[int] = None) -> Any:
+        """
+        Call callback with a WatchEvent for every change under the prefix.
+        Returns a watch id that can be passed to cancel_watch.
+        """
+        pass
+
+    @abstractmethod
+    def cancel_watch(self, watch_id: Any) -> None:
+        """Stop a watch started with watch_prefix."""
+        pass
+
 
 class EtcdStorage(StorageService):
     """Etcd implementation of the StorageService interface."""
@@ -72,6 +122,22 @@ class EtcdStorage(StorageService):
         """Delete a key. Returns True if key existed and was deleted."""
         result = self.client.delete(key)
         return result
+
+    def get_with_revision(self, key: str) -> Tuple[Optional[Any], int]:
+        """Retrieve a value (deserialized like get) and its mod revision."""
+        value, metadata = self.client.get(key)
+        if value is None:
+            return None, 0
+        return self._decode(value), metadata.mod_revision
+
+    def put_if_revision(self, key: str, value: Any, revision: int) -> bool:
+        """Compare-and-swap on the key's mod revision, in one etcd transaction."""
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        transactions = self.client.transactions
+        compare = transactions.version(key) == 0 if revision == 0 else transactions.mod(key) == revision
+        succeeded, _ = self.client.transaction(compare=[compare], success=[transactions.put(key, value)], failure=[])
+        return succeeded
     
     def get_prefix(self, prefix: str) -> Dict[str, Any]:
         """Get all keys and values with the given prefix."""
@@ -88,21 +154,70 @@ class EtcdStorage(StorageService):
                 result[key] = value.decode('utf-8', errors='replace')
         
         return result
+
+    def get_prefix_revisions(self, prefix: str) -> Dict[str, Tuple[Any, int]]:
+        """Get all keys with the given prefix, with the mod revision of each."""
+        return {metadata.key.decode('utf-8'): (self._decode(value), metadata.mod_revision)
+                for value, metadata in self.client.get_prefix(prefix)}
     
     def delete_prefix(self, prefix: str) -> int:
         """Delete all keys with the given prefix. Returns count of deleted keys."""
         result = self.client.delete_prefix(prefix)
         return result.deleted
+
+    def watch_prefix(self, prefix: str, callback: Callable[[WatchEvent], None],
+                     start_revision: Optional[int] = None) -> Any:
+        """Watch a prefix. The callback runs on the etcd3 watcher thread."""
+        import etcd3
+
+        def on_response(response):
+            if isinstance(response, Exception):
+                print(f"Watch on {prefix} failed: {response}")
+                return
+            for event in response.events:
+                key = event.key.decode('utf-8')
+                if isinstance(event, etcd3.events.DeleteEvent):
+                    callback(WatchEvent(WatchEvent.DELETE, key, None, event.mod_revision))
+                else:
+                    callback(WatchEvent(WatchEvent.PUT, key, self._decode(event.value), event.mod_revision))
+
+        kwargs = {}
+        if start_revision is not None:
+            kwargs['start_revision'] = start_revision
+        return self.client.add_watch_prefix_callback(prefix, on_response, **kwargs)
+
+    def cancel_watch(self, watch_id: Any) -> None:
+        """Stop a watch started with watch_prefix."""
+        self.client.cancel_watch(watch_id)
+
+    @staticmethod
+    def _decode(value: bytes) -> Any:
+        """Decode a raw etcd value as JSON, falling back to a string."""
+        try:
+            return json.loads(value.decode('utf-8'))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return value.decode('utf-8', errors='replace')
     
 class TestStorage(StorageService):
     """Test implementation of the StorageService interface using a dictionary."""
 
+    # Watch events kept for start_revision replays; older ones are dropped, like an etcd compaction
+    HISTORY_LIMIT = 10000
+
     def __init__(self, **kwargs):
         self.data = {}
+        self.revision = 0
+        self.mod_revisions: Dict[str, int] = {}
+        self.history: Deque[WatchEvent] = deque(maxlen=self.HISTORY_LIMIT)
+        self.watchers: Dict[int, Tuple[str, Callable[[WatchEvent], None]]] = {}
+        self._next_watch_id = 0
+        # Makes each put_if_revision's compare and write one step
+        self._lock = threading.RLock()
     
     def put(self, key: str, value: Any) -> None:
         """Store a value at the given key."""
         self.data[key] = value
+        self._notify(WatchEvent.PUT, key, value)
     
     def get(self, key: str) -> Optional[Any]:
         """Retrieve a value by key. Returns None if key doesn't exist."""
@@ -112,20 +227,68 @@ class TestStorage(StorageService):
         """Delete a key. Returns True if key existed and was deleted."""
         if key in self.data:
             del self.data[key]
+            self._notify(WatchEvent.DELETE, key, None)
             return True
         return False
+
+    def get_with_revision(self, key: str) -> Tuple[Optional[Any], int]:
+        """Retrieve a value and the revision it was last written at."""
+        with self._lock:
+            return self.data.get(key), self.mod_revisions.get(key, 0)
+
+    def put_if_revision(self, key: str, value: Any, revision: int) -> bool:
+        """Store a value only if the key was last written at `revision` (0: only if it doesn't exist)."""
+        with self._lock:
+            if self.mod_revisions.get(key, 0) != revision:
+                return False
+            self.put(key, value)
+            return True
     
     def get_prefix(self, prefix: str) -> Dict[str, Any]:
         """Get all keys and values with the given prefix."""
         return {k: v for k, v in self.data.items() if k.startswith(prefix)}
+
+    def get_prefix_revisions(self, prefix: str) -> Dict[str, Tuple[Any, int]]:
+        """Get all keys with the given prefix, with the revision each was last written at."""
+        return {k: (v, self.mod_revisions[k]) for k, v in self.data.items() if k.startswith(prefix)}
     
     def delete_prefix(self, prefix: str) -> int:
         """Delete all keys with the given prefix. Returns count of deleted keys."""
         keys = [k for k in self.data.keys() if k.startswith(prefix)]
         for key in keys:
             del self.data[key]
+            self._notify(WatchEvent.DELETE, key, None)
         return len(keys)
 
+    def watch_prefix(self, prefix: str, callback: Callable[[WatchEvent], None],
+                     start_revision: Optional[int] = None) -> Any:
+        """Watch a prefix. Callbacks run synchronously inside put/delete."""
+        self._next_watch_id += 1
+        watch_id = self._next_watch_id
+        if start_revision is not None:
+            for event in list(self.history):
+                if event.revision >= start_revision and event.key.startswith(prefix):
+                    callback(event)
+        self.watchers[watch_id] = (prefix, callback)
+        return watch_id
+
+    def cancel_watch(self, watch_id: Any) -> None:
+        """Stop a watch started with watch_prefix."""
+        self.watchers.pop(watch_id, None)
+
+    def _notify(self, event_type: str, key: str, value: Any) -> None:
+        with self._lock:
+            self.revision += 1
+            if event_type == WatchEvent.PUT:
+                self.mod_revisions[key] = self.revision
+            else:
+                self.mod_revisions.pop(key, None)
+            event = WatchEvent(event_type, key, value, self.revision)
+        self.history.append(event)
+        for prefix, callback in list(self.watchers.values()):
+            if key.startswith(prefix):
+                callback(event)
+
 
 class StorageFactory:
     """Factory class to create storage service instances."""